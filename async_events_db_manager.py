@@ -0,0 +1,159 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import events_db_manager
+
+# Async versions of the events_db_manager functions. Each one runs the sync implementation through
+# AsyncSession.run_sync, so the queries are awaited on the aiosqlite driver instead of blocking a thread,
+# and the query logic is kept in a single place.
+
+
+async def create_event(title: str, description: str, date: datetime, location: str, participants: List[str],
+                       db: AsyncSession = None, recurrence: Optional[str] = None, end: Optional[datetime] = None,
+                       conflicts: Optional[str] = None):
+    """
+    Creates a new event and saves it to the database. See events_db_manager.create_event.
+    """
+    return await db.run_sync(lambda session: events_db_manager.create_event(title, description, date, location,
+                                                                            participants, session, recurrence, end,
+                                                                            conflicts))
+
+
+async def create_events(events: List[dict], db: AsyncSession = None):
+    """
+    Creates many events in a single transaction. See events_db_manager.create_events.
+    """
+    return await db.run_sync(lambda session: events_db_manager.create_events(events, session))
+
+
+async def get_all_events(sort_by: Optional[str] = None, db: AsyncSession = None):
+    """
+    Retrieves a list of all events optionally sorted. See events_db_manager.get_all_events.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_all_events(sort_by, session))
+
+
+async def get_events_page(sort_by: Optional[str] = None, limit: int = events_db_manager.DEFAULT_PAGE_SIZE,
+                          after: Optional[str] = None, fields: Optional[List[str]] = None, db: AsyncSession = None):
+    """
+    Retrieves one page of events using keyset pagination. See events_db_manager.get_events_page.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_events_page(sort_by, limit, after, fields, session))
+
+
+async def get_events_in_range(start: datetime, end: datetime, limit: int = events_db_manager.DEFAULT_PAGE_SIZE,
+                              after: Optional[str] = None, db: AsyncSession = None):
+    """
+    Retrieves one page of the events between two dates. See events_db_manager.get_events_in_range.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_events_in_range(start, end, limit, after, session))
+
+
+async def get_conflicts(start: datetime, end: datetime, location: Optional[str] = None,
+                        participant: Optional[str] = None, limit: int = events_db_manager.DEFAULT_PAGE_SIZE,
+                        db: AsyncSession = None):
+    """
+    Finds the pairs of overlapping events between two dates. See events_db_manager.get_conflicts.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_conflicts(start, end, location, participant, limit,
+                                                                             session))
+
+
+async def get_upcoming_events(limit: int = events_db_manager.DEFAULT_PAGE_SIZE, participant: Optional[str] = None,
+                              db: AsyncSession = None):
+    """
+    Retrieves the next events, optionally only those of one participant. See events_db_manager.get_upcoming_events.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_upcoming_events(limit, participant, session))
+
+
+async def get_changes(since: int = 0, limit: int = events_db_manager.DEFAULT_PAGE_SIZE, db: AsyncSession = None):
+    """
+    Retrieves the changes made after a sequence number. See events_db_manager.get_changes.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_changes(since, limit, session))
+
+
+async def latest_change(db: AsyncSession = None):
+    """
+    Retrieves the sequence number of the last change. See events_db_manager.latest_change.
+    """
+    return await db.run_sync(events_db_manager.latest_change)
+
+
+async def export_events(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        export_format: str = "ndjson", db: AsyncSession = None,
+                        batch_size: int = events_db_manager.EXPORT_BATCH_SIZE):
+    """
+    Streams events as NDJSON or CSV from an async server-side cursor. See events_db_manager.export_events.
+    """
+    header = events_db_manager.format_export_header(export_format)
+    if header:
+        yield header
+    result = await db.stream(events_db_manager.export_events_query(start, end).execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+        emails_by_event = await db.run_sync(
+            lambda session: events_db_manager.get_emails_by_event([row.id for row in rows], session))
+        yield events_db_manager.format_export_batch(rows, emails_by_event, export_format)
+
+
+async def get_event(event_id: int, db: AsyncSession = None):
+    """
+    Retrieves details of a specific event by its ID. See events_db_manager.get_event.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_event(event_id, session))
+
+
+async def get_event_by(filter_by: str, filter_value: str, db: AsyncSession = None,
+                       limit: int = events_db_manager.DEFAULT_PAGE_SIZE):
+    """
+    Retrieves events based on a specific filter. See events_db_manager.get_event_by.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_event_by(filter_by, filter_value, session, limit))
+
+
+async def search_events(title: Optional[str] = None, description: Optional[str] = None,
+                        location: Optional[str] = None, participant: Optional[str] = None,
+                        date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                        limit: int = events_db_manager.DEFAULT_PAGE_SIZE, db: AsyncSession = None):
+    """
+    Retrieves events matching all the given filters. See events_db_manager.search_events.
+    """
+    return await db.run_sync(lambda session: events_db_manager.search_events(
+        title, description, location, participant, date_from, date_to, limit, session))
+
+
+async def update_event(event_id: int, title: Optional[str] = None, description: Optional[str] = None,
+                       date: Optional[datetime] = None, location: Optional[str] = None,
+                       participants: Optional[List[str]] = None, db: AsyncSession = None,
+                       recurrence: Optional[str] = None, end: Optional[datetime] = None,
+                       conflicts: Optional[str] = None):
+    """
+    Updates an existing event by its ID. See events_db_manager.update_event.
+    """
+    return await db.run_sync(
+        lambda session: events_db_manager.update_event(event_id, title, description, date, location, participants,
+                                                       session, recurrence, end, conflicts))
+
+
+async def delete_event(event_id: int, db: AsyncSession = None):
+    """
+    Deletes an event by its ID. See events_db_manager.delete_event.
+    """
+    return await db.run_sync(lambda session: events_db_manager.delete_event(event_id, session))
+
+
+async def cancel_occurrence(event_id: int, occurrence: datetime, db: AsyncSession = None):
+    """
+    Cancels one occurrence of a recurring event. See events_db_manager.cancel_occurrence.
+    """
+    return await db.run_sync(lambda session: events_db_manager.cancel_occurrence(event_id, occurrence, session))
+
+
+async def get_participant_events(email: str, db: AsyncSession = None):
+    """
+    Retrieves the events a participant is invited to. See events_db_manager.get_participant_events.
+    """
+    return await db.run_sync(lambda session: events_db_manager.get_participant_events(email, session))
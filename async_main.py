@@ -0,0 +1,372 @@
+# Async variant of main.py: the same routes, served by async handlers on AsyncSession/aiosqlite.
+# Selected with EVENT_MANAGER_DB_MODE=async, see main.py.
+from fastapi import FastAPI, Body, Header, Path, Query, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from datetime import datetime
+from typing import Annotated, Dict, List, Literal, Optional, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+# Importing local modules
+import async_events_db_manager
+import async_users_db_manager
+import database
+import events_db_manager
+import metrics
+import users_db_manager
+from auth_cache import credential_cache
+from change_feed import MAX_WAIT_SECONDS, STREAM_BATCH_SIZE, change_feed, sse_message, stream_changes
+from rate_limit import AdmissionMiddleware, concurrency_limiter, rate_limiter, retry_after, route_cost
+from response_cache import event_key, events_page_key, render, response_cache, to_response
+from schemas import (BulkCreateOut, ChangeOut, ChangesOut, ConflictsOut, EventMessageOut, EventOut, EventsPageOut,
+                     EventsProjectionOut, MessageOut, UserMessageOut, UserOut)
+from eventScheduler import worker_lifespan
+
+# Database setup
+EVENTS_DATABASE_URL = "sqlite+aiosqlite:///events.db"
+USERS_DATABASE_URL = "sqlite+aiosqlite:///users.db"
+
+# SQLAlchemy async session creation, with the same SQLite profile and reader/writer split as main.py. The engines
+# are created when the first session is opened.
+EventSessionLocal = database.LazyAsyncSessionmaker(EVENTS_DATABASE_URL, autoflush=False, expire_on_commit=False)
+EventReadSessionLocal = database.LazyAsyncSessionmaker(EVENTS_DATABASE_URL, read_only=True, autoflush=False,
+                                                       expire_on_commit=False)
+UsersSessionLocal = database.LazyAsyncSessionmaker(USERS_DATABASE_URL, autoflush=False, expire_on_commit=False)
+UsersReadSessionLocal = database.LazyAsyncSessionmaker(USERS_DATABASE_URL, read_only=True, autoflush=False,
+                                                       expire_on_commit=False)
+
+
+# Function to get events database session
+async def get_events_db():
+    async with EventSessionLocal() as db:
+        yield db
+
+
+# Function to get a read-only events database session
+async def get_events_read_db():
+    async with EventReadSessionLocal() as db:
+        yield db
+
+
+# Function to get users database session
+async def get_users_db():
+    async with UsersSessionLocal() as db:
+        yield db
+
+
+# Function to get a read-only users database session
+async def get_users_read_db():
+    async with UsersReadSessionLocal() as db:
+        yield db
+
+
+# Creating FastAPI app instance
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=worker_lifespan)
+# Per-route latency histograms, and cProfile of single requests sent with the X-Profile header
+app.router.route_class = metrics.InstrumentedRoute
+app.add_middleware(metrics.MetricsMiddleware)
+# Requests past MAX_CONCURRENT_REQUESTS in flight are shed with 429 before any work is done
+app.add_middleware(AdmissionMiddleware, limiter=concurrency_limiter)
+# Initializing HTTPBasic security instance
+security = HTTPBasic()
+
+
+# Function to get current username based on HTTPBasic credentials
+async def get_current_username(credentials: HTTPBasicCredentials = Depends(security),
+                               db: AsyncSession = Depends(get_users_read_db)):
+    with metrics.timed("auth"):
+        user = await async_users_db_manager.get_user_by_username(credentials.username, db)
+        if isinstance(user, users_db_manager.User):
+            # Recently verified credentials skip the slow password hash while the stored hash is unchanged, it may
+            # have been changed by another worker
+            if credential_cache.verify(credentials.username, credentials.password, user.password):
+                return credentials.username
+            # The password hash is CPU bound, keep it off the event loop
+            if await run_in_threadpool(users_db_manager.verify_password, credentials.password, user.password):
+                credential_cache.add(credentials.username, credentials.password, user.password)
+                return credentials.username
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+
+
+# Function to charge the request to the current user's token bucket, by the cost of its route
+async def rate_limited_user(request: Request, username: str = Depends(get_current_username)):
+    wait = rate_limiter.acquire(username, route_cost(request))
+    if wait:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={"Retry-After": retry_after(wait)})
+    return username
+
+
+# Endpoint to create a new user
+@app.post("/users", response_model=UserMessageOut)
+async def create_user(username: str = Body(...),
+                      password: str = Body(...),
+                      email: str = Body(...),
+                      db: AsyncSession = Depends(get_users_db)):
+    return await async_users_db_manager.create_user(username, password, email, db)
+
+
+# Endpoint to retrieve all users
+@app.get("/users", response_model=List[UserOut])
+async def get_all_users(db: AsyncSession = Depends(get_users_read_db)):
+    """Retrieves a list of all users."""
+    return await async_users_db_manager.get_all_users(db)
+
+
+# Endpoint to retrieve a specific user by username
+@app.get("/users/{username}", response_model=Union[UserOut, MessageOut])
+async def get_user(username: str = Path(..., description="username"),
+                   db: AsyncSession = Depends(get_users_read_db)):
+    """Retrieves details of a specific user by username."""
+    return await async_users_db_manager.get_user_by_username(username, db)
+
+
+# Endpoint to create a new event
+@app.post("/events", dependencies=[Depends(rate_limited_user)], response_model=Union[EventMessageOut, MessageOut])
+async def create_event(title: str = Body(...), description: str = Body(...), date: datetime = Body(...),
+                       location: str = Body(...), participants: List[str] = Body(...),
+                       recurrence: Annotated[Optional[str], Body(description="RRULE of a recurring event")] = None,
+                       end: Annotated[Optional[datetime], Body(description="default: date + 1 hour")] = None,
+                       conflicts: Annotated[Optional[Literal["reject", "flag"]],
+                                            Query(description="reject or flag overlapping events")] = None,
+                       db: AsyncSession = Depends(get_events_db)):
+    return await async_events_db_manager.create_event(title, description, date, location, participants, db,
+                                                      recurrence, end, conflicts)
+
+
+# Endpoint to create many events in one transaction
+@app.post("/events/bulk", dependencies=[Depends(rate_limited_user)],
+          response_model=BulkCreateOut, response_model_exclude_none=True)
+async def create_events(events: List[dict] = Body(..., description="events with the fields of POST /events"),
+                        db: AsyncSession = Depends(get_events_db)):
+    """Creates many events at once and returns a per-row result."""
+    return await async_events_db_manager.create_events(events, db)
+
+
+# Endpoint to retrieve events, one page at a time
+@app.get("/events", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[EventsPageOut, EventsProjectionOut])
+async def get_all_events(sort_by: Optional[str] = Query(None),
+                         limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                            le=events_db_manager.MAX_PAGE_SIZE),
+                         after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                         fields: Optional[str] = Query(None, description="comma-separated fields to return"),
+                         if_none_match: Optional[str] = Header(None),
+                         db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves a page of events, optionally sorted, with the cursor of the next page."""
+    fields_list = fields.split(",") if fields else None
+    # Served from the response cache until the next write, the generation is read before querying
+    # Writes of every worker go to the change log, cached responses older than its last entry are dropped
+    response_cache.validate(await async_events_db_manager.latest_change(db))
+    generation = response_cache.generation
+    key = events_page_key(generation, sort_by, limit, after, fields)
+    cached = response_cache.get(key)
+    if cached is None:
+        page = await async_events_db_manager.get_events_page(sort_by, limit, after, fields_list, db)
+        # A projection is rendered as plain dicts, an EventOut would fill in the fields that were not requested
+        page_model = EventsProjectionOut if fields_list else EventsPageOut
+        cached = response_cache.set(key, render(page_model, page), generation)
+    return to_response(cached, if_none_match)
+
+
+# Endpoint to retrieve the events between two dates, one page at a time
+@app.get("/events/range", dependencies=[Depends(rate_limited_user)], response_model=EventsPageOut)
+async def get_events_in_range(start: datetime = Query(..., description="earliest event date, inclusive"),
+                              end: datetime = Query(..., description="latest event date, exclusive"),
+                              limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                                 le=events_db_manager.MAX_PAGE_SIZE),
+                              after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                              db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves a page of the events between start and end, sorted by date."""
+    return await async_events_db_manager.get_events_in_range(start, end, limit, after, db)
+
+
+# Endpoint to find the overlapping events between two dates
+@app.get("/events/conflicts", dependencies=[Depends(rate_limited_user)], response_model=ConflictsOut)
+async def get_conflicts(start: datetime = Query(..., description="start of the range, inclusive"),
+                        end: datetime = Query(..., description="end of the range, exclusive, at most 31 days after"),
+                        location: Optional[str] = Query(None, description="only the events at this location"),
+                        participant: Optional[str] = Query(None, description="only the events of this email"),
+                        limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                           le=events_db_manager.MAX_PAGE_SIZE),
+                        db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves the pairs of overlapping events at the same location or with a participant in common."""
+    return await async_events_db_manager.get_conflicts(start, end, location, participant, limit, db)
+
+
+# Endpoint to retrieve the next events
+@app.get("/events/upcoming", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+async def get_upcoming_events(limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                                 le=events_db_manager.MAX_PAGE_SIZE),
+                              participant: Optional[str] = Query(None, description="only the events of this email"),
+                              db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves the next events from now on, sorted by date."""
+    return await async_events_db_manager.get_upcoming_events(limit, participant, db)
+
+
+async def read_changes(since, limit):
+    # A session per read, so a waiting long poll does not hold a pooled connection
+    async with EventReadSessionLocal() as db:
+        changes = await async_events_db_manager.get_changes(since, limit, db)
+        return render(ChangesOut, changes), not changes["changes"]
+
+
+async def read_change_messages(since):
+    async with EventReadSessionLocal() as db:
+        changes = (await async_events_db_manager.get_changes(since, STREAM_BATCH_SIZE, db))["changes"]
+        return [(change["seq"], sse_message(change["seq"], render(ChangeOut, change))) for change in changes]
+
+
+# Endpoint to retrieve the changes made after a sequence number, optionally waiting for the next one
+@app.get("/events/changes", dependencies=[Depends(rate_limited_user)], response_model=ChangesOut)
+async def get_event_changes(since: int = Query(0, ge=0, description="last_seq of the previous response"),
+                            limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                               le=events_db_manager.MAX_PAGE_SIZE),
+                            wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS,
+                                                description="seconds to wait for a change if there is none yet")):
+    """Retrieves the changes after `since`. With `wait`, an up-to-date client gets the next change as a long poll."""
+    # Subscribed before reading, so a change committed in between still ends the wait
+    subscription = change_feed.subscribe() if wait else None
+    try:
+        body, empty = await read_changes(since, limit)
+        if empty and subscription is not None and await subscription.wait(wait):
+            body, empty = await read_changes(since, limit)
+    finally:
+        if subscription is not None:
+            change_feed.unsubscribe(subscription)
+    return Response(body, media_type="application/json")
+
+
+# Endpoint to stream the changes as Server-Sent Events
+@app.get("/events/changes/stream", dependencies=[Depends(rate_limited_user)], response_class=StreamingResponse)
+async def stream_event_changes(since: int = Query(0, ge=0, description="last_seq already received"),
+                               timeout: Optional[float] = Query(None, ge=0,
+                                                                description="seconds after which the stream ends"),
+                               last_event_id: Optional[int] = Header(None)):
+    """Streams the changes after `since`, the backlog first and then each change as it is made."""
+    # Reconnecting EventSource clients send the ID of the last event they received
+    if last_event_id is not None:
+        since = max(since, last_event_id)
+    return StreamingResponse(stream_changes(read_change_messages, since, timeout), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+# Endpoint to stream events as NDJSON or CSV
+@app.get("/events/export", dependencies=[Depends(rate_limited_user)], response_class=StreamingResponse)
+async def export_events(export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                        start: Optional[datetime] = Query(None, description="earliest event date, inclusive"),
+                        end: Optional[datetime] = Query(None, description="latest event date, exclusive")):
+    """Streams events in date order, with constant memory whatever the number of events."""
+    async def rows():
+        # The session lives as long as the stream, dependencies with yield are closed before streaming starts
+        async with EventReadSessionLocal() as db:
+            async for chunk in async_events_db_manager.export_events(start, end, export_format, db):
+                yield chunk
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type)
+
+
+# Endpoint to retrieve events matching several filters
+@app.get("/events/search", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+async def search_events(title: Optional[str] = Query(None, description="title prefix"),
+                        description: Optional[str] = Query(None, description="description prefix"),
+                        location: Optional[str] = Query(None, description="location prefix"),
+                        participant: Optional[str] = Query(None, description="participant email"),
+                        date_from: Optional[datetime] = Query(None, description="earliest event date, inclusive"),
+                        date_to: Optional[datetime] = Query(None, description="latest event date, exclusive"),
+                        limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                           le=events_db_manager.MAX_PAGE_SIZE),
+                        db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves events matching all the given filters, sorted by date."""
+    return await async_events_db_manager.search_events(title, description, location, participant, date_from, date_to,
+                                                       limit, db)
+
+
+# Endpoint to retrieve a specific event by ID
+@app.get("/events/{event_id}", dependencies=[Depends(rate_limited_user)], response_model=Union[EventOut, MessageOut])
+async def get_event(event_id: int = Path(..., description="ID of the event to retrieve"),
+                    if_none_match: Optional[str] = Header(None),
+                    db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves details of a specific event by its ID."""
+    # Writes of every worker go to the change log, cached responses older than its last entry are dropped
+    response_cache.validate(await async_events_db_manager.latest_change(db))
+    generation = response_cache.generation
+    cached = response_cache.get(event_key(event_id))
+    if cached is None:
+        event = await async_events_db_manager.get_event(event_id, db)
+        cached = response_cache.set(event_key(event_id), render(Union[EventOut, MessageOut], event), generation)
+    return to_response(cached, if_none_match)
+
+
+# Endpoint to retrieve events by filtering
+@app.get("/events/{filter_by}/{filter_value}", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[List[EventOut], MessageOut])
+async def get_event_by_filter(filter_by: str = Path(..., description="key to filter by"),
+                              filter_value: str = Path(..., description="value of key"),
+                              limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                                 le=events_db_manager.MAX_PAGE_SIZE),
+                              db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves details of events based on a specific filter."""
+    return await async_events_db_manager.get_event_by(filter_by, filter_value, db, limit)
+
+
+# Endpoint to update a specific event by ID
+@app.put("/events/{event_id}", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[EventMessageOut, MessageOut])
+async def update_event(event_id: int = Path(..., description="ID of the event to update"),
+                       title: Optional[str] = Body(None),
+                       description: Optional[str] = Body(None),
+                       date: Optional[datetime] = Body(None),
+                       location: Optional[str] = Body(None),
+                       participants: List[str] = Body(None),
+                       recurrence: Annotated[Optional[str], Body(description="RRULE, empty for a single event")] = None,
+                       end: Annotated[Optional[datetime], Body(description="new end of the event")] = None,
+                       conflicts: Annotated[Optional[Literal["reject", "flag"]],
+                                            Query(description="reject or flag overlapping events")] = None,
+                       db: AsyncSession = Depends(get_events_db)):
+    return await async_events_db_manager.update_event(event_id, title, description, date, location, participants,
+                                                      db, recurrence, end, conflicts)
+
+
+# Endpoint to delete a specific event by ID
+@app.delete("/events/{event_id}", dependencies=[Depends(rate_limited_user)], response_model=MessageOut)
+async def delete_event(event_id: int = Path(..., description="ID of the event to delete"),
+                       db: AsyncSession = Depends(get_events_db)):
+    """Deletes an event by its ID."""
+    return await async_events_db_manager.delete_event(event_id, db)
+
+
+# Endpoint to cancel one occurrence of a recurring event
+@app.delete("/events/{event_id}/occurrences/{occurrence}", dependencies=[Depends(rate_limited_user)],
+            response_model=MessageOut)
+async def cancel_occurrence(event_id: int = Path(..., description="ID of the recurring event"),
+                            occurrence: datetime = Path(..., description="date of the occurrence to cancel"),
+                            db: AsyncSession = Depends(get_events_db)):
+    """Cancels one occurrence of a recurring event, the other occurrences are kept."""
+    return await async_events_db_manager.cancel_occurrence(event_id, occurrence, db)
+
+
+# Endpoint to retrieve the events a participant is invited to
+@app.get("/participants/{email}/events", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+async def get_participant_events(email: str = Path(..., description="email of the participant"),
+                                 db: AsyncSession = Depends(get_events_read_db)):
+    """Retrieves the events a participant is invited to, sorted by date."""
+    return await async_events_db_manager.get_participant_events(email, db)
+
+
+# Endpoint to retrieve the counters of the in-process caches and limiters
+@app.get("/metrics/cache", dependencies=[Depends(rate_limited_user)],
+         response_model=Dict[str, Dict[str, Union[int, float]]])
+async def get_cache_metrics():
+    """Retrieves the hit and miss counters of the response and credential caches, and of the rate limiters."""
+    return {"responses": response_cache.stats(), "credentials": credential_cache.stats(),
+            "rate_limit": rate_limiter.stats(), "admission": concurrency_limiter.stats()}
+
+
+# Endpoint to expose the metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Retrieves the request, database, SMTP and scheduler latency histograms."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,31 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+import users_db_manager
+
+# Async versions of the users_db_manager functions, run through AsyncSession.run_sync
+# like the ones in async_events_db_manager.
+
+
+async def create_user(username: str, password: str, email: str, db: AsyncSession = None):
+    """
+    Creates a new user and saves it to the database. See users_db_manager.create_user. The password is hashed in
+    the threadpool, PBKDF2 would otherwise block the event loop, and only the insert runs through run_sync.
+    """
+    password_hash = await run_in_threadpool(users_db_manager.hash_password, password)
+    return await db.run_sync(lambda session: users_db_manager.create_user(username, password, email, session,
+                                                                          password_hash))
+
+
+async def get_all_users(db: AsyncSession = None):
+    """
+    Retrieves a list of all users sorted by username. See users_db_manager.get_all_users.
+    """
+    return await db.run_sync(users_db_manager.get_all_users)
+
+
+async def get_user_by_username(username: str, db: AsyncSession = None):
+    """
+    Retrieves a user by username. See users_db_manager.get_user_by_username.
+    """
+    return await db.run_sync(lambda session: users_db_manager.get_user_by_username(username, session))
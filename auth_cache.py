@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CredentialCache:
+    """
+    TTL/LRU cache of recently verified credentials, keyed on username.
+
+    Only a keyed digest of the password is kept, never the password itself. The digest key is random per process,
+    so cached entries are useless outside of it. A hit lets get_current_username skip the slow password hash
+    verification. Entries also keep the stored hash they were verified against, and only match while it is
+    unchanged, so a password changed by another worker is not accepted from this worker's cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        """
+        Args:
+            maxsize (int): Maximum number of cached usernames, the least recently used one is evicted first.
+            ttl (float): Seconds a verified credential stays valid in the cache.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def verify(self, username, password, password_hash):
+        """
+        Checks credentials against the cache.
+
+        Args:
+            username (str): Username.
+            password (str): Password supplied with the request.
+            password_hash (str): Password hash currently stored for the user.
+
+        Returns:
+            bool: True if these credentials were verified within the TTL against the same stored hash, False if they
+                must be verified again.
+        """
+        digest = self._digest(password)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[2] > time.monotonic() and entry[1] == password_hash \
+                    and hmac.compare_digest(entry[0], digest):
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, username, password, password_hash):
+        """
+        Caches credentials that were just verified against the database.
+
+        Args:
+            username (str): Username.
+            password (str): Verified password.
+            password_hash (str): Stored password hash it was verified against.
+        """
+        digest = self._digest(password)
+        with self._lock:
+            self._entries[username] = (digest, password_hash, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """
+        Drops the cached credentials of a user, used when the user is created or changed.
+
+        Args:
+            username (str): Username.
+        """
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters, hit ratio and number of cached usernames.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+
+# Cache shared by the sync and async apps
+credential_cache = CredentialCache(maxsize=int(os.environ.get("AUTH_CACHE_SIZE", "1024")),
+                                   ttl=float(os.environ.get("AUTH_CACHE_TTL", "300")))
@@ -0,0 +1,63 @@
+"""
+Compares creating events one by one (one commit per event) with events_db_manager.create_events
+(one transaction for the whole batch), on a file database so the fsync cost of each commit is included.
+
+Run from the repository root:
+    python -m benchmarks.bench_bulk_create --events 5000
+"""
+import argparse
+import json
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import events_db_manager
+
+
+def make_rows(events):
+    start = datetime(2030, 1, 1)
+    return [{"title": f"Session {i}", "description": "conference session",
+             "date": start + timedelta(minutes=30 * i), "location": f"Room {i % 10}",
+             "participants": [f"speaker{i}@example.com", f"host{i % 10}@example.com"]}
+            for i in range(events)]
+
+
+def per_event(engine, rows):
+    with Session(engine) as db:
+        for row in rows:
+            events_db_manager.create_event(row["title"], row["description"], row["date"], row["location"],
+                                           row["participants"], db)
+
+
+def bulk(engine, rows):
+    with Session(engine) as db:
+        events_db_manager.create_events(rows, db)
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=5000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.events)
+    results = {}
+    # The scheduler is mocked so only the database path is measured
+    with patch("events_db_manager.eventScheduler"), tempfile.TemporaryDirectory() as directory:
+        for name, create in (("per_event", per_event), ("bulk", bulk)):
+            engine = create_engine(f"sqlite:///{directory}/{name}.db")
+            events_db_manager.Base.metadata.create_all(engine)
+            start = time.perf_counter()
+            create(engine, rows)
+            elapsed = time.perf_counter() - start
+            results[name] = {"events": args.events, "seconds": elapsed, "events_per_second": args.events / elapsed}
+            engine.dispose()
+    results["speedup"] = results["per_event"]["seconds"] / results["bulk"]["seconds"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
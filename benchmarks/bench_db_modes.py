@@ -0,0 +1,150 @@
+"""
+Runs the same load script against the sync app (main.app) and the async app (async_main.app)
+and reports requests/sec and latency percentiles for each.
+
+Run from the repository root:
+    python -m benchmarks.bench_db_modes --events 1000 --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+import async_main
+import database
+import events_db_manager
+import main
+import users_db_manager
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+
+def seed(directory, events):
+    """
+    Creates the events and users databases in `directory` with one user and `events` events.
+    """
+    events_engine = create_engine(f"sqlite:///{directory}/events.db")
+    users_engine = create_engine(f"sqlite:///{directory}/users.db")
+    events_db_manager.Base.metadata.create_all(events_engine)
+    users_db_manager.Base.metadata.create_all(users_engine)
+    with Session(users_engine) as db:
+        db.add(users_db_manager.User(username=USERNAME, password=users_db_manager.hash_password(PASSWORD),
+                                     email="bench@example.com"))
+        db.commit()
+    start = datetime(2030, 1, 1)
+    with Session(events_engine) as db:
+        db.add_all(events_db_manager.Event(
+            title=f"Event {i}", description="benchmark event", date=start + timedelta(hours=i),
+            location=f"Room {i % 20}",
+            participants=[events_db_manager.EventParticipant(email=f"user{i % 100}@example.com")])
+            for i in range(events))
+        db.commit()
+    events_engine.dispose()
+    users_engine.dispose()
+
+
+def use_sync_databases(directory):
+    events_session = sessionmaker(autoflush=False, bind=database.get_engine(f"sqlite:///{directory}/events.db"))
+    users_session = sessionmaker(autoflush=False, bind=database.get_engine(f"sqlite:///{directory}/users.db"))
+
+    def get_events_db():
+        with events_session() as db:
+            yield db
+
+    def get_users_db():
+        with users_session() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_events_db] = get_events_db
+    main.app.dependency_overrides[main.get_users_db] = get_users_db
+    main.app.dependency_overrides[main.get_events_read_db] = get_events_db
+    main.app.dependency_overrides[main.get_users_read_db] = get_users_db
+    return main.app
+
+
+def use_async_databases(directory):
+    events_session = async_sessionmaker(autoflush=False, expire_on_commit=False,
+                                        bind=database.get_async_engine(f"sqlite+aiosqlite:///{directory}/events.db"))
+    users_session = async_sessionmaker(autoflush=False, expire_on_commit=False,
+                                       bind=database.get_async_engine(f"sqlite+aiosqlite:///{directory}/users.db"))
+
+    async def get_events_db():
+        async with events_session() as db:
+            yield db
+
+    async def get_users_db():
+        async with users_session() as db:
+            yield db
+
+    async_main.app.dependency_overrides[async_main.get_events_db] = get_events_db
+    async_main.app.dependency_overrides[async_main.get_users_db] = get_users_db
+    async_main.app.dependency_overrides[async_main.get_events_read_db] = get_events_db
+    async_main.app.dependency_overrides[async_main.get_users_read_db] = get_users_db
+    return async_main.app
+
+
+async def load(app, events, requests, concurrency):
+    """
+    Issues `requests` authenticated reads (by ID, by filter and by participant) from `concurrency` clients.
+    """
+    rng = random.Random(42)
+    paths = [rng.choice((f"/events/{rng.randint(1, events)}",
+                         f"/events/location/Room {rng.randint(0, 19)}",
+                         f"/participants/user{rng.randint(0, 99)}@example.com/events"))
+             for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 auth=(USERNAME, PASSWORD)) as client:
+        async def client_loop(my_paths):
+            nonlocal errors
+            for path in my_paths:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(paths[i::concurrency]) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "requests_per_second": requests / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        seed(directory, args.events)
+        for mode, make_app in (("sync", use_sync_databases), ("async", use_async_databases)):
+            app = make_app(directory)
+            results[mode] = asyncio.run(load(app, args.events, args.requests, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
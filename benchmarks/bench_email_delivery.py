@@ -0,0 +1,73 @@
+"""
+Compares the old per-event SMTP session with the pooled background delivery worker.
+
+Run from the repository root:
+    python -m benchmarks.bench_email_delivery --events 50 --participants 5 --latency 0.005
+"""
+import argparse
+import json
+import smtplib
+import time
+
+from benchmarks.smtp_stub import SMTPStubServer
+from email_delivery import SMTPDeliveryWorker
+
+SENDER = "personaleventmanager@gmail.com"
+
+
+def per_event_session(port, events, participants):
+    """
+    Old behaviour: one connection and login per event, sent inline by the caller.
+    """
+    start = time.perf_counter()
+    for event_id in range(events):
+        with smtplib.SMTP(host="127.0.0.1", port=port) as smtp:
+            smtp.login("bench", "bench")
+            for participant in range(participants):
+                smtp.sendmail(SENDER, f"user{participant}@example.com", f"event {event_id}")
+    elapsed = time.perf_counter() - start
+    return {"caller_blocked_seconds": elapsed, "total_seconds": elapsed}
+
+
+def pooled_worker(port, events, participants, pool_size, batch_size):
+    """
+    New behaviour: the caller only enqueues, pooled connections deliver in the background.
+    """
+    worker = SMTPDeliveryWorker(host="127.0.0.1", port=port, username="bench", password="bench",
+                                use_tls=False, pool_size=pool_size, batch_size=batch_size)
+    worker.start()
+    start = time.perf_counter()
+    for event_id in range(events):
+        for participant in range(participants):
+            worker.enqueue(SENDER, f"user{participant}@example.com", f"event {event_id}")
+    enqueued = time.perf_counter() - start
+    worker.flush()
+    total = time.perf_counter() - start
+    stats = worker.stats()
+    worker.stop()
+    return {"caller_blocked_seconds": enqueued, "total_seconds": total, "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--participants", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.005, help="simulated SMTP reply latency in seconds")
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for name, run in (("per_event_session", lambda port: per_event_session(port, args.events, args.participants)),
+                      ("pooled_worker", lambda port: pooled_worker(port, args.events, args.participants,
+                                                                   args.pool_size, args.batch_size))):
+        server = SMTPStubServer(latency=args.latency).start()
+        results[name] = run(server.port)
+        results[name]["smtp_server"] = dict(server.counters)
+        server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
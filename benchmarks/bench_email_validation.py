@@ -0,0 +1,74 @@
+"""
+Compares the old per-address participant validation with the one-pass normalization stage, with and without the
+LRU cache of checked addresses, on invites of 10k and 100k addresses.
+
+Run from the repository root:
+    python -m benchmarks.bench_email_validation --sizes 10000 100000 --repeat 5
+"""
+import argparse
+import json
+import random
+import re
+import time
+from functools import lru_cache
+
+import events_db_manager
+
+EMAIL_PATTERN = r"^[^@]+@[^@]+\.[^@]+$"
+
+
+def legacy_validation(participants):
+    """
+    Old behaviour: re.match with the pattern string per address, then a separate deduplication pass.
+    """
+    for participant in participants:
+        if not re.match(EMAIL_PATTERN, participant):
+            return None
+    return list(dict.fromkeys(participant.strip() for participant in participants))
+
+
+def invite(size, seed):
+    # Addresses from a pool half the size of the invite, with some padding and capitals, so there are duplicates
+    rng = random.Random(seed)
+    pool = [f"Participant{index}@Example.com" for index in range(max(1, size // 2))]
+    return [rng.choice(("", " ")) + rng.choice(pool) for _ in range(size)]
+
+
+def measure(function, participants, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(participants)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    original = events_db_manager._check_email
+    check_email = getattr(original, "__wrapped__", original)
+    results = []
+    try:
+        for size in args.sizes:
+            participants = invite(size, args.seed)
+            result = {"addresses": size, "legacy_ms": measure(legacy_validation, participants, args.repeat)}
+            events_db_manager._check_email = check_email
+            result["normalized_ms"] = measure(events_db_manager.normalize_participants, participants, args.repeat)
+            # The cache is warm after the first repeat, as for addresses invited again
+            events_db_manager._check_email = lru_cache(maxsize=args.cache_size)(check_email)
+            result["normalized_cached_ms"] = measure(events_db_manager.normalize_participants, participants,
+                                                     args.repeat)
+            results.append(result)
+    finally:
+        events_db_manager._check_email = original
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares weekly standups stored as one event per week with the same standups stored as one recurring event each:
+rows in the events table, reminder jobs the scheduler holds, and the latency of a one-week GET /events/range page
+and of the next upcoming events, at the start and a few years into the series.
+
+Run from the repository root:
+    python -m benchmarks.bench_recurrence --series 100 1000 --weeks 260 --repeat 20
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import events_db_manager
+
+START = datetime(2030, 1, 7, 9)
+RULE = "FREQ=WEEKLY"
+
+
+def fill(engine, series, weeks, recurring):
+    """
+    Inserts `series` standups on different hours of the week, as `weeks` weekly rows each or as one series each.
+    """
+    events_db_manager.Base.metadata.create_all(engine)
+    rows = []
+    for standup in range(series):
+        date = START + timedelta(minutes=standup * 97 % (7 * 24 * 60))
+        if recurring:
+            rows.append({"title": f"Standup {standup}", "date": date, "location": "Room 1", "recurrence": RULE})
+        else:
+            rows += [{"title": f"Standup {standup}", "date": date + timedelta(weeks=week), "location": "Room 1"}
+                     for week in range(weeks)]
+    with engine.begin() as connection:
+        connection.execute(insert(events_db_manager.Event), rows)
+    return len(rows)
+
+
+def measure(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--series", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--weeks", type=int, default=260)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = []
+    for series in args.series:
+        for recurring in (False, True):
+            engine = create_engine("sqlite://")
+            rows = fill(engine, series, args.weeks, recurring)
+            # One job per upcoming event row, one per series whatever its number of occurrences
+            result = {"series": series, "storage": "series" if recurring else "rows", "event_rows": rows,
+                      "reminder_jobs": series if recurring else rows}
+            with Session(engine) as db:
+                for label, week in (("first_week", 0), ("late_week", args.weeks - 1)):
+                    start = START + timedelta(weeks=week)
+                    result[f"range_{label}_ms"] = measure(
+                        lambda: events_db_manager.get_events_in_range(start, start + timedelta(weeks=1), 100, None,
+                                                                      db), args.repeat)
+                    result[f"upcoming_{label}_ms"] = measure(
+                        lambda: events_db_manager.get_upcoming_events(100, None, db, start), args.repeat)
+            engine.dispose()
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares per-event reminders with per-recipient digests at a peak: many events due at once, whose participants
+come from a small pool, so every recipient has several reminders due together.
+
+Run from the repository root:
+    python -m benchmarks.bench_reminder_digest --events 200 --participants 5 --pool 50 --latency 0.005
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+import eventScheduler
+import events_db_manager
+from benchmarks.smtp_stub import SMTPStubServer
+from email_delivery import SMTPDeliveryWorker
+from eventScheduler import EventScheduler
+
+
+def due_events(count, participants, pool, seed):
+    rng = random.Random(seed)
+    start = datetime(2030, 1, 1, 10)
+    return [events_db_manager.Event(
+        id=event_id, title=f"Event {event_id}", description="benchmark event", location="Room 1",
+        date=start + timedelta(minutes=event_id % 30),
+        participants=[events_db_manager.EventParticipant(event_id=event_id, email=f"user{index}@example.com")
+                      for index in rng.sample(range(pool), participants)])
+        for event_id in range(1, count + 1)]
+
+
+def run_reminders(port, events, window, path):
+    """
+    Fires the reminder of every event through EventScheduler.remind, with a fresh reminder ledger. Without a window
+    the dispatcher sends each reminder as it comes due, with one it sends them all once the window is over.
+    """
+    event_scheduler = EventScheduler()
+    # A file database: the delivery threads mark the reminders sent on their own connections
+    engine = create_engine(f"sqlite:///{path}")
+    events_db_manager.Base.metadata.create_all(engine)
+    original = event_scheduler.delivery, event_scheduler.job_store.engine, eventScheduler.REMINDER_DIGEST_SECONDS
+    event_scheduler.delivery = SMTPDeliveryWorker("127.0.0.1", port, use_tls=False)
+    event_scheduler.delivery.start()
+    event_scheduler.job_store.engine = engine
+    eventScheduler.REMINDER_DIGEST_SECONDS = window
+    try:
+        start = time.perf_counter()
+        for event in events:
+            event_scheduler.remind(event)
+            if not window:
+                event_scheduler.send_due_reminders()
+        event_scheduler.send_due_reminders(now=time.time() + window)
+        event_scheduler.delivery.flush()
+        elapsed = time.perf_counter() - start
+        stats = event_scheduler.delivery.stats()
+        event_scheduler.delivery.stop()
+    finally:
+        event_scheduler.delivery, event_scheduler.job_store.engine, eventScheduler.REMINDER_DIGEST_SECONDS = original
+        engine.dispose()
+    return {"seconds": elapsed, "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--participants", type=int, default=5, help="participants per event")
+    parser.add_argument("--pool", type=int, default=50, help="distinct participant emails")
+    parser.add_argument("--latency", type=float, default=0.005, help="simulated SMTP reply latency in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    events = due_events(args.events, args.participants, args.pool, args.seed)
+    results = {}
+    # The digest is sent as if the window was over once all reminders are in, so any window above 0 groups them all
+    for name, window in (("per_event", 0), ("digest", 60)):
+        server = SMTPStubServer(latency=args.latency).start()
+        with tempfile.TemporaryDirectory() as directory:
+            results[name] = run_reminders(server.port, events, window, os.path.join(directory, "events.db"))
+        results[name]["smtp_server"] = dict(server.counters)
+        server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
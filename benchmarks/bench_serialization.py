@@ -0,0 +1,70 @@
+"""
+Compares serializing a list of events the way FastAPI did without response models (jsonable_encoder walking
+the ORM objects, then json.dumps) with the EventOut response model, rendered through orjson like ORJSONResponse
+or straight to JSON by pydantic-core like the response cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialization --events 10000
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import events_db_manager
+from schemas import EventOut
+
+
+def make_events(count):
+    start = datetime(2030, 1, 1)
+    return [events_db_manager.Event(
+        id=i, title=f"Event {i}", description="benchmark event", date=start + timedelta(minutes=30 * i),
+        location=f"Room {i % 20}",
+        participants=[events_db_manager.EventParticipant(event_id=i, email=f"user{(i + j) % 100}@example.com")
+                      for j in range(3)])
+        for i in range(count)]
+
+
+def measure(serialize, events, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = serialize(events)
+        timings.append(time.perf_counter() - start)
+    return {"ms": statistics.median(timings) * 1000, "bytes": len(body)}
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    adapter = TypeAdapter(List[EventOut])
+
+    def jsonable_encoder_json(rows):
+        return json.dumps(jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def response_model_orjson(rows):
+        return orjson.dumps(adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json"))
+
+    def response_model_dump_json(rows):
+        return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+    results = {name: measure(serialize, events, args.repeat)
+               for name, serialize in (("jsonable_encoder", jsonable_encoder_json),
+                                       ("response_model_orjson", response_model_orjson),
+                                       ("response_model_dump_json", response_model_dump_json))}
+    results["speedup"] = results["jsonable_encoder"]["ms"] / results["response_model_orjson"]["ms"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
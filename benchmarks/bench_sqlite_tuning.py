@@ -0,0 +1,96 @@
+"""
+Compares a default SQLite engine with the tuned profile of the database module (WAL, synchronous=NORMAL,
+busy_timeout, page cache and mmap, separate reader engine) under concurrent writers and readers.
+
+Each writer thread inserts events one commit at a time while the reader threads page through them, for a fixed
+duration. Run from the repository root:
+    python -m benchmarks.bench_sqlite_tuning --writers 4 --readers 16 --seconds 10
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import database
+import events_db_manager
+
+
+def engines(profile, url):
+    """
+    Returns the (writer, reader) engines of a profile.
+    """
+    if profile == "tuned":
+        return database.get_engine(url), database.get_engine(url, read_only=True)
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    return engine, engine
+
+
+def run_profile(profile, directory, writers, readers, seconds):
+    url = f"sqlite:///{directory}/{profile}.db"
+    writer_engine, reader_engine = engines(profile, url)
+    events_db_manager.Base.metadata.create_all(writer_engine)
+    counts = {"writes": 0, "reads": 0, "lock_errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def count(name):
+        with lock:
+            counts[name] += 1
+
+    def write_loop(worker):
+        i = 0
+        while time.perf_counter() < deadline:
+            try:
+                with Session(writer_engine) as db:
+                    db.add(events_db_manager.Event(title=f"Event {worker}-{i}", description="benchmark event",
+                                                   date=datetime(2030, 1, 1) + timedelta(minutes=i),
+                                                   location=f"Room {i % 20}"))
+                    db.commit()
+                count("writes")
+            except OperationalError:
+                count("lock_errors")
+            i += 1
+
+    def read_loop(worker):
+        while time.perf_counter() < deadline:
+            try:
+                with Session(reader_engine) as db:
+                    db.execute(select(events_db_manager.Event.id, events_db_manager.Event.title)
+                               .order_by(events_db_manager.Event.date.desc()).limit(100)).all()
+                count("reads")
+            except OperationalError:
+                count("lock_errors")
+
+    threads = [threading.Thread(target=write_loop, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read_loop, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer_engine.dispose()
+    reader_engine.dispose()
+    return {"writes_per_second": counts["writes"] / seconds, "reads_per_second": counts["reads"] / seconds,
+            "lock_errors": counts["lock_errors"]}
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {profile: run_profile(profile, directory, args.writers, args.readers, args.seconds)
+                   for profile in ("default", "tuned")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,105 @@
+"""
+Cold start of a worker: import time of the app measured with `python -X importtime`, and the time until the
+lifespan has started and the first request is answered, each in a fresh interpreter. Also checks that importing
+the models does not load the scheduler, APScheduler or any engine.
+
+Exits with status 1 if the median import or startup time is over its budget, or if a module is loaded where it
+should not be, so it can run in CI. Run from the repository root:
+    python -m benchmarks.bench_startup --runs 5 --import-budget-ms 1500 --startup-budget-ms 2500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that importing the key must not load
+FORBIDDEN_IMPORTS = {"events_db_manager": ("eventScheduler", "apscheduler", "email_delivery", "aiosqlite")}
+# Run in a temporary directory, so the lifespan creates its databases there
+STARTUP_SCRIPT = """
+import asyncio, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+import httpx
+
+async def first_request():
+    async with {module}.app.router.lifespan_context({module}.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app={module}.app), base_url="http://app") as client:
+            (await client.get("/metrics")).raise_for_status()
+        print((imported - start) * 1000, (time.perf_counter() - start) * 1000)
+
+asyncio.run(first_request())
+"""
+
+
+def import_times(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: Cumulative import time in milliseconds of each module loaded, by name.
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPOSITORY,
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def startup_times(module):
+    """
+    Returns:
+        tuple: Milliseconds to import the app, and to get through the lifespan startup and the first request.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {**os.environ, "PYTHONPATH": REPOSITORY}
+        stdout = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(module=module)], cwd=directory,
+                                env=environment, capture_output=True, text=True, check=True).stdout
+    imported, started = stdout.split()
+    return float(imported), float(started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="main", choices=["main", "async_main"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1500)
+    parser.add_argument("--startup-budget-ms", type=float, default=2500)
+    parser.add_argument("--top", type=int, default=10, help="number of local modules listed by import time")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    local_modules = {os.path.splitext(name)[0] for name in os.listdir(REPOSITORY) if name.endswith(".py")}
+    slowest = sorted(((name, statistics.median(run.get(name, 0) for run in runs)) for name in local_modules
+                      if name in runs[0]), key=lambda item: item[1], reverse=True)[:args.top]
+    startups = [startup_times(args.module) for _ in range(args.runs)]
+    result = {
+        "module": args.module,
+        "import_ms": statistics.median(run[args.module] for run in runs),
+        "startup_ms": statistics.median(started for _, started in startups),
+        "local_modules_ms": dict(slowest),
+    }
+
+    failures = []
+    if result["import_ms"] > args.import_budget_ms:
+        failures.append(f"import of {args.module} took {result['import_ms']:.0f} ms, budget {args.import_budget_ms} ms")
+    if result["startup_ms"] > args.startup_budget_ms:
+        failures.append(f"startup took {result['startup_ms']:.0f} ms, budget {args.startup_budget_ms} ms")
+    for module, forbidden in FORBIDDEN_IMPORTS.items():
+        loaded = import_times(module)
+        failures += [f"importing {module} loads {name}" for name in forbidden if name in loaded]
+    result["failures"] = failures
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Measures the latency of rescheduling an event's reminder job as the number of events grows: schedule_reminder,
+which replaces the job by its ID as the outbox dispatcher does for every update, against the previous
+implementation that loaded every event to check that the ID exists before rescheduling.
+
+The events table and the persistent job store are filled directly with N rows each, then the same event is
+rescheduled repeatedly. Run from the repository root:
+    python -m benchmarks.bench_update_reminder --sizes 100 10000 100000 1000000 --legacy-max 100000
+"""
+import argparse
+import json
+import pickle
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.date import DateTrigger
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import events_db_manager
+import eventScheduler
+
+START = datetime(2030, 1, 1)
+BATCH = 50000
+
+
+def fill(engine, job_store, size):
+    """
+    Inserts `size` events and one stored reminder job per event.
+    """
+    events_db_manager.Base.metadata.create_all(engine)
+    job_store.jobs_t.create(engine, checkfirst=True)
+
+    # One real job serves as a template for the pickled state of the others
+    template_scheduler = BackgroundScheduler()
+    template = template_scheduler.add_job(eventScheduler.send_event_reminder, DateTrigger(run_date=START),
+                                          args=[0], id="template")
+    template_scheduler.start(paused=True)
+    state = template.__getstate__()
+    template_scheduler.shutdown(wait=False)
+
+    with engine.begin() as connection:
+        for offset in range(0, size, BATCH):
+            events, jobs = [], []
+            for event_id in range(offset + 1, min(offset + BATCH, size) + 1):
+                date = START + timedelta(minutes=event_id)
+                events.append({"id": event_id, "title": f"Event {event_id}", "date": date, "location": "Room 1"})
+                trigger = DateTrigger(run_date=date - timedelta(minutes=eventScheduler.REMINDER_MINUTES_BEFORE))
+                run_date = trigger.run_date
+                state.update(id=eventScheduler.EventScheduler.job_id(event_id), args=(event_id,),
+                             trigger=trigger, next_run_time=run_date)
+                jobs.append({"id": state["id"], "next_run_time": run_date.timestamp(),
+                             "job_state": pickle.dumps(state, pickle.HIGHEST_PROTOCOL)})
+            connection.execute(insert(events_db_manager.Event), events)
+            connection.execute(job_store.jobs_t.insert(), jobs)
+
+
+def legacy_update_reminder(event_scheduler, event_id, updated_event, db):
+    """
+    The previous implementation: a full ordered read of the events table before rescheduling.
+    """
+    for existing_event in events_db_manager.get_all_events("date", db):
+        if existing_event.id == event_id:
+            event_scheduler.remove_job(event_id)
+            event_scheduler.schedule_reminder(updated_event)
+            break
+
+
+def measure(update, repeat):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        update(i)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=100000, help="largest size measured for the old path")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    event_scheduler = eventScheduler.EventScheduler()
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{directory}/events.db")
+            job_store = SQLAlchemyJobStore(engine=engine)
+            fill(engine, job_store, size)
+            event_scheduler.job_store = job_store
+            event_scheduler.scheduler = BackgroundScheduler(jobstores={"default": job_store})
+            event_scheduler.scheduler.start(paused=True)
+
+            event_id = size // 2
+
+            event = MagicMock(id=event_id, recurrence=None)
+
+            def keyed(i):
+                event.date = START + timedelta(days=1, minutes=i)
+                event_scheduler.schedule_reminder(event)
+
+            result = {"events": size, "schedule_reminder_ms": measure(keyed, args.repeat)}
+            if size <= args.legacy_max:
+                with Session(engine) as db:
+                    def legacy(i):
+                        event.date = START + timedelta(days=2, minutes=i)
+                        legacy_update_reminder(event_scheduler, event_id, event, db)
+                        db.expunge_all()
+
+                    result["legacy_update_reminder_ms"] = measure(legacy, max(1, args.repeat // 10))
+            results.append(result)
+            event_scheduler.scheduler.shutdown(wait=False)
+            engine.dispose()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,128 @@
+"""
+Seeded data generators for the benchmarks: events, participants and users written straight to the events
+and users databases with batched inserts, fast enough for 1M events.
+
+The same seed always produces the same databases, so runs on different commits are comparable. Run from the
+repository root to create databases to inspect or to reuse:
+    python -m benchmarks.datagen --scale 100k --directory /tmp/bench
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+import database
+import events_db_manager
+import users_db_manager
+
+# Number of events of each --scale preset
+SCALES = {"1k": 1000, "100k": 100000, "1M": 1000000}
+START = datetime(2030, 1, 1)
+LOCATIONS = 20
+PARTICIPANT_POOL = 1000
+BATCH_SIZE = 50000
+# Every RECURRING_EVERY-th event is a weekly series instead of a single event
+RECURRING_EVERY = 100
+RECURRENCE = "FREQ=WEEKLY"
+# Events last an hour, so each one overlaps the next and the previous one
+EVENT_DURATION = timedelta(hours=1)
+PASSWORD = "bench"
+
+
+def username(index):
+    return f"user{index}"
+
+
+def participant_email(index):
+    return f"user{index}@example.com"
+
+
+def event_rows(count, participants_per_event, seed):
+    """
+    Yields (event, participant emails) pairs with IDs from 1 to count, one event lasting EVENT_DURATION every
+    30 minutes, with a weekly series every RECURRING_EVERY events.
+    """
+    rng = random.Random(seed)
+    for event_id in range(1, count + 1):
+        date = START + timedelta(minutes=30 * event_id)
+        event = {"id": event_id, "title": f"Event {event_id}", "description": f"benchmark event {event_id}",
+                 "date": date, "end": date + EVENT_DURATION, "location": f"Room {event_id % LOCATIONS}",
+                 "recurrence": RECURRENCE if event_id % RECURRING_EVERY == 0 else None}
+        emails = {participant_email(rng.randrange(PARTICIPANT_POOL)) for _ in range(participants_per_event)}
+        yield event, sorted(emails)
+
+
+def seed_events(engine, count, participants_per_event=3, seed=42):
+    """
+    Creates the events schema and inserts `count` events with their participants.
+
+    Returns:
+        int: Number of participant rows inserted.
+    """
+    events_db_manager.Base.metadata.create_all(engine)
+    participants = 0
+    events, participant_rows = [], []
+    with engine.begin() as connection:
+        for event, emails in event_rows(count, participants_per_event, seed):
+            events.append(event)
+            participant_rows.extend({"event_id": event["id"], "email": email} for email in emails)
+            if len(events) == BATCH_SIZE:
+                connection.execute(insert(events_db_manager.Event), events)
+                connection.execute(insert(events_db_manager.EventParticipant), participant_rows)
+                participants += len(participant_rows)
+                events, participant_rows = [], []
+        if events:
+            connection.execute(insert(events_db_manager.Event), events)
+            if participant_rows:
+                connection.execute(insert(events_db_manager.EventParticipant), participant_rows)
+            participants += len(participant_rows)
+    return participants
+
+
+def seed_users(engine, count):
+    """
+    Creates the users schema and inserts `count` users, all with the password PASSWORD.
+    The password is hashed once and the hash is shared, hashing it per user would take minutes at 100k users.
+    """
+    users_db_manager.Base.metadata.create_all(engine)
+    password_hash = users_db_manager.hash_password(PASSWORD)
+    with engine.begin() as connection:
+        for offset in range(0, count, BATCH_SIZE):
+            connection.execute(insert(users_db_manager.User), [
+                {"id": index + 1, "username": username(index), "password": password_hash,
+                 "email": participant_email(index)}
+                for index in range(offset, min(offset + BATCH_SIZE, count))])
+
+
+def seed(directory, events, users, participants_per_event=3, seed=42):
+    """
+    Creates events.db and users.db in `directory`.
+
+    Returns:
+        dict: Row counts and the seconds taken.
+    """
+    start = time.perf_counter()
+    events_engine = database.get_engine(f"sqlite:///{directory}/events.db")
+    users_engine = database.get_engine(f"sqlite:///{directory}/users.db")
+    participants = seed_events(events_engine, events, participants_per_event, seed)
+    seed_users(users_engine, users)
+    return {"events": events, "participants": participants, "users": users,
+            "seconds": time.perf_counter() - start}
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--participants", type=int, default=3, help="participants per event")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--directory", required=True)
+    args = parser.parse_args()
+    print(json.dumps(seed(args.directory, SCALES[args.scale], args.users, args.participants, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,283 @@
+"""
+Load test of every route of main.app, in process over httpx's ASGI transport, on seeded databases and with
+reminder emails delivered to the local SMTP stub. Reports throughput and p50/p95/p99 latency per route as JSON.
+
+Run from the repository root:
+    python -m benchmarks.load_test --scale 100k --requests 500 --concurrency 20 --output before.json
+and after a change, to list the routes that got slower than the threshold (exits with status 1 if any):
+    python -m benchmarks.load_test --scale 100k --requests 500 --concurrency 20 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import httpx
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from fastapi.routing import APIRoute
+from sqlalchemy.orm import sessionmaker
+
+import database
+import main
+from benchmarks import datagen
+from benchmarks.smtp_stub import SMTPStubServer
+from email_delivery import SMTPDeliveryWorker
+from eventScheduler import EventScheduler
+from rate_limit import concurrency_limiter, rate_limiter
+from response_cache import response_cache
+
+# One benchmarked route: `request(rng, state)` returns the path and the httpx.request keyword arguments
+Scenario = namedtuple("Scenario", ["method", "route", "request"])
+BENCH_USER = datagen.username(0)
+
+
+def event_body(rng, title):
+    date = datagen.START + timedelta(minutes=rng.randrange(1000000))
+    return {"title": title, "description": "load test event", "date": date.isoformat(),
+            "location": f"Room {rng.randrange(datagen.LOCATIONS)}",
+            "participants": [datagen.participant_email(rng.randrange(datagen.PARTICIPANT_POOL)) for _ in range(3)]}
+
+
+def random_event_id(rng, state):
+    return rng.randint(1, state["events"])
+
+
+def export_window(rng, state):
+    # One day of seeded events, there are 48 per day
+    start = datagen.START + timedelta(days=rng.randrange(max(1, state["events"] // 48)))
+    return {"start": start.isoformat(), "end": (start + timedelta(days=1)).isoformat()}
+
+
+def next_deleted_id(state):
+    # Deletes walk down from the last seeded event, so each request deletes an existing event
+    state["deleted"] += 1
+    return state["events"] - state["deleted"] + 1
+
+
+def random_occurrence(rng, state):
+    # A weekly series from the first half of the seeded events, the deletes start from the last ones
+    event_id = datagen.RECURRING_EVERY * rng.randint(1, max(1, state["events"] // (2 * datagen.RECURRING_EVERY)))
+    date = datagen.START + timedelta(minutes=30 * event_id, weeks=rng.randrange(52))
+    return event_id, date.isoformat()
+
+
+def next_username(state):
+    state["new_users"] += 1
+    return f"loadtest{state['new_users']}"
+
+
+SCENARIOS = [
+    Scenario("POST", "/users", lambda rng, state: (
+        "/users", {"json": {"username": next_username(state), "password": "secret", "email": "new@example.com"}})),
+    Scenario("GET", "/users", lambda rng, state: ("/users", {})),
+    Scenario("GET", "/users/{username}", lambda rng, state: (
+        f"/users/{datagen.username(rng.randrange(state['users']))}", {})),
+    Scenario("POST", "/events", lambda rng, state: ("/events", {"json": event_body(rng, "Load test event")})),
+    Scenario("POST", "/events/bulk", lambda rng, state: (
+        "/events/bulk", {"json": [event_body(rng, f"Bulk event {i}") for i in range(100)]})),
+    Scenario("GET", "/events", lambda rng, state: (
+        "/events", {"params": {"sort_by": rng.choice(("date", "location")), "limit": 100}})),
+    Scenario("GET", "/events/range", lambda rng, state: ("/events/range", {"params": export_window(rng, state)})),
+    Scenario("GET", "/events/conflicts", lambda rng, state: (
+        "/events/conflicts", {"params": export_window(rng, state)})),
+    Scenario("GET", "/events/upcoming", lambda rng, state: ("/events/upcoming", {"params": {
+        "limit": 20, "participant": datagen.participant_email(rng.randrange(datagen.PARTICIPANT_POOL))}})),
+    Scenario("GET", "/events/changes", lambda rng, state: ("/events/changes", {"params": {
+        "since": rng.randrange(state["events"]), "limit": 100}})),
+    # Past the last change and with no timeout, so the stream ends after its first read
+    Scenario("GET", "/events/changes/stream", lambda rng, state: ("/events/changes/stream", {"params": {
+        "since": 10 ** 9, "timeout": 0}})),
+    Scenario("GET", "/events/export", lambda rng, state: ("/events/export", {"params": export_window(rng, state)})),
+    Scenario("GET", "/events/search", lambda rng, state: ("/events/search", {"params": {
+        "title": f"Event {rng.randint(1, 99)}", "location": "Room", "limit": 50}})),
+    Scenario("GET", "/events/{event_id}", lambda rng, state: (f"/events/{random_event_id(rng, state)}", {})),
+    Scenario("GET", "/events/{filter_by}/{filter_value}", lambda rng, state: (
+        f"/events/location/Room {rng.randrange(datagen.LOCATIONS)}", {"params": {"limit": 50}})),
+    Scenario("PUT", "/events/{event_id}", lambda rng, state: (
+        f"/events/{random_event_id(rng, state)}", {"json": {"title": "Updated event"}})),
+    Scenario("DELETE", "/events/{event_id}", lambda rng, state: (f"/events/{next_deleted_id(state)}", {})),
+    Scenario("DELETE", "/events/{event_id}/occurrences/{occurrence}", lambda rng, state: (
+        "/events/{}/occurrences/{}".format(*random_occurrence(rng, state)), {})),
+    Scenario("GET", "/participants/{email}/events", lambda rng, state: (
+        f"/participants/{datagen.participant_email(rng.randrange(datagen.PARTICIPANT_POOL))}/events", {})),
+    Scenario("GET", "/metrics/cache", lambda rng, state: ("/metrics/cache", {})),
+    Scenario("GET", "/metrics", lambda rng, state: ("/metrics", {})),
+]
+
+
+def uncovered_routes(app):
+    """
+    Returns the routes of the app that have no scenario, so new endpoints are not silently left out.
+    """
+    covered = {(scenario.method, scenario.route) for scenario in SCENARIOS}
+    return sorted(f"{method} {route.path}" for route in app.routes if isinstance(route, APIRoute)
+                  for method in route.methods if (method, route.path) not in covered)
+
+
+def use_databases(directory):
+    """
+    Points main.app at the databases in `directory`, with the same engines and pools as in production.
+
+    Returns:
+        list: The engines, to dispose of at the end.
+    """
+    sessions = {}
+    for name, read_only in (("events", False), ("events_read", True), ("users", False), ("users_read", True)):
+        engine = database.get_engine(f"sqlite:///{directory}/{name.split('_')[0]}.db", read_only=read_only)
+        sessions[name] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def dependency(name):
+        def get_db():
+            with sessions[name]() as db:
+                yield db
+        return get_db
+
+    for name, original in (("events", main.get_events_db), ("events_read", main.get_events_read_db),
+                           ("users", main.get_users_db), ("users_read", main.get_users_read_db)):
+        main.app.dependency_overrides[original] = dependency(name)
+    # The export stream opens its own session
+    main.EventReadSessionLocal = sessions["events_read"]
+    return [session.kw["bind"] for session in sessions.values()]
+
+
+def use_scheduler(directory, smtp_port):
+    """
+    Keeps reminder jobs in the benchmark database and sends emails to the SMTP stub. The scheduler takes the lease
+    and drains the outbox as in production, but does not rehydrate the seeded events. Their reminders are due
+    from 2030, so no job fires during the run.
+    """
+    event_scheduler = EventScheduler()
+    event_scheduler.job_store = SQLAlchemyJobStore(engine=database.get_engine(f"sqlite:///{directory}/events.db"))
+    event_scheduler.scheduler = BackgroundScheduler(jobstores={"default": event_scheduler.job_store})
+    event_scheduler.delivery = SMTPDeliveryWorker("127.0.0.1", smtp_port, use_tls=False)
+    event_scheduler.rehydrate = lambda db: 0
+    event_scheduler.start_leader_election()
+    return event_scheduler
+
+
+def summarize(latencies, errors, elapsed):
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+async def load(client, scenario, state, requests, concurrency, seed, warmup):
+    """
+    Issues `requests` requests of one scenario from `concurrency` clients, after `warmup` unmeasured ones.
+    """
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        path, kwargs = scenario.request(rng, state)
+        await client.request(scenario.method, path, **kwargs)
+    response_cache.clear()
+    calls = [scenario.request(rng, state) for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    async def client_loop(my_calls):
+        nonlocal errors
+        for path, kwargs in my_calls:
+            start = time.perf_counter()
+            response = await client.request(scenario.method, path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(calls[i::concurrency]) for i in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_scenarios(scenarios, state, requests, concurrency, seed, warmup):
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench",
+                                 auth=(BENCH_USER, datagen.PASSWORD), timeout=None) as client:
+        for scenario in scenarios:
+            # Creating users hashes a password per request, a tenth of the requests is enough
+            count = max(1, requests // 10) if scenario.route == "/users" and scenario.method == "POST" else requests
+            results[f"{scenario.method} {scenario.route}"] = await load(client, scenario, state, count, concurrency,
+                                                                        seed, warmup)
+    return results
+
+
+def compare(baseline, results, threshold):
+    """
+    Returns the routes whose p95 latency grew or whose throughput dropped by more than `threshold`.
+    """
+    regressions = {}
+    for route, result in results.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        p95_change = result["p95_ms"] / before["p95_ms"] - 1
+        throughput_change = result["requests_per_second"] / before["requests_per_second"] - 1
+        if p95_change > threshold or throughput_change < -threshold:
+            regressions[route] = {"p95_change": p95_change, "throughput_change": throughput_change}
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=datagen.SCALES, default="1k", help="number of seeded events")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per route")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--routes", nargs="+", help="only these routes, e.g. 'GET /events'")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the per-user rate limit on, every request is sent by the same user")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.routes or f"{scenario.method} {scenario.route}" in args.routes]
+    report = {"scale": args.scale, "users": args.users, "requests": args.requests, "concurrency": args.concurrency,
+              "uncovered_routes": uncovered_routes(main.app)}
+    if not args.rate_limit:
+        rate_limiter.rate = 0
+    stub = SMTPStubServer()
+    stub.start()
+    with tempfile.TemporaryDirectory() as directory:
+        report["seed"] = datagen.seed(directory, datagen.SCALES[args.scale], args.users, seed=args.seed)
+        engines = use_databases(directory)
+        event_scheduler = use_scheduler(directory, stub.port)
+        state = {"events": datagen.SCALES[args.scale], "users": args.users, "deleted": 0, "new_users": 0}
+        report["routes"] = asyncio.run(run_scenarios(scenarios, state, args.requests, args.concurrency, args.seed,
+                                                      args.warmup))
+        event_scheduler.stop_leader_election()
+        for engine in engines:
+            engine.dispose()
+    report["emails_delivered"] = stub.counters["messages"]
+    report["limits"] = {"rate_limit": rate_limiter.stats(), "admission": concurrency_limiter.stats()}
+    stub.stop()
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["routes"]
+        report["regressions"] = compare(baseline, report["routes"], args.threshold)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
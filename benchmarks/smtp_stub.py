@@ -0,0 +1,95 @@
+import socketserver
+import threading
+import time
+
+
+class _SMTPStubHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP and QUIT.
+    """
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.count("connections")
+        self.reply("220 smtp-stub ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-smtp-stub\r\n")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                self.server.count("logins")
+                self.reply("235 Authentication successful")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.count("messages")
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("250 OK")
+
+
+class SMTPStubServer(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for an SMTP server, used to benchmark and test email delivery without a network.
+
+    Every reply can be delayed by `latency` seconds to simulate the round-trip time of a real
+    mail provider. The server counts connections, logins and accepted messages.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), _SMTPStubHandler)
+        self.latency = latency
+        self.counters = {"connections": 0, "logins": 0, "messages": 0}
+        self._counters_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def start(self):
+        """
+        Serves in a background thread and returns the server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local SMTP stub server")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to delay every reply")
+    args = parser.parse_args()
+
+    server = SMTPStubServer(port=args.port, latency=args.latency)
+    print(f"SMTP stub listening on 127.0.0.1:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
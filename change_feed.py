@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+# An open stream sends a comment line after this many idle seconds, so proxies keep the connection open. It also
+# queries the change log then, which picks up the changes made by other worker processes.
+HEARTBEAT_SECONDS = 15
+# Maximum number of changes read per query by a stream
+STREAM_BATCH_SIZE = 500
+# Longest wait of a GET /events/changes long poll
+MAX_WAIT_SECONDS = 30
+
+
+class Subscription:
+    """
+    Wake-up signal of one waiting client, set by ChangeFeed.publish from any thread.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout):
+        """
+        Waits for the next publish.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            bool: True if something was published, False on timeout.
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+class ChangeFeed:
+    """
+    In-process pub/sub of the change log. Writers publish after their commit, and waiting clients then read the new
+    changes from the event_changes table. Nothing is sent through the feed itself, so a client that missed a publish
+    loses nothing, and an idle client is only an asyncio.Event.
+
+    The feed is per process: with several workers, a client is woken up by the writes of its own worker, and sees
+    the others' at its next heartbeat.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """
+        Returns:
+            Subscription: A new subscription, on the running event loop. Unsubscribe it when the client is gone.
+        """
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self):
+        """
+        Wakes up every subscriber. Called by the writers after their commit, from any thread.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.event.set)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(subscription)
+
+    def subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def sse_message(seq, data):
+    """
+    Returns a change as a Server-Sent Event, with its sequence number as ID so clients resume from it.
+
+    Args:
+        seq (int): Sequence number of the change.
+        data (bytes): JSON body of the change.
+    """
+    return b"id: %d\nevent: change\ndata: %s\n\n" % (seq, data)
+
+
+async def stream_changes(read_messages, since, timeout=None):
+    """
+    Server-Sent Events stream of the changes after `since`: the backlog first, then each change as it is published.
+
+    Args:
+        read_messages: Async callable taking a sequence number and returning the next changes after it as
+            (seq, message) pairs, at most STREAM_BATCH_SIZE of them.
+        since (int): Sequence number of the last change the client has.
+        timeout (float): Seconds after which the stream ends, None to stream until the client disconnects.
+
+    Yields:
+        bytes: Server-Sent Events.
+    """
+    subscription = change_feed.subscribe()
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    try:
+        while True:
+            # Subscribed before reading, so a change committed meanwhile still wakes the stream up
+            messages = await read_messages(since)
+            for seq, message in messages:
+                since = seq
+                yield message
+            if len(messages) == STREAM_BATCH_SIZE:
+                continue
+            wait = HEARTBEAT_SECONDS if deadline is None else min(HEARTBEAT_SECONDS, deadline - loop.time())
+            if wait <= 0:
+                return
+            if not await subscription.wait(wait):
+                yield b": keep-alive\n\n"
+    finally:
+        change_feed.unsubscribe(subscription)
+
+
+# Feed shared by the sync and async apps
+change_feed = ChangeFeed()
@@ -0,0 +1,166 @@
+import os
+import threading
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import metrics
+
+# Production profile applied to every SQLite connection
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",  # with WAL, fsync only at checkpoints, still safe against application crashes
+    "busy_timeout": 5000,  # wait up to 5 s for a lock instead of failing with "database is locked"
+    "cache_size": -64000,  # 64 MB page cache per connection
+    "mmap_size": 268435456,  # read pages through a 256 MB memory map
+    "temp_store": "MEMORY",
+}
+# Set on writer connections only, WAL is persistent in the database file
+WRITER_PRAGMAS = {
+    "journal_mode": "WAL",  # readers and the writer no longer block each other
+}
+# Set on reader connections only
+READER_PRAGMAS = {
+    "query_only": "ON",
+}
+
+# Pool sizes of the writer and reader engines of each database
+WRITER_POOL_SIZE = 5
+READER_POOL_SIZE = 20
+
+_engines = {}
+_async_engines = {}
+# Engines are created on first use, possibly by several threads at once
+_engines_lock = threading.Lock()
+
+
+def _pragmas_listener(read_only):
+    """
+    Returns a connect-event listener that applies the SQLite profile to each new DBAPI connection.
+    """
+    pragmas = {**SQLITE_PRAGMAS, **(READER_PRAGMAS if read_only else WRITER_PRAGMAS)}
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return apply_pragmas
+
+
+def _database_name(url):
+    """
+    Returns the label of a database in the query metrics, the file name without extension, e.g. "events".
+    """
+    database = make_url(url).database
+    return os.path.splitext(os.path.basename(database))[0] if database else "memory"
+
+
+def get_engine(url, read_only=False):
+    """
+    Returns the shared engine of a SQLite database, creating it on first use.
+    Every module asking for the same database gets the same engine, and so the same connection pool.
+
+    Args:
+        url (str): Database URL, e.g. "sqlite:///events.db".
+        read_only (bool): True for the reader engine, whose connections are query_only and pooled separately
+            from the writer's.
+
+    Returns:
+        Engine: The engine.
+    """
+    key = (url, read_only)
+    with _engines_lock:
+        if key not in _engines:
+            engine = create_engine(url, pool_size=READER_POOL_SIZE if read_only else WRITER_POOL_SIZE,
+                                   connect_args={"check_same_thread": False})
+            event.listen(engine, "connect", _pragmas_listener(read_only))
+            metrics.instrument_engine(engine, _database_name(url))
+            _engines[key] = engine
+        return _engines[key]
+
+
+def get_async_engine(url, read_only=False):
+    """
+    Returns the shared async engine of a SQLite database, creating it on first use. See get_engine.
+
+    Args:
+        url (str): Database URL, e.g. "sqlite+aiosqlite:///events.db".
+        read_only (bool): True for the reader engine.
+
+    Returns:
+        AsyncEngine: The engine.
+    """
+    key = (url, read_only)
+    with _engines_lock:
+        if key not in _async_engines:
+            # aiosqlite defaults to NullPool, which would open a connection and replay the pragmas on every checkout
+            engine = create_async_engine(url, poolclass=AsyncAdaptedQueuePool,
+                                         pool_size=READER_POOL_SIZE if read_only else WRITER_POOL_SIZE)
+            event.listen(engine.sync_engine, "connect", _pragmas_listener(read_only))
+            metrics.instrument_engine(engine.sync_engine, _database_name(url))
+            _async_engines[key] = engine
+        return _async_engines[key]
+
+
+async def dispose_engines():
+    """
+    Closes the pooled connections of every engine, at shutdown. The engines stay usable and reconnect on demand.
+    """
+    with _engines_lock:
+        engines, async_engines = list(_engines.values()), list(_async_engines.values())
+    for engine in engines:
+        engine.dispose()
+    for engine in async_engines:
+        await engine.dispose()
+
+
+class LazySessionmaker(sessionmaker):
+    """
+    sessionmaker of a database whose engine is created by get_engine when the first session is opened, so
+    importing a module that declares one builds no engine. It can still be replaced or bound to another engine with
+    configure(bind=...), e.g. in tests.
+    """
+
+    def __init__(self, url, read_only=False, **kw):
+        """
+        Args:
+            url (str): Database URL, e.g. "sqlite:///events.db".
+            read_only (bool): True for a session on the reader engine.
+            **kw: Arguments of sessionmaker.
+        """
+        super().__init__(**kw)
+        self.url = url
+        self.read_only = read_only
+
+    @property
+    def engine(self):
+        return self.kw.get("bind") or get_engine(self.url, self.read_only)
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self.engine)
+        return super().__call__(**local_kw)
+
+
+class LazyAsyncSessionmaker(async_sessionmaker):
+    """
+    async_sessionmaker whose engine is created by get_async_engine when the first session is opened.
+    See LazySessionmaker.
+    """
+
+    def __init__(self, url, read_only=False, **kw):
+        super().__init__(**kw)
+        self.url = url
+        self.read_only = read_only
+
+    @property
+    def engine(self):
+        return self.kw.get("bind") or get_async_engine(self.url, self.read_only)
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self.engine)
+        return super().__call__(**local_kw)
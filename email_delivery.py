@@ -0,0 +1,282 @@
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+
+# A single email waiting for delivery. on_done, if set, is called with None once it is sent, or with the error
+OutgoingEmail = namedtuple("OutgoingEmail", ["sender", "recipient", "message", "on_done"], defaults=(None,))
+
+# Marker put on the queue to stop a delivery thread
+_STOP = object()
+
+
+class SMTPDeliveryWorker:
+    """
+    Background delivery subsystem for reminder emails.
+
+    Emails are put on a bounded queue and delivered by a fixed pool of threads. Each thread
+    keeps one authenticated SMTP connection open and reuses it for every batch it sends,
+    so request handlers only pay for a queue put.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, pool_size=2,
+                 queue_size=10000, batch_size=50, idle_timeout=30.0, connect_timeout=10.0):
+        """
+        Initializes the worker. Delivery threads are started by start().
+
+        Args:
+            host (str): SMTP server host.
+            port (int): SMTP server port.
+            username (str): Login username, or None to skip authentication.
+            password (str): Login password.
+            use_tls (bool): Whether to upgrade connections with STARTTLS.
+            pool_size (int): Number of delivery threads, one SMTP connection each.
+            queue_size (int): Maximum number of emails waiting for delivery.
+            batch_size (int): Maximum number of emails sent per connection before checking the queue again.
+            idle_timeout (float): Seconds without work after which a connection is closed.
+            connect_timeout (float): Socket timeout for SMTP connections.
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._sent = 0
+        self._failed = 0
+        self._dropped = 0
+        self._connections = 0
+
+    def start(self):
+        """
+        Starts the delivery threads if they are not running yet.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.monotonic()
+            for i in range(self.pool_size):
+                thread = threading.Thread(target=self._run, name=f"smtp-delivery-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Delivers the emails already queued, then stops the delivery threads.
+
+        Args:
+            timeout (float): Maximum seconds to wait for each thread.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def enqueue(self, sender, recipient, message, on_done=None):
+        """
+        Queues an email for background delivery without blocking.
+
+        Args:
+            sender (str): Sender address.
+            recipient (str): Recipient address.
+            message (str): Message body.
+            on_done (callable): Called on the delivery thread with None once the email is sent, or with the error
+                message if it failed. It is not called for a dropped email.
+
+        Returns:
+            bool: True if the email was queued, False if the queue is full and the email was dropped.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(OutgoingEmail(sender, recipient, message, on_done))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """
+        Blocks until every queued email has been delivered or has failed.
+        """
+        self._queue.join()
+
+    def stats(self):
+        """
+        Returns delivery counters.
+
+        Returns:
+            dict: Queue depth, sent/failed/dropped counts, opened connections and throughput in emails per second.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            return {
+                "queue_depth": self._queue.qsize(),
+                "sent": self._sent,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "connections": self._connections,
+                "throughput": self._sent / elapsed if elapsed else 0.0,
+            }
+
+    def metric_samples(self):
+        """
+        Returns:
+            list: Queue depth and delivery counters as (name, type, documentation, value) samples, see
+                metrics.register_collector.
+        """
+        stats = self.stats()
+        return [
+            ("eventmanager_smtp_queue_depth", "gauge", "Emails waiting for delivery.", stats["queue_depth"]),
+            ("eventmanager_smtp_sent_total", "counter", "Emails delivered.", stats["sent"]),
+            ("eventmanager_smtp_failed_total", "counter", "Emails the SMTP server refused or that could not be sent.",
+             stats["failed"]),
+            ("eventmanager_smtp_dropped_total", "counter", "Emails dropped because the queue was full.",
+             stats["dropped"]),
+        ]
+
+    def _run(self):
+        """
+        Delivery thread loop: takes batches from the queue and sends them over one connection.
+        """
+        smtp = None
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                smtp = self._close(smtp)
+                continue
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            smtp = self._deliver(smtp, batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                break
+        self._close(smtp)
+
+    def _connect(self):
+        """
+        Opens and authenticates a new SMTP connection.
+
+        Returns:
+            smtplib.SMTP: Connected SMTP client.
+        """
+        with metrics.timed("smtp_connect"):
+            smtp = smtplib.SMTP(host=self.host, port=self.port, timeout=self.connect_timeout)
+            try:
+                if self.use_tls:
+                    smtp.starttls(context=ssl.create_default_context())  # Start TLS for encryption
+                if self.username:
+                    smtp.login(self.username, self.password)
+            except Exception:
+                self._close(smtp)
+                raise
+        with self._lock:
+            self._connections += 1
+        return smtp
+
+    def _deliver(self, smtp, batch):
+        """
+        Sends a batch of emails, reconnecting once if the connection was lost.
+
+        Args:
+            smtp (smtplib.SMTP): Open connection, or None to open a new one.
+            batch (list): Emails to send.
+
+        Returns:
+            smtplib.SMTP: Connection to reuse for the next batch, or None if it is unusable.
+        """
+        pending = list(batch)
+        for attempt in range(2):
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                while pending:
+                    email = pending[0]
+                    try:
+                        with metrics.timed("smtp_send"):
+                            smtp.sendmail(email.sender, email.recipient, email.message)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        print(e)
+                        with self._lock:
+                            self._failed += 1
+                        self._done(email, str(e))
+                    else:
+                        with self._lock:
+                            self._sent += 1
+                        self._done(email, None)
+                    pending.pop(0)
+                return smtp
+            except (smtplib.SMTPException, OSError) as e:
+                print(e)
+                error = str(e)
+                smtp = self._close(smtp)
+
+        with self._lock:
+            self._failed += len(pending)
+        for email in pending:
+            self._done(email, error)
+        return None
+
+    @staticmethod
+    def _done(email, error):
+        """
+        Reports the outcome of an email to its on_done callback. A failing callback must not stop the delivery thread.
+
+        Args:
+            email (OutgoingEmail): Sent or failed email.
+            error (str): Error message, None if the email was sent.
+        """
+        if email.on_done is not None:
+            try:
+                email.on_done(error)
+            except Exception as e:
+                print(e)
+
+    @staticmethod
+    def _close(smtp):
+        """
+        Closes an SMTP connection, ignoring errors from a connection that is already broken.
+
+        Args:
+            smtp (smtplib.SMTP): Connection to close, may be None.
+
+        Returns:
+            None
+        """
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+        return None
@@ -1,12 +1,55 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Union
 from unittest.mock import patch, MagicMock
 
+import httpx
+from dateutil.rrule import rrulestr
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert, text, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
 # Import modules to be tested
+import async_main
+import database
 import main
+import metrics
 import eventScheduler
 import users_db_manager
 import events_db_manager
+import async_events_db_manager
+import async_users_db_manager
+import recurrence
+from auth_cache import CredentialCache
+from change_feed import ChangeFeed, sse_message, stream_changes
+from rate_limit import AdmissionMiddleware, ConcurrencyLimiter, RateLimiter
+from response_cache import ResponseCache, render
+from schemas import EventOut, MessageOut, UserOut
+from email_delivery import SMTPDeliveryWorker
+from benchmarks import load_test
+from benchmarks.smtp_stub import SMTPStubServer
+
+
+def query_plan(engine, query):
+    """
+    Returns the EXPLAIN QUERY PLAN output of an ORM query as one string.
+    """
+    statement = query.statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        return " ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {statement}")))
 
 
 class TestMain(unittest.TestCase):
@@ -36,22 +79,772 @@ class TestMain(unittest.TestCase):
         self.assertEqual(response["message"], "Event created successfully!")
 
 
+class TestEventParticipants(unittest.TestCase):
+    def setUp(self):
+        # In-memory events database, the scheduler is mocked so no reminder is sent
+        self.engine = create_engine("sqlite://")
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        patcher = patch("events_db_manager.eventScheduler")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.db.close()
+
+    def participants_of(self, event_id):
+        rows = self.db.query(events_db_manager.EventParticipant.email) \
+            .filter(events_db_manager.EventParticipant.event_id == event_id)
+        return sorted(email for (email,) in rows)
+
+    def test_update_appends_only_new_participants(self):
+        response = events_db_manager.create_event("Standup", "daily", datetime(2030, 1, 1, 10), "Room 1",
+                                                  ["a@a.a", "b@b.b", "a@a.a"], self.db)
+        event_id = response["event"].id
+        events_db_manager.update_event(event_id, None, None, None, None, ["b@b.b", "c@c.c"], self.db)
+
+        self.assertEqual(self.participants_of(event_id), ["a@a.a", "b@b.b", "c@c.c"])
+        events = events_db_manager.get_participant_events("c@c.c", self.db)
+        self.assertEqual([event.id for event in events], [event_id])
+
+    def test_participants_are_normalized_and_invalid_ones_rejected(self):
+        response = events_db_manager.create_event("Standup", "daily", datetime(2030, 1, 1, 10), "Room 1",
+                                                  [" A@a.a", "a@a.a", "b@B.b  "], self.db)
+        self.assertEqual(self.participants_of(response["event"].id), ["a@a.a", "b@b.b"])
+        self.assertEqual([event.id for event in events_db_manager.get_participant_events("B@b.b", self.db)],
+                         [response["event"].id])
+
+        with self.assertRaises(main.HTTPException) as raised:
+            events_db_manager.update_event(response["event"].id, "Renamed", None, None, None,
+                                           ["c@c.c", "bad", " @x.y"], self.db)
+        self.assertEqual(raised.exception.status_code, 422)
+        self.assertEqual([(error["loc"], error["input"]) for error in raised.exception.detail],
+                         [(["body", "participants", 1], "bad"), (["body", "participants", 2], " @x.y")])
+        self.db.rollback()
+        self.assertEqual(self.db.get(events_db_manager.Event, response["event"].id).title, "Standup")
+
+    def test_normalize_stored_participants(self):
+        self.db.add_all([events_db_manager.Event(id=1, title="Legacy", date=datetime(2030, 1, 1), location="Room 1"),
+                         events_db_manager.EventParticipant(event_id=1, email="A@a.a "),
+                         events_db_manager.EventParticipant(event_id=1, email="a@a.a"),
+                         events_db_manager.EventParticipant(event_id=1, email="B@b.b"),
+                         events_db_manager.EventParticipant(event_id=1, email="asas")])
+        self.db.commit()
+
+        self.assertEqual(events_db_manager.normalize_stored_participants(self.engine), 3)
+        self.assertEqual(events_db_manager.normalize_stored_participants(self.engine), 0)
+        self.assertEqual(self.participants_of(1), ["a@a.a", "b@b.b"])
+
+    def test_changes_follow_the_change_log(self):
+        first = events_db_manager.create_event("Standup", "daily", datetime(2030, 1, 1, 10), "Room 1", ["a@a.a"],
+                                               self.db)["event"].id
+        second = events_db_manager.create_event("Review", "weekly", datetime(2030, 1, 2, 10), "Room 2", ["b@b.b"],
+                                                self.db)["event"].id
+        events_db_manager.update_event(first, "Daily standup", None, None, None, None, self.db)
+        events_db_manager.delete_event(second, self.db)
+
+        page = events_db_manager.get_changes(0, 10, self.db)
+        self.assertEqual([(change["event_id"], change["action"]) for change in page["changes"]],
+                         [(first, "created"), (second, "created"), (first, "updated"), (second, "deleted")])
+        # Changes carry the current state of their event, none once it is deleted
+        self.assertEqual(page["changes"][0]["event"].title, "Daily standup")
+        self.assertIsNone(page["changes"][1]["event"])
+        self.assertEqual(page["last_seq"], page["changes"][-1]["seq"])
+
+        after = events_db_manager.get_changes(page["changes"][1]["seq"], 1, self.db)
+        self.assertEqual([change["action"] for change in after["changes"]], ["updated"])
+        self.assertEqual(events_db_manager.get_changes(page["last_seq"], 10, self.db),
+                         {"changes": [], "last_seq": page["last_seq"]})
+
+    def test_bulk_create_reports_per_row_results(self):
+        rows = [{"title": "Talk 1", "description": "a", "date": "2030-01-01T10:00:00", "location": "Hall",
+                 "participants": ["a@a.a", "b@b.b"]},
+                {"title": "Talk 2", "date": "not a date", "location": "Hall", "participants": []},
+                {"title": "Talk 3", "date": "2030-01-01T11:00:00", "location": "Hall", "participants": ["bad"]},
+                {"title": "Talk 4", "date": "2030-01-01T12:00:00", "location": "Hall", "participants": ["a@a.a"]}]
+
+        response = events_db_manager.create_events(rows, self.db)
+
+        self.assertEqual((response["created"], response["failed"]), (2, 2))
+        self.assertEqual([result["status"] for result in response["results"]],
+                         ["created", "failed", "failed", "created"])
+        self.assertEqual(response["results"][2]["errors"], ["participant bad should be a valid email"])
+        self.assertEqual(self.participants_of(response["results"][0]["id"]), ["a@a.a", "b@b.b"])
+        # Both reminders of each created event are in the outbox, committed with the events
+        outbox = self.db.query(events_db_manager.ReminderOutbox.action, events_db_manager.ReminderOutbox.event_id)
+        self.assertEqual(outbox.all(), [(action, response["results"][index]["id"])
+                                        for index in (0, 3) for action in ("send", "schedule")])
+
+    def test_migrate_legacy_participants(self):
+        with self.engine.begin() as connection:
+            # The legacy column did not validate the addresses
+            connection.execute(text("INSERT INTO events (id, title, date, location, participants) VALUES "
+                                    "(1, 'Legacy', '2030-01-01 10:00:00', 'Room 1', 'a@a.a, b@b.b,a@a.a, p,asas')"))
+
+        self.assertEqual(events_db_manager.migrate_participants(self.engine), 1)
+        self.assertEqual(events_db_manager.migrate_participants(self.engine), 0)
+        self.assertEqual(self.participants_of(1), ["a@a.a", "b@b.b"])
+
+
+class TestEventsPagination(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        # Five events, two of them at the same date to exercise the id tie-breaker
+        dates = [datetime(2030, 1, day, 10) for day in (3, 1, 2, 2, 5)]
+        self.db.add_all(events_db_manager.Event(title=f"Event {i}", description="long description", date=date,
+                                                location=f"Room {i}",
+                                                participants=[events_db_manager.EventParticipant(email=f"{i}@a.a")])
+                        for i, date in enumerate(dates))
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_pages_follow_date_then_id(self):
+        titles, cursor = [], None
+        while True:
+            page = events_db_manager.get_events_page("date", 2, cursor, None, self.db)
+            titles += [event.title for event in page["events"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(titles, ["Event 1", "Event 2", "Event 3", "Event 0", "Event 4"])
+
+    def test_fields_projection(self):
+        page = events_db_manager.get_events_page("location", 1, None, ["title", "participants"], self.db)
+        self.assertEqual(page["events"], [{"title": "Event 0", "participants": ["0@a.a"]}])
+
+        page = events_db_manager.get_events_page("location", 1, page["next_cursor"], ["title"], self.db)
+        self.assertEqual(page["events"], [{"title": "Event 1"}])
+
+        # A projection with the required fields of an event must not be filled in with the other ones
+        main.response_cache.clear()
+        response = main.get_all_events("location", 1, None, "id,title,date,location", None, self.db)
+        self.assertEqual(json.loads(response.body)["events"],
+                         [{"id": 1, "title": "Event 0", "date": "2030-01-03T10:00:00", "location": "Room 0"}])
+
+    def test_invalid_cursor_and_fields(self):
+        with self.assertRaises(main.HTTPException):
+            events_db_manager.get_events_page("date", 2, "not-a-cursor", None, self.db)
+        with self.assertRaises(main.HTTPException):
+            events_db_manager.get_events_page("date", 2, None, ["password"], self.db)
+
+    def test_export_streams_batches(self):
+        chunks = list(events_db_manager.export_events(datetime(2030, 1, 2), datetime(2030, 1, 5), "ndjson",
+                                                      self.db, batch_size=2))
+        # Three events in the date range, fetched two at a time
+        self.assertEqual(len(chunks), 2)
+        events = [json.loads(line) for line in "".join(chunks).splitlines()]
+        self.assertEqual([event["title"] for event in events], ["Event 2", "Event 3", "Event 0"])
+        self.assertEqual(events[0]["participants"], ["2@a.a"])
+        self.assertEqual((events[0]["end"], events[0]["recurrence"]), ("2030-01-02T11:00:00", None))
+
+        series = events_db_manager.create_event("Standup", "", datetime(2030, 1, 1, 9), "Room 9", [], self.db,
+                                                "FREQ=DAILY", datetime(2030, 1, 1, 9, 15))["event"]
+        lines = "".join(events_db_manager.export_events(None, None, "csv", self.db)).splitlines()
+        self.assertEqual(lines[0], "id,title,description,date,end,location,recurrence,participants")
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[1], f"{series.id},Standup,,2030-01-01T09:00:00,2030-01-01T09:15:00,Room 9,FREQ=DAILY,")
+
+    def test_range_and_upcoming(self):
+        page = events_db_manager.get_events_in_range(datetime(2030, 1, 2), datetime(2030, 1, 4), 2, None, self.db)
+        self.assertEqual([event.title for event in page["events"]], ["Event 2", "Event 3"])
+        page = events_db_manager.get_events_in_range(datetime(2030, 1, 2), datetime(2030, 1, 4), 2,
+                                                     page["next_cursor"], self.db)
+        self.assertEqual(([event.title for event in page["events"]], page["next_cursor"]), (["Event 0"], None))
+        with self.assertRaises(main.HTTPException):
+            events_db_manager.get_events_in_range(datetime(2030, 1, 4), datetime(2030, 1, 2), 2, None, self.db)
+
+        now = datetime(2030, 1, 2)
+        upcoming = events_db_manager.get_upcoming_events(2, None, self.db, now)
+        self.assertEqual([event.title for event in upcoming], ["Event 2", "Event 3"])
+        self.assertEqual([event.title for event in events_db_manager.get_upcoming_events(10, "4@a.a", self.db, now)],
+                         ["Event 4"])
+        self.assertEqual(events_db_manager.get_upcoming_events(10, "1@a.a", self.db, now), [])
+
+    def test_page_uses_keyset_index(self):
+        query = self.db.query(events_db_manager.Event.id).filter(
+            tuple_(events_db_manager.Event.date, events_db_manager.Event.id) > tuple_(datetime(2030, 1, 2), 3)) \
+            .order_by(events_db_manager.Event.date, events_db_manager.Event.id).limit(2)
+        plan = query_plan(self.engine, query)
+        self.assertIn("ix_events_date_id", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestRecurringEvents(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        patcher = patch("events_db_manager.eventScheduler")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.standup = events_db_manager.create_event("Standup", "weekly", datetime(2030, 1, 7, 10), "Room 1",
+                                                      ["a@a.a"], self.db, "rrule:freq=weekly")["event"].id
+        self.review = events_db_manager.create_event("Review", "", datetime(2030, 1, 15, 9), "Room 2", ["b@b.b"],
+                                                     self.db)["event"].id
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_range_merges_occurrences_with_single_events(self):
+        dates, cursor = [], None
+        while True:
+            page = events_db_manager.get_events_in_range(datetime(2030, 1, 10), datetime(2030, 2, 1), 2, cursor,
+                                                         self.db)
+            dates += [(event["date"] if isinstance(event, dict) else event.date) for event in page["events"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(dates, [datetime(2030, 1, 14, 10), datetime(2030, 1, 15, 9), datetime(2030, 1, 21, 10),
+                                 datetime(2030, 1, 28, 10)])
+
+        events_db_manager.cancel_occurrence(self.standup, datetime(2030, 1, 21, 10), self.db)
+        page = events_db_manager.get_events_in_range(datetime(2030, 1, 20), datetime(2030, 2, 1), 10, None, self.db)
+        self.assertEqual([EventOut.model_validate(event).date for event in page["events"]],
+                         [datetime(2030, 1, 28, 10)])
+        with self.assertRaises(main.HTTPException):
+            events_db_manager.cancel_occurrence(self.standup, datetime(2030, 1, 22, 10), self.db)
+
+    def test_timezone_aware_dates_are_read_as_utc(self):
+        # As FastAPI parses "...Z" and "...+00:00" query and path parameters
+        start, end = datetime.fromisoformat("2030-01-10T00:00:00Z"), datetime.fromisoformat("2030-01-20T00:00:00+00:00")
+        page = events_db_manager.get_events_in_range(start, end, 10, None, self.db)
+        self.assertEqual([event["date"] if isinstance(event, dict) else event.date for event in page["events"]],
+                         [datetime(2030, 1, 14, 10), datetime(2030, 1, 15, 9)])
+        self.assertEqual(len(events_db_manager.get_upcoming_events(2, None, self.db, start)), 2)
+
+        events_db_manager.cancel_occurrence(self.standup, datetime.fromisoformat("2030-01-14T12:00:00+02:00"), self.db)
+        page = events_db_manager.get_events_in_range(start, end, 10, None, self.db)
+        self.assertEqual([event.title for event in page["events"]], ["Review"])
+
+    def test_upcoming_expands_unbounded_series_lazily(self):
+        upcoming = events_db_manager.get_upcoming_events(3, "a@a.a", self.db, datetime(2031, 1, 1))
+        self.assertEqual([event["date"] for event in upcoming],
+                         [datetime(2031, 1, 6, 10), datetime(2031, 1, 13, 10), datetime(2031, 1, 20, 10)])
+        self.assertEqual(upcoming[0]["recurrence"], "FREQ=WEEKLY")
+
+    def test_occurrences_far_from_the_start_match_dateutil(self):
+        dtstart = datetime(2030, 1, 7, 10, 30)
+        for rule in ("FREQ=WEEKLY", "FREQ=HOURLY;INTERVAL=5", "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH",
+                     "FREQ=DAILY;BYHOUR=9,17", "FREQ=MONTHLY;BYDAY=-1FR"):
+            for start in (dtstart, datetime(2030, 1, 1), datetime(2041, 3, 5, 11)):
+                end = start + timedelta(days=40)
+                expected = [date for date in rrulestr(rule, dtstart=dtstart).between(start, end, inc=True)
+                            if date < end]
+                self.assertEqual(list(recurrence.occurrences(rule, dtstart, start, end)), expected, rule)
+
+    def test_recurrence_is_validated_and_bounded(self):
+        for rule in ("FREQ=MINUTELY", "FREQ=WEEKLY;INTERVAL=0", "FREQ=WEEKLY;INTERVAL=-1", "FREQ=DAILY;COUNT=0"):
+            with self.assertRaises(main.HTTPException) as raised:
+                events_db_manager.create_event("Bad", "", datetime(2030, 1, 1), "Room 1", [], self.db, rule)
+            self.assertEqual((raised.exception.status_code, raised.exception.detail[0]["loc"]),
+                             (422, ["body", "recurrence"]), rule)
+
+        event = events_db_manager.update_event(self.standup, None, None, None, None, None, self.db,
+                                               "FREQ=WEEKLY;COUNT=2")["event"]
+        self.assertEqual(event.recurrence_end, datetime(2030, 1, 14, 10))
+        page = events_db_manager.get_events_in_range(datetime(2030, 1, 15), datetime(2030, 2, 1), 10, None, self.db)
+        self.assertEqual([event.title for event in page["events"]], ["Review"])
+
+
+class TestEventConflicts(unittest.TestCase):
+    def setUp(self):
+        # Shared with the threads of the TestClient
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        patcher = patch("events_db_manager.eventScheduler")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.meeting = events_db_manager.create_event("Meeting", "", datetime(2030, 1, 7, 9), "Room 1", ["a@a.a"],
+                                                      self.db, None, datetime(2030, 1, 7, 11))["event"].id
+        self.standup = events_db_manager.create_event("Standup", "", datetime(2030, 1, 8, 10), "Room 2", ["b@b.b"],
+                                                      self.db, "FREQ=DAILY")["event"].id
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_reject_and_flag_overlapping_events(self):
+        with self.assertRaises(main.HTTPException) as raised:
+            events_db_manager.create_event("Call", "", datetime(2030, 1, 7, 10), "Room 1", ["c@c.c"], self.db, None,
+                                           None, "reject")
+        self.assertEqual(raised.exception.status_code, 409)
+        self.assertEqual(raised.exception.detail["conflicts"][0]["second"]["id"], self.meeting)
+
+        # Another room, but b@b.b is in the standup of 2030-01-10 10:00
+        found = events_db_manager.create_event("Lunch", "", datetime(2030, 1, 10, 10, 30), "Room 3", ["B@b.b"],
+                                               self.db, None, None, "flag")["conflicts"]
+        self.assertEqual([(conflict["second"]["date"], conflict["same_location"], conflict["participants"])
+                          for conflict in found], [(datetime(2030, 1, 10, 10), False, ["b@b.b"])])
+
+        # Back to back with the meeting, it does not overlap
+        created = events_db_manager.create_event("Debrief", "", datetime(2030, 1, 7, 11), "Room 1", ["a@a.a"],
+                                                 self.db, None, None, "reject")
+        self.assertEqual(created["event"].end, datetime(2030, 1, 7, 12))
+
+    def test_check_holds_the_write_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # No busy timeout, a write waiting for the lock fails at once
+            engine = create_engine(f"sqlite:///{directory}/events.db", connect_args={"timeout": 0})
+            events_db_manager.Base.metadata.create_all(engine)
+            find_conflicts = events_db_manager.find_conflicts
+
+            def find_while_another_request_writes(*args):
+                with self.assertRaises(OperationalError), engine.begin() as connection:
+                    connection.execute(insert(events_db_manager.Event).values(
+                        title="Other", date=datetime(2030, 1, 7, 9), location="Room 1"))
+                return find_conflicts(*args)
+
+            with Session(engine) as db, \
+                    patch("events_db_manager.find_conflicts", side_effect=find_while_another_request_writes):
+                events_db_manager.create_event("Call", "", datetime(2030, 1, 7, 9), "Room 1", [], db, None, None,
+                                               "reject")
+            engine.dispose()
+
+    def test_updated_series_is_checked_from_now(self):
+        tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+        events_db_manager.create_event("Visit", "", tomorrow.replace(hour=10), "Room 9", [], self.db)
+        daily = events_db_manager.create_event("Daily", "", datetime(2020, 1, 1, 10), "Room 9", [], self.db,
+                                               "FREQ=DAILY")["event"].id
+        with self.assertRaises(main.HTTPException) as raised:
+            events_db_manager.update_event(daily, "Renamed", None, None, None, None, self.db, None, None, "reject")
+        self.assertEqual(raised.exception.detail["conflicts"][0]["first"]["date"],
+                         tomorrow.replace(hour=10).isoformat())
+        self.assertEqual(self.db.get(events_db_manager.Event, daily).title, "Daily")
+
+    def test_end_is_validated_and_kept_on_update(self):
+        with self.assertRaises(main.HTTPException) as raised:
+            events_db_manager.create_event("Bad", "", datetime(2030, 1, 1), "Room 1", [], self.db, None,
+                                           datetime(2030, 1, 3))
+        self.assertEqual((raised.exception.status_code, raised.exception.detail[0]["loc"]), (422, ["body", "end"]))
+
+        event = events_db_manager.update_event(self.meeting, None, None, datetime(2030, 2, 1, 14), None, None,
+                                               self.db)["event"]
+        self.assertEqual(event.end, datetime(2030, 2, 1, 16))
+
+    def test_conflicts_in_range(self):
+        events_db_manager.create_event("Sync", "", datetime(2030, 1, 9, 10, 15), "Room 2", ["d@d.d"], self.db)
+        found = events_db_manager.get_conflicts(datetime(2030, 1, 7), datetime(2030, 1, 14), None, None, 10,
+                                                self.db)["conflicts"]
+        self.assertEqual([(conflict["first"]["date"], conflict["second"]["title"], conflict["same_location"])
+                          for conflict in found], [(datetime(2030, 1, 9, 10), "Sync", True)])
+        with self.assertRaises(main.HTTPException):
+            events_db_manager.get_conflicts(datetime(2030, 1, 1), datetime(2030, 3, 1), None, None, 10, self.db)
+
+    def test_routes_read_timezone_aware_dates_as_utc(self):
+        app = main.app
+        app.dependency_overrides.update({main.get_current_username: lambda: "ben", main.get_events_db: lambda: self.db,
+                                         main.get_events_read_db: lambda: self.db})
+        self.addCleanup(app.dependency_overrides.clear)
+        client = TestClient(app)
+        response = client.post("/events", params={"conflicts": "reject"}, json={
+            "title": "Call", "description": "", "date": "2030-01-07T10:00:00+00:00", "location": "Room 1",
+            "participants": ["c@c.c"]})
+        self.assertEqual((response.status_code, response.json()["detail"]["conflicts"][0]["second"]["id"]),
+                         (409, self.meeting))
+
+        events_db_manager.create_event("Sync", "", datetime(2030, 1, 9, 10, 15), "Room 2", ["d@d.d"], self.db)
+        response = client.get("/events/conflicts", params={"start": "2030-01-07T00:00:00Z",
+                                                           "end": "2030-01-14T00:00:00Z"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(conflict["first"]["date"], conflict["second"]["title"])
+                          for conflict in response.json()["conflicts"]], [("2030-01-09T10:00:00", "Sync")])
+
+    def test_location_lookup_uses_index(self):
+        Event = events_db_manager.Event
+        query = self.db.query(Event).filter(Event.location == "Room 1", Event.recurrence.is_(None),
+                                            Event.date > datetime(2030, 1, 6), Event.date < datetime(2030, 1, 7))
+        self.assertIn("ix_events_location_date", query_plan(self.engine, query))
+
+
+class TestEventFilters(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        Event, EventParticipant = events_db_manager.Event, events_db_manager.EventParticipant
+        self.db.add_all([
+            Event(title="Team standup", description="daily", date=datetime(2030, 1, 1, 9), location="Room 1",
+                  participants=[EventParticipant(email="ann@a.a")]),
+            Event(title="team_lunch", description="food", date=datetime(2030, 1, 1, 12), location="Cafe",
+                  participants=[EventParticipant(email="bob@b.b")]),
+            Event(title="Retro", description="weekly", date=datetime(2030, 1, 2, 9), location="Room 1",
+                  participants=[EventParticipant(email="ann@a.a"), EventParticipant(email="bob@b.b")]),
+        ])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def titles(self, events):
+        return [event.title for event in events]
+
+    def test_filter_by_field(self):
+        self.assertEqual(self.titles(events_db_manager.get_event_by("title", "TEAM", self.db)),
+                         ["Team standup", "team_lunch"])
+        # LIKE wildcards in the value are matched literally
+        self.assertEqual(self.titles(events_db_manager.get_event_by("title", "team_", self.db)), ["team_lunch"])
+        self.assertEqual(self.titles(events_db_manager.get_event_by("date", "2030-01-01", self.db)),
+                         ["Team standup", "team_lunch"])
+        self.assertEqual(self.titles(events_db_manager.get_event_by("participants", "bo", self.db)),
+                         ["team_lunch", "Retro"])
+        # Stored emails are lowercase, the prefix is normalized the same way
+        self.assertEqual(self.titles(events_db_manager.get_event_by("participants", " BOB@", self.db)),
+                         ["team_lunch", "Retro"])
+
+    def test_invalid_filter_is_a_client_error(self):
+        for filter_by, filter_value in (("password", "x"), ("__class__", "x"), ("date", "tomorrow"),
+                                        ("participants", " ")):
+            with self.assertRaises(main.HTTPException) as error:
+                events_db_manager.get_event_by(filter_by, filter_value, self.db)
+            self.assertEqual(error.exception.status_code, 400)
+
+    def test_search_combines_filters(self):
+        events = events_db_manager.search_events(location="room", participant="bob@b.b", db=self.db)
+        self.assertEqual(self.titles(events), ["Retro"])
+        events = events_db_manager.search_events(date_from=datetime(2030, 1, 1, 10), date_to=datetime(2030, 1, 2),
+                                                 db=self.db)
+        self.assertEqual(self.titles(events), ["team_lunch"])
+
+    def test_filters_use_indexes(self):
+        Event = events_db_manager.Event
+        for condition, index in (
+                (events_db_manager._prefix_condition(Event.title, "Team"), "ix_events_title_nocase"),
+                (events_db_manager._prefix_condition(Event.location, "Room"), "ix_events_location_nocase"),
+                (events_db_manager._participant_prefix_condition("bob"), "ix_event_participants_email_event_id")):
+            plan = query_plan(self.engine, self.db.query(Event.id).filter(condition))
+            self.assertIn("SEARCH", plan)
+            self.assertIn(index, plan)
+
+
+class TestAsyncEventsDBManager(unittest.TestCase):
+    async def create_and_get(self):
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as connection:
+            await connection.run_sync(events_db_manager.Base.metadata.create_all)
+        async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+            response = await async_events_db_manager.create_event("Async", "event", datetime(2030, 1, 1, 10),
+                                                                  "Room 1", ["a@a.a"], db)
+            event = await async_events_db_manager.get_event(response["event"].id, db)
+            missing = await async_events_db_manager.get_event(response["event"].id + 1, db)
+        await engine.dispose()
+        return event, missing
+
+    def test_create_and_get_event(self):
+        with patch("events_db_manager.eventScheduler"):
+            event, missing = asyncio.run(self.create_and_get())
+
+        self.assertEqual(event.title, "Async")
+        self.assertEqual([participant.email for participant in event.participants], ["a@a.a"])
+        self.assertEqual(missing, {"message": "Event not found"})
+
+
 class TestEventScheduler(unittest.TestCase):
     def test_schedule_reminder(self):
         # Mock event object
-        mock_event = MagicMock()
+        mock_event = MagicMock(recurrence=None)
         mock_event.date = datetime.now()
 
         # Create an instance of EventScheduler
         scheduler = eventScheduler.EventScheduler()
 
-        # Call the function with mocked dependencies
-        scheduler.scheduler = MagicMock()
-        scheduler.send_reminder = MagicMock()
-        scheduler.schedule_reminder(mock_event)
+        # Call the function with mocked dependencies, restored afterwards since the instance is shared
+        with patch.object(scheduler, "scheduler"):
+            scheduler.schedule_reminder(mock_event)
+
+            # Assert that the scheduler was called with the correct arguments
+            scheduler.scheduler.add_job.assert_called_once()
+
+
+class TestReminderJobs(unittest.TestCase):
+    def setUp(self):
+        # Persistent job store on an in-memory database shared by the scheduler thread
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.event_scheduler = eventScheduler.EventScheduler()
+        self.original = self.event_scheduler.scheduler, self.event_scheduler.job_store
+        self.event_scheduler.job_store = eventScheduler.SQLAlchemyJobStore(engine=self.engine)
+        self.event_scheduler.scheduler = eventScheduler.BackgroundScheduler(
+            jobstores={"default": self.event_scheduler.job_store})
+        self.event_scheduler.scheduler.start(paused=True)
+
+    def tearDown(self):
+        self.event_scheduler.scheduler.shutdown(wait=False)
+        self.event_scheduler.scheduler, self.event_scheduler.job_store = self.original
+
+    def test_one_shot_job_per_event(self):
+        event = MagicMock(id=7, date=datetime(2030, 1, 1, 10), recurrence=None)
+        self.event_scheduler.schedule_reminder(event)
+        event.date = datetime(2030, 1, 2, 10)
+        self.event_scheduler.schedule_reminder(event)
+
+        jobs = self.event_scheduler.scheduler.get_jobs()
+        self.assertEqual([job.id for job in jobs], ["event-7"])
+        self.assertIsInstance(jobs[0].trigger, eventScheduler.DateTrigger)
+        self.assertEqual(jobs[0].next_run_time.replace(tzinfo=None), datetime(2030, 1, 2, 9, 30))
+        self.assertEqual(jobs[0].args, (7,))
+
+        self.event_scheduler.remove_job(7)
+        self.event_scheduler.remove_job(7)  # removing a missing job is a no-op
+        self.assertEqual(self.event_scheduler.scheduler.get_jobs(), [])
+
+    def test_schedule_reminder_replaces_only_its_job(self):
+        for event_id in (1, 2):
+            self.event_scheduler.schedule_reminder(MagicMock(id=event_id, date=datetime(2030, 1, 1, 10),
+                                                             recurrence=None))
+
+        self.event_scheduler.schedule_reminder(MagicMock(id=2, date=datetime(2030, 2, 1, 10), recurrence=None))
+        self.event_scheduler.schedule_reminder(MagicMock(id=3, date=datetime(2030, 3, 1, 10), recurrence=None))
+
+        run_times = {job.id: job.next_run_time.replace(tzinfo=None)
+                     for job in self.event_scheduler.scheduler.get_jobs()}
+        self.assertEqual(run_times, {"event-1": datetime(2030, 1, 1, 9, 30), "event-2": datetime(2030, 2, 1, 9, 30),
+                                     "event-3": datetime(2030, 3, 1, 9, 30)})
+
+    def test_rehydrate_schedules_upcoming_events_once(self):
+        with Session(self.engine) as db:
+            db.add_all([events_db_manager.Event(id=1, title="Past", date=datetime(2020, 1, 1), location="Room 1"),
+                        events_db_manager.Event(id=2, title="Next", date=datetime(2030, 1, 1), location="Room 1")])
+            db.commit()
+            self.assertEqual(self.event_scheduler.rehydrate(db), 1)
+            self.assertEqual(self.event_scheduler.rehydrate(db), 0)
+        self.assertEqual([job.id for job in self.event_scheduler.scheduler.get_jobs()], ["event-2"])
 
-        # Assert that the scheduler was called with the correct arguments
-        scheduler.scheduler.add_job.assert_called_once()
+    def test_series_has_one_job_for_its_next_occurrence(self):
+        with Session(self.engine) as db:
+            db.add(events_db_manager.Event(id=3, title="Standup", date=datetime(2030, 1, 7, 10), location="Room 1",
+                                           recurrence="FREQ=WEEKLY"))
+            db.add(events_db_manager.EventException(event_id=3, occurrence=datetime(2030, 1, 14, 10)))
+            db.commit()
+            self.assertEqual(self.event_scheduler.rehydrate(db), 1)
+        job = self.event_scheduler.scheduler.get_job("event-3")
+        self.assertEqual(job.args, (3, datetime(2030, 1, 7, 10)))
+
+        # Once the reminder is sent, the same job moves to the next occurrence that is not cancelled
+        with patch("events_db_manager.SessionLocal", lambda: Session(self.engine)), \
+                patch.object(self.event_scheduler, "remind") as remind:
+            eventScheduler.send_event_reminder(3, datetime(2030, 1, 7, 10))
+        self.assertEqual(remind.call_args.args[1], datetime(2030, 1, 7, 10))
+        jobs = self.event_scheduler.scheduler.get_jobs()
+        self.assertEqual([(job.id, job.args) for job in jobs], [("event-3", (3, datetime(2030, 1, 21, 10)))])
+        self.assertEqual(jobs[0].next_run_time.replace(tzinfo=None), datetime(2030, 1, 21, 9, 30))
+
+    def test_digest_sends_one_email_per_recipient_once(self):
+        def event(event_id, date, *emails):
+            return events_db_manager.Event(id=event_id, title=f"Event {event_id}", description="", date=date,
+                                           location="Room 1", participants=[events_db_manager.EventParticipant(
+                                               event_id=event_id, email=email) for email in emails])
+
+        first, second = event(1, datetime(2030, 1, 1, 10), "a@a.a"), event(2, datetime(2030, 1, 1, 9), "a@a.a", "b@b.b")
+        with patch.object(self.event_scheduler, "delivery") as delivery, \
+                patch("eventScheduler.REMINDER_DIGEST_SECONDS", 60):
+            delivery.enqueue.side_effect = lambda sender, recipient, message, on_done: on_done(None) or True
+            self.event_scheduler.remind(first)
+            self.event_scheduler.remind(second)
+            self.event_scheduler.remind(first)  # fired twice
+            # The window is still open
+            self.assertEqual(self.event_scheduler.send_due_reminders(), 0)
+            delivery.enqueue.assert_not_called()
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=time.time() + 60), 3)
+
+            messages = {call.args[1]: call.args[2] for call in delivery.enqueue.call_args_list}
+            self.assertEqual(delivery.enqueue.call_count, 2)
+            self.assertTrue(messages["a@a.a"].startswith("You have 2 upcoming events:\n\nEvent 2"))
+            self.assertTrue(messages["b@b.b"].startswith("You are invited to the event Event 2"))
+
+            # Already sent, unless the event moved
+            self.event_scheduler.remind(first)
+            first.date = datetime(2030, 1, 2, 10)
+            self.event_scheduler.remind(first)
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=time.time() + 60), 1)
+            self.assertEqual(delivery.enqueue.call_count, 3)
+            self.assertIn("On the date 2030-01-02 10:00:00", delivery.enqueue.call_args.args[2])
+
+    def test_reminders_are_kept_until_delivered(self):
+        event = events_db_manager.Event(id=1, title="Event", description="", date=datetime(2030, 1, 1, 10),
+                                        location="Room 1", participants=[events_db_manager.EventParticipant(
+                                            event_id=1, email="a@a.a")])
+        self.event_scheduler.remind(event)
+        with patch.object(self.event_scheduler, "delivery") as delivery:
+            # The queue is full: retried after a backoff
+            delivery.enqueue.return_value = False
+            self.assertEqual(self.event_scheduler.send_due_reminders(), 1)
+            self.assertEqual(self.event_scheduler.send_due_reminders(), 0)
+            retry = time.time() + eventScheduler.OUTBOX_RETRY_SECONDS
+
+            # Queued but never confirmed, e.g. the leader died: claimed again once the claim expired
+            delivery.enqueue.return_value = True
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=retry), 1)
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=retry + 1), 0)
+            stale = retry + eventScheduler.reminder_digest.CLAIM_SECONDS
+
+            delivery.enqueue.side_effect = lambda sender, recipient, message, on_done: on_done(None) or True
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=stale), 1)
+            self.assertEqual(self.event_scheduler.send_due_reminders(now=stale + 3600), 0)
+            self.assertEqual(delivery.enqueue.call_count, 3)
+
+    def test_lease_has_a_single_holder(self):
+        self.assertTrue(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-1", now=0))
+        self.assertFalse(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-2", now=1))
+        self.assertTrue(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-1", now=10))
+        # worker-1 stopped renewing, worker-2 takes over once the lease expired
+        expired = 10 + eventScheduler.LEASE_SECONDS + 1
+        self.assertTrue(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-2", now=expired))
+        self.assertFalse(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-1", now=expired))
+        eventScheduler.release_lease(self.engine, "dispatch", "worker-2")
+        self.assertTrue(eventScheduler.acquire_lease(self.engine, "dispatch", "worker-1", now=expired))
+
+    def test_outbox_is_drained_by_the_leader(self):
+        with Session(self.engine) as db:
+            events_db_manager.create_events([
+                {"title": "Kept", "date": "2030-01-01T10:00:00", "location": "Room 1", "participants": ["a@a.a"]},
+                {"title": "Deleted", "date": "2030-01-02T10:00:00", "location": "Room 1", "participants": []}], db)
+            events_db_manager.delete_event(2, db)
+            outbox = events_db_manager.ReminderOutbox
+            self.assertEqual(db.query(outbox.action, outbox.event_id).order_by(outbox.id).all(),
+                             [("send", 1), ("schedule", 1), ("send", 2), ("schedule", 2), ("remove", 2)])
+        self.assertEqual(self.event_scheduler.scheduler.get_jobs(), [])
+
+        with patch.object(self.event_scheduler, "delivery") as delivery:
+            delivery.enqueue.side_effect = lambda sender, recipient, message, on_done: on_done(None) or True
+            # Another process holds the lease, nothing is applied here
+            eventScheduler.acquire_lease(self.engine, eventScheduler.LEASE_NAME, "other-worker")
+            self.assertFalse(self.event_scheduler.poll_leadership())
+            expired = time.time() + eventScheduler.LEASE_SECONDS + 1
+            try:
+                self.assertTrue(self.event_scheduler.poll_leadership(now=expired))
+            finally:
+                self.event_scheduler.is_leader = False
+            self.assertEqual([job.id for job in self.event_scheduler.scheduler.get_jobs()], ["event-1"])
+            delivery.enqueue.assert_called_once()
+            self.assertEqual(delivery.enqueue.call_args.args[1], "a@a.a")
+        with Session(self.engine) as db:
+            self.assertEqual(db.query(events_db_manager.ReminderOutbox).count(), 0)
+
+    def test_invitations_are_kept_until_delivered(self):
+        with Session(self.engine) as db:
+            db.add(events_db_manager.Event(id=1, title="Event", date=datetime(2030, 1, 1), location="Room 1",
+                                           participants=[events_db_manager.EventParticipant(email="a@a.a")]))
+            events_db_manager.queue_reminders(db, ("send",), [1])
+            db.commit()
+
+        with patch.object(self.event_scheduler, "delivery") as delivery:
+            # The queue is full: the row is retried with backoff
+            delivery.enqueue.return_value = False
+            self.assertEqual(self.event_scheduler.process_outbox(now=1000), 1)
+            with Session(self.engine) as db:
+                row = db.query(events_db_manager.ReminderOutbox).one()
+                self.assertEqual(row.attempts, 1)
+                self.assertEqual(row.last_error, "SMTP delivery queue is full")
+                self.assertGreater(row.available_at, time.time())
+
+            # The SMTP server refused it: still kept
+            delivery.enqueue.side_effect = lambda sender, recipient, message, on_done: on_done("refused") or True
+            self.assertEqual(self.event_scheduler.process_outbox(now=time.time() + 1000), 1)
+            with Session(self.engine) as db:
+                row = db.query(events_db_manager.ReminderOutbox).one()
+                self.assertEqual((row.attempts, row.last_error), (2, "refused"))
+
+            delivery.enqueue.side_effect = lambda sender, recipient, message, on_done: on_done(None) or True
+            self.assertEqual(self.event_scheduler.process_outbox(now=time.time() + 1000), 1)
+        with Session(self.engine) as db:
+            self.assertEqual(db.query(events_db_manager.ReminderOutbox).count(), 0)
+
+    def test_failed_outbox_rows_are_retried_with_backoff(self):
+        with Session(self.engine) as db:
+            db.add(events_db_manager.Event(id=1, title="Event", date=datetime(2030, 1, 1), location="Room 1"))
+            events_db_manager.queue_reminders(db, ("schedule",), [1])
+            db.commit()
+
+        with patch.object(self.event_scheduler, "schedule_reminder", side_effect=RuntimeError("job store down")):
+            self.assertEqual(self.event_scheduler.process_outbox(now=1000), 1)
+        with Session(self.engine) as db:
+            row = db.query(events_db_manager.ReminderOutbox).one()
+            self.assertEqual((row.attempts, row.available_at, row.last_error), (1, 1005, "job store down"))
+
+        self.assertEqual(self.event_scheduler.process_outbox(now=1004), 0)
+        self.assertEqual(self.event_scheduler.process_outbox(now=1005), 1)
+        self.assertEqual([job.id for job in self.event_scheduler.scheduler.get_jobs()], ["event-1"])
+        self.assertEqual(self.event_scheduler.process_outbox(now=2000), 0)
+
+class TestChangeFeed(unittest.TestCase):
+    def test_publish_wakes_up_subscribers(self):
+        async def wait_for_publish(feed):
+            subscription = feed.subscribe()
+            timed_out = await subscription.wait(0.01)
+            # Published from another thread, as the sync app's writers do
+            threading.Timer(0.01, feed.publish).start()
+            published = await subscription.wait(5)
+            feed.unsubscribe(subscription)
+            return timed_out, published, feed.subscribers()
+
+        self.assertEqual(asyncio.run(wait_for_publish(ChangeFeed())), (False, True, 0))
+
+    def test_stream_sends_the_backlog_then_ends(self):
+        log = [(seq, sse_message(seq, b'{"seq": %d}' % seq)) for seq in (1, 2, 3)]
+
+        async def read_messages(since):
+            return [(seq, message) for seq, message in log if seq > since]
+
+        async def collect():
+            return [message async for message in stream_changes(read_messages, 1, timeout=0)]
+
+        self.assertEqual(asyncio.run(collect()), [message for _, message in log[1:]])
+        self.assertEqual(log[0][1], b'id: 1\nevent: change\ndata: {"seq": 1}\n\n')
+
+
+class TestSMTPDeliveryWorker(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPStubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_reuses_pooled_connection(self):
+        worker = SMTPDeliveryWorker(host="127.0.0.1", port=self.server.port, username="user",
+                                    password="password", use_tls=False, pool_size=1)
+
+        # Queue emails for several events, the caller should not wait for delivery
+        for event_id in range(3):
+            for participant in ("a@a.a", "b@b.b"):
+                self.assertTrue(worker.enqueue("sender@a.a", participant, f"event {event_id}"))
+        worker.flush()
+        worker.stop()
+
+        # All emails go through one authenticated connection
+        self.assertEqual(self.server.counters, {"connections": 1, "logins": 1, "messages": 6})
+        self.assertEqual(worker.stats()["sent"], 6)
+
+    def test_reports_each_outcome(self):
+        outcomes = []
+        worker = SMTPDeliveryWorker(host="127.0.0.1", port=self.server.port, use_tls=False, pool_size=1)
+        worker.enqueue("sender@a.a", "a@a.a", "sent", outcomes.append)
+        worker.flush()
+        worker.stop()
+        # Nothing listens on port 1, the connection is refused
+        unreachable = SMTPDeliveryWorker(host="127.0.0.1", port=1, use_tls=False, pool_size=1)
+        unreachable.enqueue("sender@a.a", "a@a.a", "failed", outcomes.append)
+        unreachable.flush()
+        unreachable.stop()
+
+        self.assertIsNone(outcomes[0])
+        self.assertIsInstance(outcomes[1], str)
+
+    def test_drops_when_queue_full(self):
+        worker = SMTPDeliveryWorker(host="127.0.0.1", port=self.server.port, use_tls=False, queue_size=1)
+        worker.start = MagicMock()  # keep the delivery threads stopped so the queue fills up
+
+        self.assertTrue(worker.enqueue("sender@a.a", "a@a.a", "first"))
+        self.assertFalse(worker.enqueue("sender@a.a", "b@b.b", "second"))
+        self.assertEqual(worker.stats()["queue_depth"], 1)
+        self.assertEqual(worker.stats()["dropped"], 1)
+        with patch("metrics._collectors", [worker.metric_samples]):
+            lines = metrics.render().splitlines()
+        self.assertIn("eventmanager_smtp_queue_depth 1", lines)
+        self.assertIn("eventmanager_smtp_dropped_total 1", lines)
 
 
 class TestUsersDBManager(unittest.TestCase):
@@ -69,6 +862,348 @@ class TestUsersDBManager(unittest.TestCase):
         # Assert response
         self.assertEqual(response["message"], "Username created successfully!")
 
+    def test_duplicate_username_rejected(self):
+        engine = create_engine("sqlite://")
+        users_db_manager.Base.metadata.create_all(engine)
+        with Session(engine) as db, patch("users_db_manager.PASSWORD_HASH_ITERATIONS", 1000):
+            users_db_manager.create_user("ben", "secret", "ben@gmail.com", db)
+            with self.assertRaises(main.HTTPException) as error:
+                users_db_manager.create_user("ben", "other", "ben@gmail.com", db)
+        self.assertEqual(error.exception.status_code, 409)
+
+    def test_async_create_user_hashes_off_the_event_loop(self):
+        hash_threads = []
+        hash_password = users_db_manager.hash_password
+
+        def recorded_hash(password):
+            hash_threads.append(threading.get_ident())
+            return hash_password(password)
+
+        async def create():
+            engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+            async with engine.begin() as connection:
+                await connection.run_sync(users_db_manager.Base.metadata.create_all)
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                user = (await async_users_db_manager.create_user("ben", "secret", "ben@gmail.com", db))["user"]
+            await engine.dispose()
+            return threading.get_ident(), user
+
+        with patch("users_db_manager.PASSWORD_HASH_ITERATIONS", 1000), \
+                patch("users_db_manager.hash_password", side_effect=recorded_hash):
+            loop_thread, user = asyncio.run(create())
+        self.assertEqual(len(hash_threads), 1)
+        self.assertNotEqual(hash_threads[0], loop_thread)
+        self.assertTrue(users_db_manager.verify_password("secret", user.password))
+
+    def test_migrate_users_hashes_passwords(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                    "username TEXT NOT NULL, password TEXT NOT NULL, email TEXT NOT NULL)"))
+            connection.execute(text("INSERT INTO users (username, password, email) VALUES ('ben', 'ben', 'b@b.b')"))
+
+        with patch("users_db_manager.PASSWORD_HASH_ITERATIONS", 1000):
+            self.assertEqual(users_db_manager.migrate_users(engine), 1)
+            self.assertEqual(users_db_manager.migrate_users(engine), 0)
+
+        with Session(engine) as db:
+            user = users_db_manager.get_user_by_username("ben", db)
+            self.assertTrue(users_db_manager.verify_password("ben", user.password))
+            self.assertFalse(users_db_manager.verify_password("wrong", user.password))
+        with engine.connect() as connection:
+            indexes = connection.execute(text("PRAGMA index_list(users)")).fetchall()
+        self.assertIn(("ix_users_username", 1), [(index[1], index[2]) for index in indexes])
+
+
+class TestCredentialCache(unittest.TestCase):
+    def test_hits_misses_and_invalidation(self):
+        cache = CredentialCache(maxsize=2, ttl=60)
+        self.assertFalse(cache.verify("ben", "secret", "hash"))
+        cache.add("ben", "secret", "hash")
+
+        self.assertTrue(cache.verify("ben", "secret", "hash"))
+        self.assertFalse(cache.verify("ben", "wrong", "hash"))
+        # The password was changed, e.g. by another worker
+        self.assertFalse(cache.verify("ben", "secret", "new hash"))
+        cache.invalidate("ben")
+        self.assertFalse(cache.verify("ben", "secret", "hash"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 4)
+
+    def test_lru_eviction_and_ttl(self):
+        cache = CredentialCache(maxsize=2, ttl=60)
+        for username in ("a", "b", "c"):
+            cache.add(username, "secret", "hash")
+        self.assertFalse(cache.verify("a", "secret", "hash"))
+        self.assertTrue(cache.verify("c", "secret", "hash"))
+
+        expired = CredentialCache(ttl=0)
+        expired.add("a", "secret", "hash")
+        self.assertFalse(expired.verify("a", "secret", "hash"))
+
+    def test_get_current_username_uses_cache(self):
+        credentials = MagicMock(username="cached_user", password="secret")
+        user = users_db_manager.User(username="cached_user", password="stored hash")
+        main.credential_cache.add("cached_user", "secret", "stored hash")
+
+        with patch("users_db_manager.get_user_by_username", return_value=user), \
+                patch("users_db_manager.verify_password") as verify_password:
+            self.assertEqual(main.get_current_username(credentials, None), "cached_user")
+        verify_password.assert_not_called()
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_token_bucket_refills_and_evicts_idle_users(self):
+        limiter = RateLimiter(rate=2, burst=10)
+        self.assertEqual(limiter.acquire("ben", 5, now=0), 0)
+        self.assertEqual(limiter.acquire("ben", 5, now=0), 0)
+        # Empty bucket: 5 tokens take 2.5 s to come back
+        self.assertEqual(limiter.acquire("ben", 5, now=0), 2.5)
+        self.assertEqual(limiter.acquire("ben", 5, now=2.5), 0)
+        self.assertEqual(limiter.acquire("dan", 1, now=2.5), 0)
+
+        # Full again 5 s after their last request, ben's bucket is dropped when another user is charged
+        limiter.acquire("dan", 1, now=7.5)
+        self.assertEqual(limiter.stats(), {"allowed": 5, "limited": 1, "size": 1})
+        self.assertEqual(RateLimiter(rate=0).acquire("ben", 1000), 0)
+
+    def test_rate_limited_user_returns_429(self):
+        app = main.app
+        with patch.object(main, "rate_limiter", RateLimiter(rate=0.5, burst=2)):
+            app.dependency_overrides[main.get_current_username] = lambda: "ben"
+            self.addCleanup(app.dependency_overrides.clear)
+            client = TestClient(app)
+            statuses = [client.get("/metrics/cache").status_code for _ in range(2)]
+            response = client.get("/metrics/cache")
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual((response.status_code, response.headers["retry-after"]), (429, "2"))
+
+    def test_admission_sheds_requests_past_the_cap(self):
+        limiter = ConcurrencyLimiter(max_concurrent=1)
+        release = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"done"})
+
+        async def run():
+            transport = httpx.ASGITransport(app=AdmissionMiddleware(slow_app, limiter))
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                first = asyncio.create_task(client.get("/events"))
+                await asyncio.sleep(0.01)
+                shed = await client.get("/events")
+                exempt = asyncio.create_task(client.get("/metrics"))
+                release.set()
+                return (await first).status_code, shed.status_code, shed.headers["retry-after"], \
+                    (await exempt).status_code
+
+        self.assertEqual(asyncio.run(run()), (200, 429, "1", 200))
+        self.assertEqual(limiter.stats(), {"admitted": 1, "rejected": 1, "in_flight": 0})
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        events_db_manager.Base.metadata.create_all(self.engine)
+        self.db = Session(self.engine)
+        self.cache = ResponseCache(maxsize=10, ttl=60)
+        for patcher in (patch("events_db_manager.eventScheduler"),
+                        patch("events_db_manager.response_cache", self.cache),
+                        patch("main.response_cache", self.cache)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_etag_and_invalidation_by_id(self):
+        event_id = events_db_manager.create_event("Standup", "daily", datetime(2030, 1, 1, 10), "Room 1",
+                                                  ["a@a.a"], self.db)["event"].id
+        first = main.get_event(event_id, None, self.db)
+        etag = first.headers["ETag"]
+        self.assertEqual(json.loads(first.body)["title"], "Standup")
+
+        with patch("events_db_manager.get_event") as get_event:
+            self.assertEqual(main.get_event(event_id, etag, self.db).status_code, 304)
+            get_event.assert_not_called()
+
+        events_db_manager.update_event(event_id, "Retro", None, None, None, None, self.db)
+        updated = main.get_event(event_id, etag, self.db)
+        self.assertEqual(updated.status_code, 200)
+        self.assertNotEqual(updated.headers["ETag"], etag)
+        self.assertEqual(json.loads(updated.body)["title"], "Retro")
+
+    def test_list_pages_follow_the_generation(self):
+        self.assertEqual(json.loads(main.get_all_events(None, 10, None, None, None, self.db).body)["events"], [])
+        main.get_all_events(None, 10, None, None, None, self.db)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        events_db_manager.create_event("Standup", "daily", datetime(2030, 1, 1, 10), "Room 1", ["a@a.a"], self.db)
+        page = json.loads(main.get_all_events(None, 10, None, None, None, self.db).body)
+        self.assertEqual([event["title"] for event in page["events"]], ["Standup"])
+
+        # A write of another worker is only seen in the change log
+        with Session(self.engine) as other_worker:
+            other_worker.add(events_db_manager.Event(title="Retro", date=datetime(2030, 1, 2, 10), location="Room 2"))
+            events_db_manager.record_changes(other_worker, "created", [2])
+            other_worker.commit()
+        page = json.loads(main.get_all_events(None, 10, None, None, None, self.db).body)
+        self.assertEqual([event["title"] for event in page["events"]], ["Standup", "Retro"])
+
+        # A response computed before a write is returned but not cached
+        stale_generation = self.cache.generation - 1
+        self.cache.set(("stale",), b'{"events":[]}', stale_generation)
+        self.assertIsNone(self.cache.get(("stale",)))
+
+
+class TestResponseModels(unittest.TestCase):
+    def test_every_route_declares_its_response(self):
+        # Streamed and plain-text responses have no model
+        unmodelled = ("/events/export", "/events/changes/stream", "/metrics")
+        for route in main.app.routes:
+            if isinstance(route, APIRoute):
+                self.assertTrue(route.response_model is not None or route.path in unmodelled, route.path)
+
+    def test_users_never_expose_password(self):
+        user = users_db_manager.User(id=1, username="ben", password=users_db_manager.hash_password("secret"),
+                                     email="ben@example.com")
+        self.assertEqual(json.loads(render(List[UserOut], [user])),
+                         [{"id": 1, "username": "ben", "email": "ben@example.com"}])
+
+    def test_event_participants_are_emails(self):
+        event = events_db_manager.Event(id=1, title="Standup", date=datetime(2030, 1, 1, 10), location="Room 1",
+                                        participants=[events_db_manager.EventParticipant(email="a@a.a")])
+        body = json.loads(render(Union[EventOut, MessageOut], event))
+        self.assertEqual((body["date"], body["participants"]), ("2030-01-01T10:00:00", ["a@a.a"]))
+        self.assertEqual(json.loads(render(Union[EventOut, MessageOut], {"message": "Event not found"})),
+                         {"message": "Event not found"})
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(load_test.uncovered_routes(main.app), [])
+
+    def test_compare_reports_regressions(self):
+        baseline = {"GET /events": {"p95_ms": 10.0, "requests_per_second": 100.0},
+                    "GET /users": {"p95_ms": 10.0, "requests_per_second": 100.0}}
+        results = {"GET /events": {"p95_ms": 10.5, "requests_per_second": 98.0},
+                   "GET /users": {"p95_ms": 15.0, "requests_per_second": 70.0}}
+        self.assertEqual(list(load_test.compare(baseline, results, 0.1)), ["GET /users"])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(("/events",), value)
+        lines = histogram.render().splitlines()
+        self.assertIn('test_seconds_bucket{route="/events",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{route="/events",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{route="/events",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{route="/events"} 3', lines)
+
+    def test_middleware_records_route_and_queries(self):
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine, "test")
+        app = FastAPI()
+        app.router.route_class = metrics.InstrumentedRoute
+        app.add_middleware(metrics.MetricsMiddleware)
+
+        # A sync endpoint, run in the threadpool like the routes of main.py
+        @app.get("/items/{item_id}")
+        def get_item(item_id: int):
+            with metrics.timed("test_operation"), engine.connect() as connection:
+                return {"value": connection.execute(text("SELECT :id"), {"id": item_id}).scalar()}
+
+        self.assertEqual(TestClient(app).get("/items/3").json(), {"value": 3})
+        labels = ("GET", "/items/{item_id}")
+        self.assertEqual(metrics.REQUEST_SECONDS.series(labels + ("200",))[0], 1)
+        self.assertEqual(metrics.REQUEST_DB_QUERIES.series(labels), (1, 1))
+        self.assertEqual(metrics.REQUEST_OPERATION_SECONDS.series(labels + ("test_operation",))[0], 1)
+        self.assertIn('eventmanager_db_query_duration_seconds_count{database="test"}', metrics.render())
+
+    def test_failed_query_leaves_no_start_time(self):
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine, "test")
+        with engine.connect() as connection:
+            with self.assertRaises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+            connection.execute(text("SELECT 1"))
+            self.assertEqual(connection.info["query_start"], [])
+
+
+class TestDatabase(unittest.TestCase):
+    def test_engines_are_shared_and_tuned(self):
+        self.assertIs(events_db_manager.SessionLocal.engine, main.EventSessionLocal.engine)
+        self.assertIs(database.get_async_engine(async_main.EVENTS_DATABASE_URL), async_main.EventSessionLocal.engine)
+        with tempfile.TemporaryDirectory() as directory:
+            url = f"sqlite:///{directory}/tuned.db"
+            writer = database.get_engine(url)
+            reader = database.get_engine(url, read_only=True)
+            self.assertIs(database.get_engine(url), writer)
+            self.assertIsNot(reader, writer)
+            try:
+                with writer.connect() as connection:
+                    self.assertEqual(connection.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+                    self.assertEqual(connection.execute(text("PRAGMA busy_timeout")).scalar(), 5000)
+                    connection.execute(text("CREATE TABLE t (x INTEGER)"))
+                    connection.commit()
+                with reader.connect() as connection:
+                    self.assertEqual(connection.execute(text("PRAGMA query_only")).scalar(), 1)
+                    self.assertEqual(connection.execute(text("SELECT count(*) FROM t")).scalar(), 0)
+                    with self.assertRaises(Exception):
+                        connection.execute(text("INSERT INTO t VALUES (1)"))
+            finally:
+                writer.dispose()
+                reader.dispose()
+
+    def test_imports_create_no_engine_and_models_skip_the_scheduler(self):
+        script = ("import sys, database, events_db_manager; print('apscheduler' in sys.modules); "
+                  "import main, async_main; print(len(database._engines) + len(database._async_engines))")
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.split(), ["False", "0"])
+
+    def test_lifespan_prepares_databases_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            events = database.LazySessionmaker(f"sqlite:///{directory}/events.db")
+            app = FastAPI(lifespan=eventScheduler.worker_lifespan)
+            with patch("events_db_manager.SessionLocal", events), \
+                    patch("users_db_manager.DATABASE_URL", f"sqlite:///{directory}/users.db"), \
+                    patch("eventScheduler._databases_prepared", False), \
+                    patch.object(eventScheduler.EventScheduler, "start_leader_election") as start, \
+                    patch.object(eventScheduler.EventScheduler, "stop_leader_election") as stop:
+                with TestClient(app):
+                    start.assert_called_once()
+                    with events() as db:
+                        self.assertEqual(db.query(events_db_manager.Event).count(), 0)
+                stop.assert_called_once()
+                with patch("events_db_manager.migrate_database") as migrate:
+                    eventScheduler.prepare_databases()
+                    # A worker spawned by main.py only sees the flag main.py left in its environment
+                    with patch("eventScheduler._databases_prepared", False), \
+                            patch.dict("os.environ", {eventScheduler.DATABASES_PREPARED_ENV: "1"}):
+                        eventScheduler.prepare_databases()
+                migrate.assert_not_called()
+            database.get_engine(f"sqlite:///{directory}/users.db").dispose()
+            events.engine.dispose()
+
+    def test_workers_migrate_one_after_the_other(self):
+        # As "uvicorn main:app --workers 4" starts them: every worker prepares the databases of its working directory
+        script = "import eventScheduler; eventScheduler.prepare_databases()"
+        with tempfile.TemporaryDirectory() as directory:
+            environment = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+            environment.pop(eventScheduler.DATABASES_PREPARED_ENV, None)
+            workers = [subprocess.Popen([sys.executable, "-c", script], cwd=directory, env=environment,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(4)]
+            errors = [worker.communicate()[1] for worker in workers]
+            self.assertEqual([worker.returncode for worker in workers], [0] * 4, errors)
+            engine = create_engine(f"sqlite:///{directory}/events.db")
+            with engine.connect() as connection:
+                self.assertIsNone(connection.scalar(text("SELECT owner FROM scheduler_leases")))
+                self.assertEqual(connection.scalar(text("SELECT count(*) FROM apscheduler_jobs")), 0)
+            engine.dispose()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,13 +1,181 @@
-import functools
 import os
-import ssl
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import partial
 
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
 from datetime import datetime, timedelta
-import smtplib
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
 
+import database
 import events_db_manager
+import metrics
+import reminder_digest
+import users_db_manager
+from email_delivery import SMTPDeliveryWorker
+from recurrence import next_occurrence
+
+# Reminders are sent this many minutes before the event, and are still sent this late after a restart
+REMINDER_MINUTES_BEFORE = 30
+# Reminders due within this many seconds of each other are sent as one digest per recipient, 0 disables digests
+REMINDER_DIGEST_SECONDS = float(os.environ.get("REMINDER_DIGEST_SECONDS", "0"))
+
+# Number of uvicorn worker processes. Every worker serves HTTP and writes its reminder work to the reminder_outbox
+# table, and only the worker holding the scheduler lease runs the scheduler, drains the outbox and sends emails.
+WORKERS = int(os.environ.get("EVENT_MANAGER_WORKERS", "1"))
+LEASE_NAME = "reminder-dispatch"
+# A leader that stops renewing its lease for this long is replaced
+LEASE_SECONDS = 15
+# The leader renews its lease and drains the outbox this often, and right after each write of its own process
+OUTBOX_POLL_SECONDS = 1
+OUTBOX_BATCH_SIZE = 500
+# A claimed row is claimed again after this long if its dispatcher did not finish it, e.g. because it died
+OUTBOX_CLAIM_SECONDS = 60
+# A failed row is retried after OUTBOX_RETRY_SECONDS, doubled at each attempt up to OUTBOX_MAX_RETRY_SECONDS
+OUTBOX_RETRY_SECONDS = 5
+OUTBOX_MAX_RETRY_SECONDS = 600
+
+# Workers started without main.py, e.g. by "uvicorn main:app --workers N", all prepare the databases at startup.
+# They take turns through this lease, and a worker that died while migrating is replaced after the lease expires.
+MIGRATION_LEASE_NAME = "schema-migration"
+MIGRATION_LEASE_SECONDS = 300
+MIGRATION_POLL_SECONDS = 0.1
+
+# Set once this process has created and migrated the tables
+_databases_prepared = False
+# Set by main.py in its environment once it has migrated the tables, before starting the workers. uvicorn spawns
+# them, so they do not inherit _databases_prepared but do inherit the environment.
+DATABASES_PREPARED_ENV = "EVENT_MANAGER_DATABASES_PREPARED"
+
+
+def send_event_reminder(event_id, occurrence=None):
+    """
+    Job function of the reminder jobs. It is stored by reference with only the event ID as argument,
+    so jobs survive in the persistent job store and always send the current state of the event.
+    A recurring event has a single job, for its next occurrence, which moves on to the following occurrence
+    once it has run.
+
+    Args:
+        event_id (int): ID of the event.
+        occurrence (datetime): Date of the occurrence of a recurring event.
+    """
+    with events_db_manager.SessionLocal() as db:
+        event = (db.query(events_db_manager.Event)
+                 .options(selectinload(events_db_manager.Event.participants),
+                          selectinload(events_db_manager.Event.exceptions))
+                 .filter(events_db_manager.Event.id == event_id).first())
+        if event is None:
+            return
+        if occurrence is None or occurrence not in {exception.occurrence for exception in event.exceptions}:
+            EventScheduler().remind(event, occurrence)
+        if event.recurrence:
+            EventScheduler().schedule_reminder(event, after=occurrence)
+
+
+def retry_delay(attempts):
+    """
+    Returns:
+        float: Seconds before retrying an outbox row or a reminder that failed at its `attempts`-th attempt.
+    """
+    return min(OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_SECONDS)
+
+
+def acquire_lease(engine, name, owner, now=None, seconds=LEASE_SECONDS):
+    """
+    Takes or renews a lease in one statement, so two processes can never both get it.
+    The lease is granted if it is free, already held by `owner`, or expired.
+
+    Args:
+        engine (Engine): Engine of the database holding the scheduler_leases table.
+        name (str): Name of the lease.
+        owner (str): ID of the calling process.
+        now (float): Current Unix time, defaults to time.time().
+        seconds (float): Duration of the lease.
+
+    Returns:
+        bool: True if `owner` holds the lease for the next `seconds`.
+    """
+    now = time.time() if now is None else now
+    lease = events_db_manager.SchedulerLease.__table__
+    statement = sqlite_insert(lease).values(name=name, owner=owner, expires_at=now + seconds)
+    statement = statement.on_conflict_do_update(
+        index_elements=[lease.c.name],
+        set_={"owner": statement.excluded.owner, "expires_at": statement.excluded.expires_at},
+        where=(lease.c.owner == owner) | (lease.c.expires_at < now))
+    with engine.begin() as connection:
+        return connection.execute(statement).rowcount == 1
+
+
+def release_lease(engine, name, owner):
+    """
+    Gives up a lease held by `owner`, so another process can take it without waiting for it to expire.
+    """
+    lease = events_db_manager.SchedulerLease
+    with engine.begin() as connection:
+        connection.execute(delete(lease).where(lease.name == name, lease.owner == owner))
+
+
+def prepare_databases():
+    """
+    Creates and migrates the tables of both databases, once: main.py runs it before starting the workers and
+    sets DATABASES_PREPARED_ENV for them, and the lifespan of a process started another way runs it before serving.
+    Processes preparing the same databases at once run the migration one after the other, holding
+    MIGRATION_LEASE_NAME, so none of them creates a table or adds a column another one just did. The ones after
+    the first find nothing left to do.
+    """
+    global _databases_prepared
+    if _databases_prepared or os.environ.get(DATABASES_PREPARED_ENV) == "1":
+        return
+    engine = events_db_manager.SessionLocal.engine
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    _create_table(engine, events_db_manager.SchedulerLease.__table__)
+    while not acquire_lease(engine, MIGRATION_LEASE_NAME, owner, seconds=MIGRATION_LEASE_SECONDS):
+        time.sleep(MIGRATION_POLL_SECONDS)
+    try:
+        events_db_manager.migrate_database()
+        users_db_manager.migrate_users(database.get_engine(users_db_manager.DATABASE_URL))
+        # Every worker's scheduler creates the job store table when it starts, it must exist by then
+        _create_table(engine, SQLAlchemyJobStore(engine=engine).jobs_t)
+    finally:
+        release_lease(engine, MIGRATION_LEASE_NAME, owner)
+    _databases_prepared = True
+
+
+def _create_table(engine, table):
+    """
+    Creates a table if it does not exist, when another process may be creating it at the same time: the check
+    and the CREATE TABLE of checkfirst are two statements, so both processes can pass the check.
+    """
+    try:
+        table.create(engine, checkfirst=True)
+    except OperationalError as e:
+        if "already exists" not in str(e):
+            raise
+
+
+@asynccontextmanager
+async def worker_lifespan(app):
+    """
+    Lifespan of main.app and async_main.app. Every worker process runs it: it prepares the databases, takes part in
+    the election of the worker that sends the reminders, and closes the database connections at shutdown. Engines
+    and the EventScheduler are created on first use, so importing the apps does neither.
+    """
+    await run_in_threadpool(prepare_databases)
+    EventScheduler().start_leader_election()
+    try:
+        yield
+    finally:
+        EventScheduler().stop_leader_election()
+        await database.dispose_engines()
 
 
 class EventScheduler:
@@ -27,58 +195,241 @@ class EventScheduler:
     def __init__(self):
         """
         Initializes the EventScheduler instance with necessary attributes.
+        Runs only once, since every EventScheduler() call returns the same instance.
         """
-        self.scheduler = BackgroundScheduler()
+        if getattr(self, "_initialized", False):
+            return
+        self._initialized = True
+        # Jobs are kept in the apscheduler_jobs table of the events database, so they survive restarts
+        self.job_store = SQLAlchemyJobStore(engine=events_db_manager.SessionLocal.engine)
+        self.scheduler = BackgroundScheduler(
+            jobstores={"default": self.job_store},
+            job_defaults={"misfire_grace_time": REMINDER_MINUTES_BEFORE * 60, "coalesce": True},
+        )
         self.username = os.environ.get("EMAIL_SENDER_USERNAME", "eventManager")
         self.password = os.environ.get("EMAIL_SENDER_PASSWORD", "gzic evwm ibig qiag")
         self.sender = os.environ.get("SENDER", "personaleventmanager@gmail.com")
+        self.delivery = SMTPDeliveryWorker(
+            host=os.environ.get("SMTP_HOST", "smtp.gmail.com"),
+            port=int(os.environ.get("SMTP_PORT", "587")),
+            username=self.username,
+            password=self.password,
+            use_tls=os.environ.get("SMTP_USE_TLS", "1") == "1",
+            pool_size=int(os.environ.get("SMTP_POOL_SIZE", "2")),
+            queue_size=int(os.environ.get("SMTP_QUEUE_SIZE", "10000")),
+            batch_size=int(os.environ.get("SMTP_BATCH_SIZE", "50")),
+        )
+        metrics.register_collector(self.delivery.metric_samples)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self._stop_election = threading.Event()
+        self._wakeup = threading.Event()
+        self._election_thread = None
 
     def create_scheduler(self):
         """
-        Initializes the BackgroundScheduler instance.
+        Starts the BackgroundScheduler instance and the email delivery threads.
         """
         self.scheduler.start()
+        self.delivery.start()
+
+    def start_leader_election(self):
+        """
+        Starts the scheduler paused and a thread that competes for the scheduler lease, called in every worker.
+        The worker holding the lease resumes its scheduler and drains the outbox written by all workers, the others
+        only keep trying to take over.
+        """
+        self.scheduler.start(paused=True)
+        self.delivery.start()
+        self._stop_election.clear()
+        self._election_thread = threading.Thread(target=self._run_election, name="scheduler-leader", daemon=True)
+        self._election_thread.start()
+
+    def stop_leader_election(self):
+        """
+        Stops competing for the lease and releases it if this worker is the leader, so another worker takes over
+        at its next poll.
+        """
+        self._stop_election.set()
+        self._wakeup.set()
+        if self._election_thread is not None:
+            self._election_thread.join()
+            self._election_thread = None
+        if self.is_leader:
+            self.is_leader = False
+            self.scheduler.pause()
+            release_lease(self.job_store.engine, LEASE_NAME, self.worker_id)
+        self.scheduler.shutdown(wait=False)
+        self.delivery.stop()
+
+    def _run_election(self):
+        while not self._stop_election.is_set():
+            try:
+                self.poll_leadership()
+            except Exception as e:
+                print(e)
+            self._wakeup.wait(OUTBOX_POLL_SECONDS)
+            self._wakeup.clear()
+
+    def notify(self):
+        """
+        Drains the outbox now instead of at the next poll, called after a commit that wrote to it.
+        Only the leader's dispatcher is woken up, the other workers' writes are picked up by its polling.
+        """
+        if self.is_leader:
+            self._wakeup.set()
 
-    def add_event(self, event):
+    def poll_leadership(self, now=None):
         """
-        Adds a new event and schedules a reminder email.
+        Renews or takes the lease, then drains the outbox and sends the due reminders if this worker is the leader.
+        A new leader also schedules the reminders missing from the job store. A worker that lost the lease,
+        e.g. because it was stalled for longer than LEASE_SECONDS, pauses its scheduler.
 
         Args:
-            event: Object representing the event.
+            now (float): Current Unix time, defaults to time.time().
+
+        Returns:
+            bool: True if this worker is the leader.
         """
-        self.schedule_reminder(event)
+        leader = acquire_lease(self.job_store.engine, LEASE_NAME, self.worker_id, now)
+        if leader and not self.is_leader:
+            self.is_leader = True
+            with Session(self.job_store.engine) as db:
+                self.rehydrate(db)
+            self.scheduler.resume()
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            self.scheduler.pause()
+        if self.is_leader:
+            while self.process_outbox() == OUTBOX_BATCH_SIZE:
+                pass
+            self.send_due_reminders()
+        return self.is_leader
 
-    def update_reminder(self, event_id, updated_event, db):
+    def process_outbox(self, now=None):
         """
-        Updates an existing event and reschedules the reminder email.
+        Claims a batch of outbox rows and applies them in order.
+
+        Claiming pushes the rows' available_at OUTBOX_CLAIM_SECONDS ahead, so no other dispatcher takes them
+        meanwhile. Events are read once for the batch, and rows of events deleted since are dropped. Reminder jobs
+        are idempotent, they are set to the current state of the event. Invitation rows stay claimed until their
+        emails are delivered, see deliver_invitation. Rows that failed are retried with exponential backoff.
 
         Args:
-            event_id (int): ID of the event to update.
-            updated_event: Updated event object.
-            db: Database session.
+            now (float): Current Unix time, defaults to time.time().
+
+        Returns:
+            int: Number of claimed rows.
         """
-        for i, existing_event in enumerate(events_db_manager.get_all_events("date", db)):
-            if existing_event.id == event_id:
-                self.remove_job(event_id)  # Remove existing job
-                self.schedule_reminder(updated_event)  # Schedule reminder for updated event
-                break
+        now = time.time() if now is None else now
+        outbox = events_db_manager.ReminderOutbox
+        event_model = events_db_manager.Event
+        claimable = (select(outbox.id).where(outbox.available_at <= now).order_by(outbox.id)
+                     .limit(OUTBOX_BATCH_SIZE).scalar_subquery())
+        with self.job_store.engine.begin() as connection:
+            rows = connection.execute(
+                update(outbox).where(outbox.id.in_(claimable))
+                .values(attempts=outbox.attempts + 1, available_at=now + OUTBOX_CLAIM_SECONDS)
+                .returning(outbox.id, outbox.action, outbox.event_id, outbox.attempts)).all()
+        if not rows:
+            return 0
+        rows.sort(key=lambda row: row.id)
+
+        with Session(self.job_store.engine, expire_on_commit=False) as db:
+            event_ids = {row.event_id for row in rows if row.action != "remove"}
+            events = {event.id: event for event in db.scalars(
+                select(event_model).options(selectinload(event_model.participants),
+                                            selectinload(event_model.exceptions))
+                .where(event_model.id.in_(event_ids)))}
+
+        done, failed, invitations = [], {}, []
+        for row in rows:
+            event = events.get(row.event_id)
+            try:
+                if row.action == "remove":
+                    self.remove_job(row.event_id)
+                elif event is None:
+                    pass
+                elif row.action == "schedule":
+                    self.schedule_reminder(event)
+                else:
+                    invitations.append(row)
+                    continue
+                done.append(row.id)
+            except Exception as e:
+                print(e)
+                failed[row.id] = (row.attempts, str(e))
 
-    def schedule_reminder(self, event):
+        with self.job_store.engine.begin() as connection:
+            if done:
+                connection.execute(delete(outbox).where(outbox.id.in_(done)))
+            for row_id, (attempts, error) in failed.items():
+                connection.execute(update(outbox).where(outbox.id == row_id)
+                                   .values(available_at=now + retry_delay(attempts), last_error=error))
+        for row in invitations:
+            self.deliver_invitation(row.id, row.attempts, events[row.event_id])
+        return len(rows)
+
+    def finish_outbox_row(self, row_id, attempts, error, now=None):
         """
-        Schedules a job to send a reminder email 30 minutes before the event.
+        Deletes an outbox row once it is applied, or makes it claimable again after a backoff if it failed.
 
         Args:
-            event: Object representing the event.
+            row_id (int): ID of the outbox row.
+            attempts (int): Number of times the row was claimed, including the current one.
+            error (str): Error message, None if the row was applied.
+            now (float): Current Unix time, defaults to time.time().
         """
-        event_start_time = event.date
-        reminder_time = event_start_time - timedelta(minutes=30)
+        now = time.time() if now is None else now
+        outbox = events_db_manager.ReminderOutbox
+        with self.job_store.engine.begin() as connection:
+            if error is None:
+                connection.execute(delete(outbox).where(outbox.id == row_id))
+            else:
+                connection.execute(update(outbox).where(outbox.id == row_id)
+                                   .values(available_at=now + retry_delay(attempts), last_error=error))
 
-        # Construct a CronTrigger for 30 minutes before the event
-        trigger = CronTrigger(hour=reminder_time.hour, minute=reminder_time.minute)
+    @staticmethod
+    def job_id(event_id):
+        """
+        Returns:
+            str: ID of the reminder job of an event.
+        """
+        return f"event-{event_id}"
 
-        self.scheduler.add_job(
-            functools.partial(self.send_reminder, event), trigger
-        )
+    @staticmethod
+    def next_reminder(event, after=None):
+        """
+        Returns the occurrence whose reminder is scheduled next: the event's date for a single event, the first
+        occurrence after `after` (default now) that is not cancelled for a recurring one.
+
+        Returns:
+            datetime: Date of the occurrence, None if a recurring event has no occurrence left.
+        """
+        if not event.recurrence:
+            return event.date
+        cancelled = [exception.occurrence for exception in event.exceptions]
+        return next_occurrence(event.recurrence, event.date, after or datetime.now(), cancelled)
+
+    def schedule_reminder(self, event, after=None):
+        """
+        Schedules a one-shot job to send a reminder email 30 minutes before the event, or before the next
+        occurrence of a recurring event, so a series has a single job whatever its number of occurrences.
+        Scheduling an event again replaces its job.
+
+        Args:
+            event: Object representing the event.
+            after (datetime): For a recurring event, the occurrence just reminded, the job moves to the next one.
+        """
+        occurrence = self.next_reminder(event, after)
+        if occurrence is None:
+            self.remove_job(event.id)
+            return
+        reminder_time = occurrence - timedelta(minutes=REMINDER_MINUTES_BEFORE)
+        args = [event.id, occurrence] if event.recurrence else [event.id]
+        with metrics.timed("scheduler_add"):
+            self.scheduler.add_job(send_event_reminder, DateTrigger(run_date=reminder_time), args=args,
+                                   id=self.job_id(event.id), replace_existing=True)
 
     def remove_job(self, event_id):
         """
@@ -87,32 +438,118 @@ class EventScheduler:
         Args:
             event_id (int): ID of the event whose job needs removal.
         """
-        for job in self.scheduler.get_jobs():
-            if job.id.startswith(str(event_id)):
-                self.scheduler.remove_job(job.id)
-                break
+        try:
+            with metrics.timed("scheduler_remove"):
+                self.scheduler.remove_job(self.job_id(event_id))
+        except JobLookupError:
+            pass
+
+    def rehydrate(self, db):
+        """
+        Schedules the reminders of upcoming events that have no job in the job store yet,
+        e.g. events created before the job store existed. Reads the events table in a single query.
+        Call it once the scheduler is started, which creates the job store table.
+
+        Args:
+            db: Database session.
+
+        Returns:
+            int: Number of scheduled reminders.
+        """
+        with self.job_store.engine.connect() as connection:
+            existing_job_ids = set(connection.scalars(select(self.job_store.jobs_t.c.id)))
+
+        event_model = events_db_manager.Event
+        now = datetime.now()
+        upcoming = db.execute(select(event_model.id, event_model.date, event_model.recurrence)
+                              .where(event_model.recurrence.is_(None), event_model.date > now)).all()
+        # Series are few, one row each whatever their number of occurrences
+        upcoming += db.scalars(select(event_model).options(selectinload(event_model.exceptions)).where(
+            event_model.recurrence.isnot(None),
+            (event_model.recurrence_end.is_(None)) | (event_model.recurrence_end > now))).all()
+        scheduled = 0
+        for event in upcoming:
+            if self.job_id(event.id) not in existing_job_ids:
+                self.schedule_reminder(event)
+                scheduled += 1
+        return scheduled
 
-    def send_reminder(self, event):
+    def deliver_invitation(self, row_id, attempts, event):
         """
-        Sends a reminder email for the event.
+        Queues an invitation email for every participant of the event of an outbox "send" row.
+        Delivery happens on the background SMTP worker, so this returns immediately. The row is finished once
+        every email is done: deleted if all were sent, retried if one failed or was dropped.
 
         Args:
+            row_id (int): ID of the outbox row.
+            attempts (int): Number of times the row was claimed, including the current one.
             event: Object representing the event.
         """
-        try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP(host='smtp.gmail.com', port=587) as smtp:
-                smtp.starttls(context=context)  # Start TLS for encryption
-                smtp.login(self.username, self.password)
-                message = (f"You are invited to the event {event.title}"
-                           f"\n Description: {event.description}"
-                           f"\n Location {event.location}"
-                           f"\n Invited: {event.participants}"
-                           f"\n On the date {event.date}")
-                for participant in event.participants:
-                    smtp.sendmail(self.sender, participant, message)
-
-        except smtplib.SMTPAuthenticationError as e:
-            print(e)
-        except smtplib.SMTPException as e:
-            print(e)
+        recipients = [participant.email for participant in event.participants]
+        if not recipients:
+            self.finish_outbox_row(row_id, attempts, None)
+            return
+        message = reminder_digest.render_invitation(reminder_digest.event_fields(event))
+        errors = []
+        lock = threading.Lock()
+
+        def on_done(error):
+            with lock:
+                errors.append(error)
+                if len(errors) < len(recipients):
+                    return
+            self.finish_outbox_row(row_id, attempts, next((error for error in errors if error), None))
+
+        with metrics.timed("reminder_enqueue"):
+            for recipient in recipients:
+                if not self.delivery.enqueue(self.sender, recipient, message, on_done):
+                    on_done("SMTP delivery queue is full")
+
+    def remind(self, event, occurrence=None):
+        """
+        Records the reminder of an event that is due in the reminder ledger, called by its reminder job. The leader's
+        dispatcher sends it, after the digest window if REMINDER_DIGEST_SECONDS is set, see send_due_reminders.
+
+        Args:
+            event: Object representing the event, with its participants loaded.
+            occurrence (datetime): Date of the due occurrence of a recurring event.
+        """
+        reminder_digest.record_reminders(self.job_store.engine, reminder_digest.event_fields(event, occurrence),
+                                         [participant.email for participant in event.participants])
+        self.notify()
+
+    def send_due_reminders(self, now=None):
+        """
+        Claims the due reminders of the ledger and queues one email per recipient: the event's invitation, or a
+        digest if the recipient has several events and REMINDER_DIGEST_SECONDS is set. A reminder is marked sent
+        once its email is delivered, and retried with backoff if the email failed or was dropped.
+
+        Args:
+            now (float): Current Unix time, defaults to time.time().
+
+        Returns:
+            int: Number of claimed reminders.
+        """
+        claimed = reminder_digest.claim_reminders(self.job_store.engine, REMINDER_DIGEST_SECONDS, now)
+        with metrics.timed("reminder_enqueue"):
+            for recipient, events in claimed.items():
+                for batch in ([events] if REMINDER_DIGEST_SECONDS > 0 else [[fields] for fields in events]):
+                    on_done = partial(self.finish_reminders, recipient, batch)
+                    if not self.delivery.enqueue(self.sender, recipient, reminder_digest.render_reminder(batch),
+                                                 on_done):
+                        on_done("SMTP delivery queue is full")
+        return sum(len(events) for events in claimed.values())
+
+    def finish_reminders(self, recipient, events, error):
+        """
+        Marks the reminders of a delivered email as sent, or retries them with backoff if it failed.
+
+        Args:
+            recipient (str): Recipient email.
+            events (list): Fields of the events of the email, see reminder_digest.claim_reminders.
+            error (str): Error message, None if the email was sent.
+        """
+        retry_at = None
+        if error is not None:
+            retry_at = time.time() + retry_delay(max(fields["attempts"] for fields in events))
+        reminder_digest.finish_reminders(self.job_store.engine, recipient, events, retry_at)
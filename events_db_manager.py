@@ -1,21 +1,56 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
 from typing import List, Optional
+import base64
+import csv
+import heapq
+import io
+import json
+import os
 import re
 
-from fastapi import Body, Depends, Query, Path
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi import Body, Depends, Query, Path, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import (func, inspect, insert, or_, select, text, update, Column, Integer, Float, String, DateTime,
+                        ForeignKey, Index, tuple_)
+from sqlalchemy.orm import declarative_base, deferred, relationship, selectinload
+from sqlalchemy.orm import Session
 
-from eventScheduler import EventScheduler as eventScheduler
+import database
+from change_feed import change_feed
+from recurrence import is_occurrence, normalize_rule, occurrences
+from response_cache import event_key, response_cache
+from schemas import ConflictOut, EventCreate
 
 # Base class for SQLAlchemy models
 Base = declarative_base()
 
 DATABASE_URL = "sqlite:///events.db"
-# SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLAlchemy sessions on the same engine main.py uses for the events database, created with the first session
+SessionLocal = database.LazySessionmaker(DATABASE_URL, autocommit=False, autoflush=False)
+
+# Page size limits of GET /events
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Basic email format, compiled once for all participants
+EMAIL_REGEX = re.compile(r"^[^@]+@[^@]+\.[^@]+$")
+# Size of the LRU cache of checked participant emails, 0 disables it
+EMAIL_CACHE_SIZE = int(os.environ.get("EMAIL_VALIDATION_CACHE_SIZE", "0"))
+# Maximum number of events in one POST /events/bulk request
+MAX_BULK_EVENTS = 10000
+# Rows fetched per round trip by GET /events/export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "title", "description", "date", "end", "location", "recurrence", "participants")
+# Length of an event created without an end, and of the events stored before events had one
+DEFAULT_EVENT_DURATION = timedelta(minutes=int(os.environ.get("DEFAULT_EVENT_MINUTES", "60")))
+# No event lasts longer, so the events overlapping a slot all start less than this before it: conflict lookups read
+# a bounded range of the (location, date) and (date, id) indexes. Lowering it hides the longer events stored before.
+MAX_EVENT_DURATION = timedelta(hours=int(os.environ.get("MAX_EVENT_HOURS", "24")))
+# Occurrences of a recurring event checked for conflicts when it is written, from its first one
+MAX_CHECKED_OCCURRENCES = 100
+# Longest range of GET /events/conflicts
+MAX_CONFLICT_RANGE = timedelta(days=31)
 
 
 class Event(Base):
@@ -28,13 +63,425 @@ class Event(Base):
     description = Column(String)
     date = Column(DateTime, nullable=False)
     location = Column(String, nullable=False)
-    participants = Column(String, nullable=False)
+    # Comma-joined participants from before the event_participants table, emptied by migrate_participants
+    legacy_participants = deferred(Column("participants", String, nullable=False, default=""))
+    participants = relationship("EventParticipant", cascade="all, delete-orphan", passive_deletes=True)
+    # RRULE of a recurring event, e.g. "FREQ=WEEKLY;BYDAY=MO", None for a single event. The series starts at date
+    # and its occurrences are expanded when queried, never stored.
+    recurrence = Column(String)
+    # Date of the last occurrence of a bounded series, None for an unbounded one
+    recurrence_end = Column(DateTime)
+    exceptions = relationship("EventException", cascade="all, delete-orphan", passive_deletes=True)
+    # End of the event, at most MAX_EVENT_DURATION after its date. Every occurrence of a series lasts as long.
+    end = Column(DateTime)
+    # Keyset pagination on (date, id) and (location, id), and conflicts at a location on (location, date)
+    __table_args__ = (Index("ix_events_date_id", "date", "id"),
+                      Index("ix_events_location_id", "location", "id"),
+                      Index("ix_events_location_date", "location", "date"))
+
+# Fields that can be selected with the fields parameter of GET /events
+EVENT_FIELDS = ("id", "title", "description", "date", "location", "participants", "recurrence", "end")
+# Fields accepted by GET /events/{filter_by}/{filter_value}
+FILTERABLE_FIELDS = ("title", "description", "location", "date", "participants")
+
+# Case-insensitive prefix filters: SQLite only serves "column LIKE 'prefix%'" from an index with NOCASE collation
+Index("ix_events_title_nocase", Event.title.collate("NOCASE"))
+Index("ix_events_description_nocase", Event.description.collate("NOCASE"))
+Index("ix_events_location_nocase", Event.location.collate("NOCASE"))
+# Range queries read every recurring event, whatever its first date, from this partial index of the series only
+Index("ix_events_series_date", Event.date, sqlite_where=Event.recurrence.isnot(None))
+
+
+class EventParticipant(Base):
+    """
+    SQLAlchemy model linking an Event to one participant email address.
+    The primary key (event_id, email) serves membership checks, the (email, event_id) index serves
+    "which events is this participant invited to".
+    """
+    __tablename__ = "event_participants"
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    email = Column(String, primary_key=True)
+    __table_args__ = (Index("ix_event_participants_email_event_id", "email", "event_id"),)
+
+
+class EventException(Base):
+    """
+    SQLAlchemy model of a cancelled occurrence of a recurring event, an EXDATE of its series.
+    """
+    __tablename__ = "event_exceptions"
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    occurrence = Column(DateTime, primary_key=True)
+
+
+class EventChange(Base):
+    """
+    SQLAlchemy model of the change log: one row per created, updated or deleted event, written in the transaction
+    of the change. AUTOINCREMENT keeps seq increasing even after the last rows are deleted.
+    """
+    __tablename__ = "event_changes"
+    seq = Column(Integer, primary_key=True)
+    event_id = Column(Integer, nullable=False)
+    # "created", "updated" or "deleted"
+    action = Column(String, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.now)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class ReminderOutbox(Base):
+    """
+    SQLAlchemy model of the reminder outbox: the reminder side effects of an event change, committed in the same
+    transaction as the change. The scheduler's dispatcher claims them in batches and retries failed ones with
+    backoff, see EventScheduler.process_outbox.
+    """
+    __tablename__ = "reminder_outbox"
+    id = Column(Integer, primary_key=True)
+    # "send", "schedule" or "remove"
+    action = Column(String, nullable=False)
+    # No foreign key: the remove row of a deleted event outlives the event
+    event_id = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Unix time from which the row can be claimed, pushed back while it is claimed and after each failure
+    available_at = Column(Float, nullable=False, default=0.0)
+    last_error = Column(String)
+
+
+class SentReminder(Base):
+    """
+    SQLAlchemy model of the reminder ledger: one row per due reminder and recipient, kept once sent so the reminder
+    is not sent again, see reminder_digest. The event date is part of the key, so a rescheduled event is reminded
+    again.
+    """
+    __tablename__ = "sent_reminders"
+    event_id = Column(Integer, primary_key=True)
+    email = Column(String, primary_key=True)
+    event_date = Column(DateTime, primary_key=True, index=True)
+    # Template fields as JSON, see reminder_digest.event_fields
+    fields = Column(String)
+    # Unix time from which the reminder can be claimed, pushed back while it is claimed and after a failure.
+    # None once it is sent, as for the rows written before reminders were tracked until delivery.
+    available_at = Column(Float)
+    attempts = Column(Integer, default=0)
+
+
+class SchedulerLease(Base):
+    """
+    SQLAlchemy model of a lease, held by the process named in owner until expires_at (Unix time).
+    """
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)
+
+
+def eventScheduler():
+    """
+    Returns the EventScheduler, whose module is only imported once an event is written, so the tools that only
+    need the models do not load APScheduler and the SMTP worker.
+    """
+    from eventScheduler import EventScheduler
+    return EventScheduler()
+
+
+def queue_reminders(db, actions, event_ids):
+    """
+    Adds the reminder side effects of an event change to the outbox, in the transaction of the change.
+
+    Args:
+        db (Session): Database session, not committed yet.
+        actions (tuple): "send" (invitation email), "schedule" (reminder job) and/or "remove", in this order.
+        event_ids (list): IDs of the changed events.
+    """
+    db.execute(insert(ReminderOutbox), [{"action": action, "event_id": event_id}
+                                        for event_id in event_ids for action in actions])
+
+
+def record_changes(db, action, event_ids):
+    """
+    Adds the changes of events to the change log, in the transaction of the change.
+
+    Args:
+        db (Session): Database session, not committed yet.
+        action (str): "created", "updated" or "deleted".
+        event_ids (list): IDs of the changed events.
+    """
+    now = datetime.now()
+    db.execute(insert(EventChange), [{"event_id": event_id, "action": action, "changed_at": now}
+                                     for event_id in event_ids])
+
+
+def latest_change(db):
+    """
+    Returns the sequence number of the last change of any event, 0 if there is none. Every worker writes to the
+    change log, so it tells a worker whether its cached responses are still current. Reading the largest
+    primary key is a single index lookup.
+    """
+    return db.query(func.max(EventChange.seq)).scalar() or 0
+
+
+def validate_recurrence(recurrence, date):
+    """
+    Validates the recurrence rule of an event.
+
+    Args:
+        recurrence (Optional[str]): RRULE of the event, None or empty for a single event.
+        date (datetime): Date of the event, the first occurrence of the series.
+
+    Returns:
+        tuple: The rule to store and the date of the last occurrence, see recurrence.normalize_rule.
+
+    Raises:
+        HTTPException: 422 in the format of FastAPI's validation errors if the rule is invalid.
+    """
+    if not recurrence:
+        return None, None
+    try:
+        return normalize_rule(recurrence, date)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=[{"type": "value_error", "loc": ["body", "recurrence"],
+                                                      "msg": str(e), "input": recurrence}])
+
+
+def naive_utc(value):
+    """
+    Returns a datetime in the form dates are stored and compared in: naive. A timezone-aware datetime, e.g. parsed
+    from "2030-01-01T10:00:00Z", is converted to UTC first, since Python cannot compare it with a naive one.
+
+    Args:
+        value (Optional[datetime]): Datetime from the client, may be None.
+
+    Returns:
+        Optional[datetime]: The naive datetime, None for None.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def event_end(end, date):
+    """
+    Returns:
+        datetime: The end of an event starting at `date`, date + DEFAULT_EVENT_DURATION if `end` is None.
+
+    Raises:
+        ValueError: If the end is not after the date, or more than MAX_EVENT_DURATION after it.
+    """
+    if end is None:
+        return date + DEFAULT_EVENT_DURATION
+    if end <= date:
+        raise ValueError("end must be after date")
+    if end - date > MAX_EVENT_DURATION:
+        raise ValueError(f"an event must not last longer than {MAX_EVENT_DURATION}")
+    return end
+
+
+def validate_end(end, date):
+    """
+    Validates the end of an event, see event_end.
+
+    Raises:
+        HTTPException: 422 in the format of FastAPI's validation errors if the end is invalid.
+    """
+    try:
+        return event_end(end, date)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=[{"type": "value_error", "loc": ["body", "end"], "msg": str(e),
+                                                      "input": end.isoformat()}])
+
+
+def _duration(event):
+    # Events stored before they had an end last DEFAULT_EVENT_DURATION
+    return event.end - event.date if event.end is not None else DEFAULT_EVENT_DURATION
+
+
+def _slot(event_id, title, date, end, location):
+    # An event, or one occurrence of a recurring event, as in ConflictOut
+    return {"id": event_id, "title": title, "date": date, "end": end, "location": location}
+
+
+def find_conflicts(title, date, end, location, participants, db, recurrence=None, exceptions=(), event_id=None):
+    """
+    Finds the existing events that overlap an event at the same location or with a participant in common.
+
+    Since no event lasts longer than MAX_EVENT_DURATION, the single events overlapping [date, end) start between
+    date - MAX_EVENT_DURATION and end: they are read from a bounded range of the (location, date) index, and of the
+    (date, id) index for the shared participants, so the cost does not grow with the size of the table. Recurring
+    events are read once from their partial index and their occurrences expanded around the event. A recurring
+    event is checked on its next MAX_CHECKED_OCCURRENCES occurrences from now, or from its date if it is later.
+
+    Args:
+        title (str): Title of the event.
+        date (datetime): Date of the event, the first occurrence of a series.
+        end (datetime): End of the event, or of the first occurrence of a series.
+        location (str): Location of the event.
+        participants (List[str]): Normalized participant emails of the event.
+        db (Session): Database session.
+        recurrence (Optional[str]): Normalized RRULE of a recurring event.
+        exceptions: Dates of the cancelled occurrences of a recurring event.
+        event_id (Optional[int]): ID of the event when it is updated, it does not conflict with itself.
+
+    Returns:
+        list: Conflicts as in ConflictOut, sorted by date.
+    """
+    date, end = naive_utc(date), naive_utc(end)
+    duration = end - date
+    dates = [date]
+    if recurrence:
+        # Past occurrences cannot be booked anymore, an occurrence still running now is checked
+        start = max(date, datetime.now() - duration)
+        dates = islice(occurrences(recurrence, date, start, exceptions=exceptions), MAX_CHECKED_OCCURRENCES)
+    slots = [(start, start + duration) for start in dates]
+    if not slots:
+        return []
+    participants = list(participants)
+    shares_participant = Event.participants.any(EventParticipant.email.in_(participants))
+    conflicts = []
+
+    def add(start, other, other_date):
+        emails = sorted({participant.email for participant in other.participants}.intersection(participants))
+        conflicts.append({"first": _slot(event_id, title, start, start + duration, location),
+                          "second": _slot(other.id, other.title, other_date, other_date + _duration(other),
+                                          other.location),
+                          "same_location": other.location == location, "participants": emails})
+
+    for start, stop in slots:
+        window = (Event.recurrence.is_(None), Event.date > start - MAX_EVENT_DURATION, Event.date < stop,
+                  Event.end > start, Event.id != event_id)
+        singles = db.query(Event).options(selectinload(Event.participants))
+        overlapping = singles.filter(Event.location == location, *window).all()
+        if participants:
+            overlapping += singles.filter(*window, Event.location != location, shares_participant).all()
+        for other in overlapping:
+            add(start, other, other.date)
+
+    series = (db.query(Event).options(selectinload(Event.participants), selectinload(Event.exceptions))
+              .filter(Event.recurrence.isnot(None), Event.date < slots[-1][1], Event.id != event_id,
+                      or_(Event.recurrence_end.is_(None), Event.recurrence_end > slots[0][0] - MAX_EVENT_DURATION),
+                      or_(Event.location == location, shares_participant)))
+    for other in series:
+        other_duration = _duration(other)
+        cancelled = [exception.occurrence for exception in other.exceptions]
+        for start, stop in slots:
+            for occurrence in occurrences(other.recurrence, other.date, start - other_duration, stop, cancelled):
+                if occurrence + other_duration > start:
+                    add(start, other, occurrence)
+    conflicts.sort(key=lambda conflict: (conflict["first"]["date"], conflict["second"]["date"],
+                                         conflict["second"]["id"]))
+    return conflicts
+
+
+def check_conflicts(mode, conflicts):
+    """
+    Applies the conflict-check mode of POST and PUT /events to the conflicts found.
+
+    Args:
+        mode (Optional[str]): "reject" to refuse an event with conflicts, "flag" to write it and return them.
+        conflicts (list): Conflicts found by find_conflicts.
+
+    Returns:
+        dict: The conflicts to add to the response with "flag", nothing otherwise.
+
+    Raises:
+        HTTPException: 409 with the conflicts if the mode is "reject" and there are any.
+    """
+    if mode == "reject" and conflicts:
+        raise HTTPException(status_code=409, detail={
+            "message": "Event conflicts with existing events",
+            "conflicts": [ConflictOut.model_validate(conflict).model_dump(mode="json") for conflict in conflicts]})
+    return {"conflicts": conflicts} if mode == "flag" else {}
+
+
+def _check_written_event(db, mode, title, date, end, location, participants, recurrence, exceptions, event_id):
+    # Called once the event is flushed: the write holds SQLite's write lock until commit, so no other request can
+    # write an overlapping event between the check and the commit. A rejected event is rolled back.
+    try:
+        return check_conflicts(mode, find_conflicts(title, date, end, location, participants, db, recurrence,
+                                                    exceptions, event_id))
+    except HTTPException:
+        db.rollback()
+        raise
+
+
+def get_conflicts(start: datetime, end: datetime, location: Optional[str] = None, participant: Optional[str] = None,
+                  limit: int = DEFAULT_PAGE_SIZE, db: Session = None):
+    """
+    Finds the pairs of overlapping events, or occurrences of recurring events, at the same location or with a
+    participant in common, between two dates.
+
+    The single events overlapping the range are read from a bounded range of the (date, id) index, see
+    find_conflicts, and the occurrences of the recurring events are expanded over it. A sweep over all of them in
+    date order then only compares each one with the events still running at the same location or with the same
+    participants.
+
+    Args:
+        start (datetime): Start of the range, inclusive.
+        end (datetime): End of the range, exclusive, at most MAX_CONFLICT_RANGE after start.
+        location (Optional[str]): Only the events at this location.
+        participant (Optional[str]): Only the events of this participant.
+        limit (int): Maximum number of conflicts returned.
+        db (Session): Database session.
+
+    Returns:
+        dict: The conflicts, sorted by the date of their later event.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > MAX_CONFLICT_RANGE:
+        raise HTTPException(status_code=400, detail=f"The range must not be longer than {MAX_CONFLICT_RANGE.days} days")
+    events = db.query(Event).options(selectinload(Event.participants))
+    if location is not None:
+        events = events.filter(Event.location == location)
+    if participant is not None:
+        events = events.filter(Event.participants.any(EventParticipant.email == normalize_email(participant)))
+
+    slots = [(event.date, event.end or event.date + DEFAULT_EVENT_DURATION, event) for event in events.filter(
+        Event.recurrence.is_(None), Event.date > start - MAX_EVENT_DURATION, Event.date < end, Event.end > start)]
+    series = events.options(selectinload(Event.exceptions)).filter(
+        Event.recurrence.isnot(None), Event.date < end,
+        or_(Event.recurrence_end.is_(None), Event.recurrence_end > start - MAX_EVENT_DURATION))
+    for event in series:
+        duration = _duration(event)
+        cancelled = [exception.occurrence for exception in event.exceptions]
+        slots += [(occurrence, occurrence + duration, event)
+                  for occurrence in occurrences(event.recurrence, event.date, start - duration, end, cancelled)
+                  if occurrence + duration > start]
+    slots.sort(key=lambda slot: (slot[0], slot[2].id))
+
+    # Slots still running at the sweep's date, by location and by participant email
+    running = {}
+    conflicts = {}
+    for index, (date, slot_end, event) in enumerate(slots):
+        keys = [("location", event.location)] + [("email", participant.email) for participant in event.participants]
+        for key in keys:
+            others = running[key] = [other for other in running.get(key, ()) if slots[other][1] > date]
+            for other in others:
+                if slots[other][2].id == event.id:
+                    continue
+                conflict = conflicts.setdefault((other, index), {"same_location": False, "participants": []})
+                if key[0] == "location":
+                    conflict["same_location"] = True
+                else:
+                    conflict["participants"].append(key[1])
+            others.append(index)
+        if len(conflicts) >= limit:
+            break
+
+    def slot(index):
+        date, slot_end, event = slots[index]
+        return _slot(event.id, event.title, date, slot_end, event.location)
+
+    return {"conflicts": [{"first": slot(first), "second": slot(second), "same_location": conflict["same_location"],
+                           "participants": sorted(conflict["participants"])}
+                          for (first, second), conflict in list(conflicts.items())[:limit]]}
 
 
 def create_event(title: str = Body(...), description: str = Body(...), date: datetime = Body(...),
-                 location: str = Body(...), participants: List[str] = Body(...), db: Session = None):
+                 location: str = Body(...), participants: List[str] = Body(...), db: Session = None,
+                 recurrence: Optional[str] = None, end: Optional[datetime] = None, conflicts: Optional[str] = None):
     """
-    Creates a new event and saves it to the database.
+    Creates a new event and saves it to the database. With a recurrence rule, the event is a series whose
+    occurrences are expanded on demand. With a conflict-check mode, the events it overlaps at the same location or
+    with a participant in common are looked up once it is written, in the same transaction, see find_conflicts.
 
     Args:
         title (str): Title of the event.
@@ -43,24 +490,115 @@ def create_event(title: str = Body(...), description: str = Body(...), date: dat
         location (str): Location of the event.
         participants (List[str]): List of participants' email addresses.
         db (Session): Database session.
+        recurrence (Optional[str]): RRULE of a recurring event, e.g. "FREQ=WEEKLY;BYDAY=MO".
+        end (Optional[datetime]): End of the event, of each occurrence for a series, defaults to
+            date + DEFAULT_EVENT_DURATION.
+        conflicts (Optional[str]): "reject" to refuse an event with conflicts, "flag" to create it and return them,
+            None for no check.
 
     Returns:
-        dict: Message indicating success or failure of event creation along with event details.
+        dict: Message indicating success or failure of event creation along with event details, and the conflicts
+            with "flag".
     """
-    for participant in participants:
-        if not is_valid_email(participant):
-            return {f"participant {participant} should be a valid email"}
-
-    new_event = Event(title=title, description=description, date=date, location=location,
-                      participants=",".join(participants))
+    date, end = naive_utc(date), naive_utc(end)
+    participants = validate_participants(participants)
+    recurrence, recurrence_end = validate_recurrence(recurrence, date)
+    end = validate_end(end, date)
+    new_event = Event(title=title, description=description, date=date, location=location, recurrence=recurrence,
+                      recurrence_end=recurrence_end, end=end,
+                      participants=[EventParticipant(email=participant) for participant in participants])
     db.add(new_event)
+    db.flush()
+    found = {}
+    if conflicts:
+        found = _check_written_event(db, conflicts, title, date, end, location, participants, recurrence, (),
+                                     new_event.id)
+    queue_reminders(db, ("send", "schedule"), [new_event.id])
+    record_changes(db, "created", [new_event.id])
     db.commit()
     db.refresh(new_event)
+    # SQLite may reuse the ID of a deleted event, drop any cached "Event not found" for it
+    response_cache.invalidate(event_key(new_event.id))
+    eventScheduler().notify()
+    change_feed.publish()
+    return {"message": "Event created successfully!", "event": new_event, **found}
+
+
+def create_events(events: List[dict] = Body(...), db: Session = None):
+    """
+    Creates many events in a single transaction.
+
+    Every row is validated first, and the participant emails of all rows are checked in one pass. The valid rows are
+    inserted with one multi-row INSERT ... RETURNING plus one executemany for their participants, and a single commit.
+    Their reminders are added to the outbox in the same transaction.
+
+    Args:
+        events (List[dict]): Events with the fields of EventCreate.
+        db (Session): Database session.
+
+    Returns:
+        dict: Number of created and failed events, and a per-row result with the new ID or the errors.
+    """
+    if len(events) > MAX_BULK_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_EVENTS} events per request")
+
+    results = [None] * len(events)
+    valid_rows = {}
+    for index, row in enumerate(events):
+        try:
+            event = EventCreate.model_validate(row)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "failed",
+                              "errors": [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]}
+        else:
+            event.date, event.end = naive_utc(event.date), naive_utc(event.end)
+            valid_rows[index] = event
+
+    participants_by_row, recurrence_by_row, end_by_row = {}, {}, {}
+    for index, event in list(valid_rows.items()):
+        participants_by_row[index], errors = normalize_participants(event.participants)
+        if errors:
+            results[index] = {"index": index, "status": "failed",
+                              "errors": [f"participant {error['input']} should be a valid email" for error in errors]}
+            del valid_rows[index]
+            continue
+        try:
+            recurrence_by_row[index] = (normalize_rule(event.recurrence, event.date) if event.recurrence
+                                        else (None, None))
+        except ValueError as e:
+            results[index] = {"index": index, "status": "failed", "errors": [f"recurrence: {e}"]}
+            del valid_rows[index]
+            continue
+        try:
+            end_by_row[index] = event_end(event.end, event.date)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "failed", "errors": [f"end: {e}"]}
+            del valid_rows[index]
+
+    if valid_rows:
+        new_ids = db.scalars(
+            insert(Event).returning(Event.id, sort_by_parameter_order=True),
+            [{"title": event.title, "description": event.description, "date": event.date, "location": event.location,
+              "recurrence": recurrence_by_row[index][0], "recurrence_end": recurrence_by_row[index][1],
+              "end": end_by_row[index]}
+             for index, event in valid_rows.items()]).all()
+        participant_rows = [{"event_id": event_id, "email": email}
+                            for event_id, index in zip(new_ids, valid_rows)
+                            for email in participants_by_row[index]]
+        if participant_rows:
+            db.execute(insert(EventParticipant), participant_rows)
+        queue_reminders(db, ("send", "schedule"), new_ids)
+        record_changes(db, "created", new_ids)
+        db.commit()
+        response_cache.invalidate(*(event_key(event_id) for event_id in new_ids))
+        eventScheduler().notify()
+        change_feed.publish()
 
-    es = eventScheduler()
-    es.send_reminder(new_event)
-    es.add_event(new_event)
-    return {"message": "Event created successfully!", "event": new_event}
+        for index, event_id in zip(valid_rows, new_ids):
+            results[index] = {"index": index, "status": "created", "id": event_id}
+
+    return {"message": f"{len(valid_rows)} events created, {len(events) - len(valid_rows)} failed",
+            "created": len(valid_rows), "failed": len(events) - len(valid_rows), "results": results}
 
 
 def get_all_events(sort_by: Optional[str] = Query(None), db: Session = None):
@@ -74,7 +612,7 @@ def get_all_events(sort_by: Optional[str] = Query(None), db: Session = None):
     Returns:
         list: List of all events.
     """
-    events = db.query(Event)
+    events = db.query(Event).options(selectinload(Event.participants))
     if sort_by == "location":
         events = events.order_by(Event.location)
     else:
@@ -82,6 +620,328 @@ def get_all_events(sort_by: Optional[str] = Query(None), db: Session = None):
     return events.all()
 
 
+def get_events_page(sort_by: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                    fields: Optional[List[str]] = None, db: Session = None):
+    """
+    Retrieves one page of events using keyset pagination on (date, id) or (location, id).
+    Each page is a single index range scan, so the cost does not grow with the page number or the table size.
+
+    Args:
+        sort_by (Optional[str]): Field to sort by, "location" or "date" (default).
+        limit (int): Maximum number of events in the page.
+        after (Optional[str]): Cursor returned as next_cursor by the previous page.
+        fields (Optional[List[str]]): Fields to return, all fields if None. Only these columns are selected.
+        db (Session): Database session.
+
+    Returns:
+        dict: The events of the page and the cursor of the next page, None on the last page.
+    """
+    sort_column = Event.location if sort_by == "location" else Event.date
+    if fields:
+        unknown_fields = [field for field in fields if field not in EVENT_FIELDS]
+        if unknown_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown fields {unknown_fields}, choose from {EVENT_FIELDS}")
+        columns = [getattr(Event, field) for field in fields if field != "participants"]
+        events = db.query(Event.id, sort_column, *columns)
+    else:
+        events = db.query(Event).options(selectinload(Event.participants))
+
+    rows, next_cursor = _keyset_page(events, sort_column, limit, after)
+
+    if fields:
+        projected_rows = [{field: getattr(row, field) for field in fields if field != "participants"} for row in rows]
+        if "participants" in fields:
+            emails_by_event = get_emails_by_event([row.id for row in rows], db)
+            for row, projected_row in zip(rows, projected_rows):
+                projected_row["participants"] = emails_by_event[row.id]
+        rows = projected_rows
+    return {"events": rows, "next_cursor": next_cursor}
+
+
+def get_events_in_range(start: datetime, end: datetime, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                        db: Session = None):
+    """
+    Retrieves one page of the events between two dates, sorted by date, with the occurrences of recurring events.
+    Single events are a seek and scan of the (date, id) index, whatever the size of the table. Recurring events
+    are read from their partial index without their participants and expanded lazily, up to the end of the page.
+
+    Args:
+        start (datetime): Earliest event date, inclusive.
+        end (datetime): Latest event date, exclusive.
+        limit (int): Maximum number of events in the page.
+        after (Optional[str]): Cursor returned as next_cursor by the previous page.
+        db (Session): Database session.
+
+    Returns:
+        dict: The events of the page and the cursor of the next page, None on the last page.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    events = db.query(Event)
+    singles = events.filter(Event.recurrence.is_(None), Event.date >= start, Event.date < end)
+    series = _series_query(events, start, end)
+    rows, next_cursor = _merged_page(singles, series, start, end, limit, after, db)
+    return {"events": rows, "next_cursor": next_cursor}
+
+
+def get_upcoming_events(limit: int = DEFAULT_PAGE_SIZE, participant: Optional[str] = None, db: Session = None,
+                        now: Optional[datetime] = None):
+    """
+    Retrieves the next events, optionally only those of one participant, with the next occurrences of recurring
+    events. Without a participant this reads the first `limit` entries of the (date, id) index from now on. With one,
+    the participant's events are found through the (email, event_id) index and only those are sorted.
+
+    Args:
+        limit (int): Maximum number of events returned.
+        participant (Optional[str]): Email address of the participant.
+        db (Session): Database session.
+        now (Optional[datetime]): Current time, defaults to datetime.now().
+
+    Returns:
+        list: The next events, sorted by date.
+    """
+    events = db.query(Event)
+    if participant:
+        events = (events.join(EventParticipant, EventParticipant.event_id == Event.id)
+                  .filter(EventParticipant.email == normalize_email(participant)))
+    now = naive_utc(now) or datetime.now()
+    singles = events.filter(Event.recurrence.is_(None), Event.date >= now)
+    rows, _ = _merged_page(singles, _series_query(events, now), now, None, limit, None, db)
+    return rows
+
+
+def get_changes(since: int = Query(0, ge=0), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                db: Session = None):
+    """
+    Retrieves the changes made after a sequence number, oldest first, with the current state of their events.
+
+    Args:
+        since (int): Sequence number of the last change the client has, 0 for all of them.
+        limit (int): Maximum number of changes returned.
+        db (Session): Database session.
+
+    Returns:
+        dict: The changes, each with its event or None if the event is deleted by now, and the sequence number to
+            pass as `since` next time.
+    """
+    changes = db.query(EventChange).filter(EventChange.seq > since).order_by(EventChange.seq).limit(limit).all()
+    event_ids = {change.event_id for change in changes if change.action != "deleted"}
+    events = {event.id: event for event in db.query(Event).options(selectinload(Event.participants))
+              .filter(Event.id.in_(event_ids))} if event_ids else {}
+    return {"changes": [{"seq": change.seq, "event_id": change.event_id, "action": change.action,
+                         "changed_at": change.changed_at, "event": events.get(change.event_id)}
+                        for change in changes],
+            "last_seq": changes[-1].seq if changes else since}
+
+
+def _series_query(events, start, end=None):
+    """
+    Narrows an events query to the recurring events with occurrences between two dates, as (id, date, recurrence)
+    rows: there is one per series in the range, so their participants are only loaded for those in the page.
+    """
+    series = events.with_entities(Event.id, Event.date, Event.recurrence).filter(
+        Event.recurrence.isnot(None), or_(Event.recurrence_end.is_(None), Event.recurrence_end >= start))
+    return series if end is None else series.filter(Event.date < end)
+
+
+def _occurrence(event, date):
+    """
+    Returns one occurrence of a recurring event, with the fields of EventOut.
+    """
+    return {"id": event.id, "title": event.title, "description": event.description, "date": date,
+            "location": event.location, "participants": [participant.email for participant in event.participants],
+            "recurrence": event.recurrence, "end": date + _duration(event)}
+
+
+def _merged_page(singles, series, start, end, limit, after, db):
+    """
+    Returns a page of single events and occurrences of recurring events, sorted by (date, id), and the cursor of
+    the next page. Single events come from one keyset query. The occurrences of each series are generated lazily
+    from the page's start, and heapq.merge stops as soon as the page is full, so an unbounded series is never
+    expanded past it. The series that made it into the page are then loaded with their participants.
+
+    Args:
+        singles (Query): Single events between start and end.
+        series (Query): (id, date, recurrence) rows of the recurring events with occurrences between start and end.
+        start (datetime): Earliest occurrence.
+        end (Optional[datetime]): Occurrences at or after it are left out, None for no limit.
+        limit (int): Maximum number of events in the page.
+        after (Optional[str]): Cursor returned as next_cursor by the previous page.
+        db (Session): Database session.
+    """
+    cursor = None if after is None else _decode_cursor(after, Event.date)
+    if cursor is not None:
+        singles = singles.filter(tuple_(Event.date, Event.id) > tuple_(*cursor))
+        start = max(start, cursor[0])
+
+    # Only the exceptions that fall in the range can hide an occurrence of the page
+    exceptions = db.query(EventException.event_id, EventException.occurrence).filter(
+        EventException.event_id.in_(series.with_entities(Event.id).scalar_subquery()),
+        EventException.occurrence >= start)
+    if end is not None:
+        exceptions = exceptions.filter(EventException.occurrence < end)
+    cancelled = {}
+    for event_id, occurrence in exceptions:
+        cancelled.setdefault(event_id, []).append(occurrence)
+
+    def expand(event_id, dtstart, rule):
+        for date in occurrences(rule, dtstart, start, end, cancelled.get(event_id, ())):
+            if cursor is None or (date, event_id) > cursor:
+                yield date, event_id, None
+
+    single_rows = ((event.date, event.id, event) for event in singles.options(selectinload(Event.participants))
+                   .order_by(Event.date, Event.id).limit(limit + 1).all())
+    rows = list(islice(heapq.merge(single_rows, *(expand(*row) for row in series)), limit + 1))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][0], rows[-1][1])
+    series_ids = {event_id for _, event_id, event in rows if event is None}
+    recurring = {}
+    if series_ids:
+        recurring = {event.id: event for event in db.query(Event).options(selectinload(Event.participants))
+                     .filter(Event.id.in_(series_ids))}
+    page = [_occurrence(recurring[event_id], date) if event is None else event for date, event_id, event in rows]
+    return page, next_cursor
+
+
+def _keyset_page(events, sort_column, limit, after):
+    """
+    Returns the page of a query after a cursor, sorted by (sort_column, id), and the cursor of the next page.
+    """
+    if after is not None:
+        sort_value, last_id = _decode_cursor(after, sort_column)
+        events = events.filter(tuple_(sort_column, Event.id) > tuple_(sort_value, last_id))
+    rows = events.order_by(sort_column, Event.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(getattr(rows[-1], sort_column.key), rows[-1].id)
+    return rows, next_cursor
+
+
+def get_emails_by_event(event_ids, db):
+    """
+    Retrieves the participant emails of several events with a single query.
+
+    Returns:
+        dict: Event ID to list of emails.
+    """
+    emails_by_event = {event_id: [] for event_id in event_ids}
+    if emails_by_event:
+        for event_id, email in (db.query(EventParticipant.event_id, EventParticipant.email)
+                                .filter(EventParticipant.event_id.in_(emails_by_event))):
+            emails_by_event[event_id].append(email)
+    return emails_by_event
+
+
+def export_events_query(start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Builds the query of GET /events/export: the event columns in (date, id) order, served by ix_events_date_id.
+
+    Args:
+        start (Optional[datetime]): Earliest event date, inclusive.
+        end (Optional[datetime]): Latest event date, exclusive.
+
+    Returns:
+        Select: The query.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    query = select(Event.id, Event.title, Event.description, Event.date, Event.end, Event.location, Event.recurrence)
+    if start is not None:
+        query = query.where(Event.date >= start)
+    if end is not None:
+        query = query.where(Event.date < end)
+    return query.order_by(Event.date, Event.id)
+
+
+def _export_end(row):
+    # A series is exported as one row, with the end of its first occurrence and its rule
+    return row.end or row.date + DEFAULT_EVENT_DURATION
+
+
+def format_export_header(export_format: str):
+    """
+    Returns:
+        str: The CSV header line, or an empty string for NDJSON.
+    """
+    if export_format == "csv":
+        return ",".join(EXPORT_COLUMNS) + "\r\n"
+    return ""
+
+
+def format_export_batch(rows, emails_by_event, export_format: str):
+    """
+    Formats a batch of exported events as NDJSON lines or CSV rows.
+
+    Args:
+        rows: Rows of export_events_query.
+        emails_by_event (dict): Event ID to participant emails, see get_emails_by_event.
+        export_format (str): "ndjson" or "csv".
+
+    Returns:
+        str: The formatted batch.
+    """
+    buffer = io.StringIO()
+    if export_format == "csv":
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row.id, row.title, row.description, row.date.isoformat(), _export_end(row).isoformat(),
+                             row.location, row.recurrence, ",".join(emails_by_event[row.id])])
+    else:
+        for row in rows:
+            buffer.write(json.dumps({"id": row.id, "title": row.title, "description": row.description,
+                                     "date": row.date.isoformat(), "end": _export_end(row).isoformat(),
+                                     "location": row.location, "recurrence": row.recurrence,
+                                     "participants": emails_by_event[row.id]}))
+            buffer.write("\n")
+    return buffer.getvalue()
+
+
+def export_events(start: Optional[datetime] = None, end: Optional[datetime] = None, export_format: str = "ndjson",
+                  db: Session = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Streams events as NDJSON or CSV. Rows are fetched batch_size at a time from an open cursor,
+    so memory use stays constant whatever the number of exported events.
+
+    Args:
+        start (Optional[datetime]): Earliest event date, inclusive.
+        end (Optional[datetime]): Latest event date, exclusive.
+        export_format (str): "ndjson" or "csv".
+        db (Session): Database session.
+        batch_size (int): Rows fetched per round trip.
+
+    Yields:
+        str: The header, then one formatted chunk per batch.
+    """
+    header = format_export_header(export_format)
+    if header:
+        yield header
+    result = db.execute(export_events_query(start, end).execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        emails_by_event = get_emails_by_event([row.id for row in rows], db)
+        yield format_export_batch(rows, emails_by_event, export_format)
+
+
+def _encode_cursor(sort_value, event_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort_value, event_id]).encode()).decode()
+
+
+def _decode_cursor(cursor, sort_column):
+    try:
+        sort_value, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort_column is Event.date:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(event_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 def get_event(event_id: int = Path(..., description="ID of the event to retrieve"), db: Session = None):
     """
     Retrieves details of a specific event by its ID.
@@ -93,32 +953,112 @@ def get_event(event_id: int = Path(..., description="ID of the event to retrieve
     Returns:
         dict: Details of the event.
     """
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = db.query(Event).options(selectinload(Event.participants)).filter(Event.id == event_id).first()
     if event is None:
         return {"message": "Event not found"}
     return event
 
 
-def get_event_by(filter_by: str, filter_value: str, db):
+def get_event_by(filter_by: str, filter_value: str, db, limit: int = DEFAULT_PAGE_SIZE):
     """
     Retrieves events based on a specific filter.
 
     Args:
-        filter_by (str): Field to filter by.
-        filter_value (str): Value of the filter.
+        filter_by (str): Field to filter by, one of FILTERABLE_FIELDS.
+        filter_value (str): Value of the filter, a prefix for text fields and a date or date and time for "date".
         db (Session): Database session.
+        limit (int): Maximum number of events returned.
 
     Returns:
-        list: List of events matching the filter criteria.
+        list: List of events matching the filter criteria, sorted by date.
+    """
+    if filter_by not in FILTERABLE_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot filter by {filter_by}, choose from {FILTERABLE_FIELDS}")
+    if filter_by == "date":
+        date_from, date_to = _parse_date_filter(filter_value)
+        conditions = [Event.date >= date_from, Event.date < date_to]
+    elif filter_by == "participants":
+        conditions = [_participant_prefix_condition(filter_value)]
+    else:
+        conditions = [_prefix_condition(getattr(Event, filter_by), filter_value)]
+
+    events = _filtered_events(conditions, limit, db)
+    if not events:
+        return {"message": "No events found matching the filter criteria."}
+    return events
+
+
+def search_events(title: Optional[str] = None, description: Optional[str] = None, location: Optional[str] = None,
+                  participant: Optional[str] = None, date_from: Optional[datetime] = None,
+                  date_to: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE, db: Session = None):
+    """
+    Retrieves events matching all the given filters.
+
+    Args:
+        title (Optional[str]): Title prefix, case-insensitive.
+        description (Optional[str]): Description prefix, case-insensitive.
+        location (Optional[str]): Location prefix, case-insensitive.
+        participant (Optional[str]): Participant email.
+        date_from (Optional[datetime]): Earliest event date, inclusive.
+        date_to (Optional[datetime]): Latest event date, exclusive.
+        limit (int): Maximum number of events returned.
+        db (Session): Database session.
+
+    Returns:
+        list: List of events matching every filter, sorted by date.
+    """
+    conditions = []
+    for column, prefix in ((Event.title, title), (Event.description, description), (Event.location, location)):
+        if prefix:
+            conditions.append(_prefix_condition(column, prefix))
+    if participant:
+        conditions.append(Event.id.in_(select(EventParticipant.event_id)
+                                         .where(EventParticipant.email == normalize_email(participant))))
+    if date_from is not None:
+        conditions.append(Event.date >= date_from)
+    if date_to is not None:
+        conditions.append(Event.date < date_to)
+    return _filtered_events(conditions, limit, db)
+
+
+def _filtered_events(conditions, limit, db):
+    return (db.query(Event).options(selectinload(Event.participants))
+            .filter(*conditions).order_by(Event.date, Event.id).limit(limit).all())
+
+
+def _prefix_condition(column, prefix):
+    """
+    Case-insensitive "starts with" condition that SQLite can serve with the column's NOCASE index.
+    The pattern is bound as a single parameter, "LIKE :prefix || '%'" would force a full scan.
+    """
+    escaped = prefix.replace("/", "//").replace("%", "/%").replace("_", "/_")
+    return column.like(escaped + "%", escape="/")
+
+
+def _participant_prefix_condition(prefix):
+    """
+    Participant email "starts with" condition, a range on the (email, event_id) index. The prefix is normalized
+    like the stored emails.
+    """
+    prefix = normalize_email(prefix)
+    if not prefix:
+        raise HTTPException(status_code=400, detail="The participant prefix must not be empty")
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Event.id.in_(select(EventParticipant.event_id)
+                        .where(EventParticipant.email >= prefix, EventParticipant.email < upper_bound))
+
+
+def _parse_date_filter(value):
+    """
+    Turns a date filter into a [start, end) range: a whole day for a date, one instant for a date and time.
     """
-    query = db.query(Event)
-    if filter_by and filter_value:
-        filter_condition = getattr(Event, filter_by).startswith(filter_value)
-        query = query.filter(filter_condition)
-        events = query.all()
-        if not events:
-            return {"message": "No events found matching the filter criteria."}
-        return events
+    try:
+        start = naive_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date {value}, use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
+    if len(value) == 10:
+        return start, start + timedelta(days=1)
+    return start, start + timedelta(microseconds=1)
 
 
 def update_event(event_id: int = Path(..., description="ID of the event to update"),
@@ -127,9 +1067,12 @@ def update_event(event_id: int = Path(..., description="ID of the event to updat
                  date: Optional[datetime] = Body(None),
                  location: Optional[str] = Body(None),
                  participants: List[str] = Body(None),
-                 db: Session = None):
+                 db: Session = None,
+                 recurrence: Optional[str] = None,
+                 end: Optional[datetime] = None,
+                 conflicts: Optional[str] = None):
     """
-    Updates an existing event by its ID.
+    Updates an existing event by its ID. An event moved to another date keeps its length unless a new end is given.
 
     Args:
         event_id (int): ID of the event to update.
@@ -139,15 +1082,35 @@ def update_event(event_id: int = Path(..., description="ID of the event to updat
         location (Optional[str]): New location of the event.
         participants (List[str]): List of new participants' email addresses.
         db (Session): Database session.
+        recurrence (Optional[str]): New RRULE of the event, an empty string makes it a single event.
+        end (Optional[datetime]): New end of the event.
+        conflicts (Optional[str]): Conflict-check mode, see create_event. The event is checked as updated.
 
     Returns:
-        dict: Message indicating success or failure of event update along with updated event details.
+        dict: Message indicating success or failure of event update along with updated event details, and the
+            conflicts with "flag".
     """
+    date, end = naive_utc(date), naive_utc(end)
+    if participants is not None:
+        participants = validate_participants(participants)
     event = db.query(Event).filter(Event.id == event_id).first()
     if event is None:
         return {"message": "Event not found"}
-    event_participants = event.participants.replace(" ", "")
-    participants_list = event_participants.split(",")
+    new_date = date or event.date
+    new_end = validate_end(end, new_date) if end is not None else new_date + _duration(event)
+    new_recurrence, new_recurrence_end = event.recurrence, event.recurrence_end
+    if recurrence is not None or (date is not None and event.recurrence):
+        # The end of the series moves with its rule and its first date
+        new_recurrence, new_recurrence_end = validate_recurrence(
+            event.recurrence if recurrence is None else recurrence, new_date)
+    if conflicts:
+        emails = {participant.email for participant in event.participants}.union(participants or ())
+        cancelled = [exception.occurrence for exception in event.exceptions] if new_recurrence else ()
+        checked = (title or event.title, new_date, new_end, location or event.location, emails, new_recurrence,
+                   cancelled)
+    if event.recurrence and new_recurrence is None:
+        db.query(EventException).filter(EventException.event_id == event_id).delete(synchronize_session=False)
+    event.recurrence, event.recurrence_end, event.end = new_recurrence, new_recurrence_end, new_end
 
     if title is not None:
         event.title = title
@@ -158,17 +1121,22 @@ def update_event(event_id: int = Path(..., description="ID of the event to updat
     if location is not None:
         event.location = location
     if participants is not None:
-        for participant in participants:
-            if not is_valid_email(participant):
-                return {f"participant {participant} should be a valid email"}
-            if participant not in participants_list:
-                event.participants += "," + participant
+        # Only the requested emails are looked up, through the primary key, instead of loading every participant
+        existing = {email for (email,) in db.query(EventParticipant.email)
+                    .filter(EventParticipant.event_id == event_id, EventParticipant.email.in_(participants))}
+        db.add_all(EventParticipant(event_id=event_id, email=participant)
+                   for participant in participants if participant not in existing)
+    found = {}
+    if conflicts:
+        db.flush()
+        found = _check_written_event(db, conflicts, *checked, event_id)
+    queue_reminders(db, ("send", "schedule"), [event_id])
+    record_changes(db, "updated", [event_id])
     db.commit()
-
-    es = eventScheduler()
-    es.send_reminder(event)
-    es.update_reminder(event.id, event, db)
-    return {"message": "Event updated successfully!", "event": event}
+    response_cache.invalidate(event_key(event_id))
+    eventScheduler().notify()
+    change_feed.publish()
+    return {"message": "Event updated successfully!", "event": event, **found}
 
 
 def delete_event(event_id: int = Path(..., description="ID of the event to delete"), db: Session = None):
@@ -185,11 +1153,216 @@ def delete_event(event_id: int = Path(..., description="ID of the event to delet
     event = db.query(Event).filter(Event.id == event_id).first()
     if event is None:
         return {"message": "Event not found"}
+    db.query(EventParticipant).filter(EventParticipant.event_id == event_id).delete(synchronize_session=False)
+    db.query(EventException).filter(EventException.event_id == event_id).delete(synchronize_session=False)
     db.delete(event)
+    queue_reminders(db, ("remove",), [event_id])
+    record_changes(db, "deleted", [event_id])
     db.commit()
+    response_cache.invalidate(event_key(event_id))
+    eventScheduler().notify()
+    change_feed.publish()
     return {"message": f"Event id {event_id} deleted successfully"}
 
 
+def cancel_occurrence(event_id: int = Path(..., description="ID of the recurring event"),
+                      occurrence: datetime = Path(..., description="date of the occurrence to cancel"),
+                      db: Session = None):
+    """
+    Cancels one occurrence of a recurring event. The series' reminder job moves to its next occurrence if needed.
+
+    Args:
+        event_id (int): ID of the recurring event.
+        occurrence (datetime): Date of the occurrence.
+        db (Session): Database session.
+
+    Returns:
+        dict: Message indicating success or failure of the cancellation.
+    """
+    occurrence = naive_utc(occurrence)
+    event = db.query(Event).filter(Event.id == event_id).first()
+    if event is None:
+        return {"message": "Event not found"}
+    if not event.recurrence or not is_occurrence(event.recurrence, event.date, occurrence):
+        raise HTTPException(status_code=400, detail=f"{occurrence} is not an occurrence of event id {event_id}")
+    if db.get(EventException, (event_id, occurrence)) is None:
+        db.add(EventException(event_id=event_id, occurrence=occurrence))
+    queue_reminders(db, ("schedule",), [event_id])
+    record_changes(db, "updated", [event_id])
+    db.commit()
+    response_cache.invalidate(event_key(event_id))
+    eventScheduler().notify()
+    change_feed.publish()
+    return {"message": f"Occurrence {occurrence.isoformat()} of event id {event_id} cancelled"}
+
+
+def get_participant_events(email: str = Path(..., description="participant email"), db: Session = None):
+    """
+    Retrieves the events a participant is invited to, sorted by date.
+
+    Args:
+        email (str): Email address of the participant.
+        db (Session): Database session.
+
+    Returns:
+        list: List of events the participant is invited to.
+    """
+    events = (db.query(Event)
+              .join(EventParticipant, EventParticipant.event_id == Event.id)
+              .filter(EventParticipant.email == normalize_email(email))
+              .options(selectinload(Event.participants))
+              .order_by(Event.date))
+    return events.all()
+
+
+def migrate_database(bind=None):
+    """
+    Creates the missing tables once, then brings an existing events database up to date with the models. Run at
+    startup, safe to run repeatedly.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+    """
+    bind = bind or SessionLocal.engine
+    Base.metadata.create_all(bind)
+    # Adding the columns declared on the event models to the existing tables, e.g. the recurrence columns
+    add_missing_columns(bind)
+    # Moving participants of existing events into the event_participants table
+    migrate_participants(bind)
+    # Trimming and lowercasing participant emails stored before they were normalized
+    normalize_stored_participants(bind)
+    # Giving the events stored before they had an end the default length
+    fill_event_ends(bind)
+    # Adding indexes declared on the event models to the existing database
+    create_missing_indexes(bind)
+
+
+def migrate_participants(bind=None):
+    """
+    Moves participants out of the legacy comma-joined events.participants column into the event_participants
+    table. Safe to run repeatedly, migrated rows have an empty legacy column. Addresses that are not valid emails,
+    which the legacy column did not check, are dropped and logged.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+
+    Returns:
+        int: Number of migrated events.
+    """
+    bind = bind or SessionLocal.engine
+    with Session(bind) as db:
+        rows = db.query(Event.id, Event.legacy_participants).filter(Event.legacy_participants != "").all()
+        for event_id, legacy_participants in rows:
+            emails = {}
+            for email in legacy_participants.split(","):
+                normalized, valid = _check_email(email)
+                if valid:
+                    emails[normalized] = None
+                elif email.strip():
+                    print(f"Dropped the invalid participant {email.strip()!r} of event {event_id}")
+            existing = {email for (email,) in db.query(EventParticipant.email)
+                        .filter(EventParticipant.event_id == event_id)}
+            db.add_all(EventParticipant(event_id=event_id, email=email) for email in emails if email not in existing)
+        db.query(Event).filter(Event.legacy_participants != "").update({Event.legacy_participants: ""},
+                                                                       synchronize_session=False)
+        db.commit()
+    return len(rows)
+
+
+def add_missing_columns(bind=None):
+    """
+    Adds the columns declared on the models that the existing tables do not have yet, e.g. the recurrence
+    columns of events. create_all only creates missing tables.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+
+    Returns:
+        list: Names of the added columns, as "table.column".
+    """
+    bind = bind or SessionLocal.engine
+    added = []
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=connection.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def fill_event_ends(bind=None):
+    """
+    Sets the end of the events stored without one to date + DEFAULT_EVENT_DURATION, so the conflict lookups, which
+    compare ends in SQL, see them.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+
+    Returns:
+        int: Number of events changed.
+    """
+    bind = bind or SessionLocal.engine
+    changed = 0
+    with Session(bind) as db:
+        while True:
+            events = db.query(Event.id, Event.date).filter(Event.end.is_(None)).limit(EXPORT_BATCH_SIZE).all()
+            if not events:
+                break
+            db.execute(update(Event), [{"id": event_id, "end": date + DEFAULT_EVENT_DURATION}
+                                       for event_id, date in events])
+            db.commit()
+            changed += len(events)
+    return changed
+
+
+def create_missing_indexes(bind=None):
+    """
+    Creates the indexes declared on the models that an existing database does not have yet.
+    create_all only adds indexes together with new tables.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+    """
+    bind = bind or SessionLocal.engine
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
+def normalize_stored_participants(bind=None):
+    """
+    Trims and lowercases the participant emails stored before they were normalized on the way in.
+    An email that becomes a duplicate of another participant of the same event is dropped, and so is an address
+    that is not a valid email, e.g. one copied from the legacy participants column, which is logged.
+
+    Args:
+        bind: Engine of the events database, defaults to the engine of SessionLocal.
+
+    Returns:
+        int: Number of participant rows changed or dropped.
+    """
+    bind = bind or SessionLocal.engine
+    email = EventParticipant.email
+    with Session(bind) as db:
+        # LIKE only preselects the rows, EMAIL_REGEX decides
+        changed = (db.query(EventParticipant.event_id, email)
+                   .filter(or_(email != func.lower(func.trim(email)), email.notlike("_%@_%._%"),
+                               email.like("%@%@%"))).all())
+        for event_id, stored in changed:
+            db.query(EventParticipant).filter(EventParticipant.event_id == event_id,
+                                              email == stored).delete(synchronize_session=False)
+            normalized, valid = _check_email(stored)
+            if not valid:
+                print(f"Dropped the invalid participant {stored!r} of event {event_id}")
+            elif db.get(EventParticipant, (event_id, normalized)) is None:
+                db.add(EventParticipant(event_id=event_id, email=normalized))
+        db.commit()
+    return len(changed)
+
+
 def get_db():
     """
     Dependency function to provide a database session.
@@ -214,5 +1387,58 @@ def is_valid_email(email):
     Returns:
         bool: True if the email is valid, False otherwise.
     """
-    regex = r"^[^@]+@[^@]+\.[^@]+$"
-    return bool(re.match(regex, email))
+    return bool(EMAIL_REGEX.match(email))
+
+
+def normalize_email(email):
+    """
+    Returns the form participant emails are stored in: trimmed and lowercased.
+    """
+    return email.strip().lower()
+
+
+def _check_email(email):
+    normalized = email.strip().lower()
+    return normalized, EMAIL_REGEX.match(normalized) is not None
+
+
+if EMAIL_CACHE_SIZE > 0:
+    # Invitations to the same people come back often, their addresses are then checked once
+    _check_email = lru_cache(maxsize=EMAIL_CACHE_SIZE)(_check_email)
+
+
+def normalize_participants(participants):
+    """
+    Trims, lowercases, validates and deduplicates participant emails in one pass.
+
+    Args:
+        participants (List[str]): Email addresses as sent by the client.
+
+    Returns:
+        tuple: The valid emails, normalized and in first-seen order, and one error per invalid address in the format
+            of FastAPI's validation errors, with the index of the address in `participants`.
+    """
+    emails = {}
+    errors = []
+    check = _check_email
+    for index, participant in enumerate(participants):
+        email, valid = check(participant)
+        if valid:
+            emails[email] = None
+        else:
+            errors.append({"type": "value_error", "loc": ["body", "participants", index],
+                           "msg": "value is not a valid email address", "input": participant})
+    return list(emails), errors
+
+
+def validate_participants(participants):
+    """
+    Returns the normalized participant emails, see normalize_participants.
+
+    Raises:
+        HTTPException: 422 with the error of every invalid address.
+    """
+    emails, errors = normalize_participants(participants)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    return emails
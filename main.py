@@ -1,27 +1,45 @@
 # Importing necessary modules and packages
-from fastapi import FastAPI, Body, Path, Query, Depends, HTTPException
+import os
+
+from fastapi import FastAPI, Body, Header, Path, Query, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from datetime import datetime
-from typing import Optional, List
+from typing import Annotated, Dict, List, Literal, Optional, Union
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 # Importing local modules
+import database
 import events_db_manager
+import metrics
 import users_db_manager
-from eventScheduler import EventScheduler
+from auth_cache import credential_cache
+from change_feed import MAX_WAIT_SECONDS, STREAM_BATCH_SIZE, change_feed, sse_message, stream_changes
+from rate_limit import AdmissionMiddleware, concurrency_limiter, rate_limiter, retry_after, route_cost
+from response_cache import event_key, events_page_key, render, response_cache, to_response
+from schemas import (BulkCreateOut, ChangeOut, ChangesOut, ConflictsOut, EventMessageOut, EventOut, EventsPageOut,
+                     EventsProjectionOut, MessageOut, UserMessageOut, UserOut)
+from eventScheduler import DATABASES_PREPARED_ENV, WORKERS, prepare_databases, worker_lifespan
+
+# "sync" serves this module's app, "async" serves async_main.app (AsyncSession on aiosqlite)
+DB_MODE = os.environ.get("EVENT_MANAGER_DB_MODE", "sync")
 
 # Database setup
 EVENTS_DATABASE_URL = "sqlite:///events.db"
 USERS_DATABASE_URL = "sqlite:///users.db"
 
-# SQLAlchemy engine and session creation
-event_engine = create_engine(EVENTS_DATABASE_URL)
-EventSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=event_engine)
-users_engine = create_engine(USERS_DATABASE_URL)
-UsersSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=users_engine)
+# SQLAlchemy session creation. The engines are shared with the other modules through the database module, and
+# created when the first session is opened. Read-only endpoints use the reader engines, whose connection pools are
+# separate from the writers'.
+EventSessionLocal = database.LazySessionmaker(EVENTS_DATABASE_URL, autocommit=False, autoflush=False)
+EventReadSessionLocal = database.LazySessionmaker(EVENTS_DATABASE_URL, read_only=True, autocommit=False,
+                                                  autoflush=False)
+UsersSessionLocal = database.LazySessionmaker(USERS_DATABASE_URL, autocommit=False, autoflush=False)
+UsersReadSessionLocal = database.LazySessionmaker(USERS_DATABASE_URL, read_only=True, autocommit=False,
+                                                  autoflush=False)
 
 # Base class for SQLAlchemy models
 Base = declarative_base()
@@ -36,6 +54,15 @@ def get_events_db():
         db.close()
 
 
+# Function to get a read-only events database session
+def get_events_read_db():
+    db = EventReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 # Function to get users database session
 def get_users_db():
     db = UsersSessionLocal()
@@ -45,24 +72,52 @@ def get_users_db():
         db.close()
 
 
+# Function to get a read-only users database session
+def get_users_read_db():
+    db = UsersReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 # Creating FastAPI app instance
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=worker_lifespan)
+# Per-route latency histograms, and cProfile of single requests sent with the X-Profile header
+app.router.route_class = metrics.InstrumentedRoute
+app.add_middleware(metrics.MetricsMiddleware)
+# Requests past MAX_CONCURRENT_REQUESTS in flight are shed with 429 before any work is done
+app.add_middleware(AdmissionMiddleware, limiter=concurrency_limiter)
 # Initializing HTTPBasic security instance
 security = HTTPBasic()
 
 
 # Function to get current username based on HTTPBasic credentials
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_users_db)):
-
-    user = users_db_manager.get_user_by_username(credentials.username, db)
-    if not user or not isinstance(user, dict):  # user is dict only if user not found
-        if credentials.password == user.password:
-            return credentials.username
-    raise HTTPException(status_code=401, detail="Incorrect username or password")
+def get_current_username(credentials: HTTPBasicCredentials = Depends(security),
+                         db: Session = Depends(get_users_read_db)):
+    with metrics.timed("auth"):
+        user = users_db_manager.get_user_by_username(credentials.username, db)
+        if isinstance(user, users_db_manager.User):
+            # Recently verified credentials skip the slow password hash while the stored hash is unchanged, it may
+            # have been changed by another worker
+            if credential_cache.verify(credentials.username, credentials.password, user.password):
+                return credentials.username
+            if users_db_manager.verify_password(credentials.password, user.password):
+                credential_cache.add(credentials.username, credentials.password, user.password)
+                return credentials.username
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+
+
+# Function to charge the request to the current user's token bucket, by the cost of its route
+async def rate_limited_user(request: Request, username: str = Depends(get_current_username)):
+    wait = rate_limiter.acquire(username, route_cost(request))
+    if wait:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={"Retry-After": retry_after(wait)})
+    return username
 
 
 # Endpoint to create a new user
-@app.post("/users")
+@app.post("/users", response_model=UserMessageOut)
 def create_event(username: str = Body(...),
                  password: str = Body(...),
                  email: str = Body(...),
@@ -71,79 +126,277 @@ def create_event(username: str = Body(...),
 
 
 # Endpoint to retrieve all users
-@app.get("/users")
-def get_all_users(db: Session = Depends(get_users_db)):
+@app.get("/users", response_model=List[UserOut])
+def get_all_users(db: Session = Depends(get_users_read_db)):
     """Retrieves a list of all users."""
     return users_db_manager.get_all_users(db)
 
 
 # Endpoint to retrieve a specific user by username
-@app.get("/users/{username}")
+@app.get("/users/{username}", response_model=Union[UserOut, MessageOut])
 def get_user(username: str = Path(..., description="username"),
-             db: Session = Depends(get_users_db)):
+             db: Session = Depends(get_users_read_db)):
     """Retrieves details of a specific event by its ID."""
     return users_db_manager.get_user_by_username(username, db)
 
 
 # Endpoint to create a new event
-@app.post("/events", dependencies=[Depends(get_current_username)])
+@app.post("/events", dependencies=[Depends(rate_limited_user)], response_model=Union[EventMessageOut, MessageOut])
 def create_event(title: str = Body(...), description: str = Body(...), date: datetime = Body(...),
-                 location: str = Body(...), participants: List[str] = Body(...), db: Session = Depends(get_events_db)):
-    return events_db_manager.create_event(title, description, date, location, participants, db)
-
-
-# Endpoint to retrieve all events
-@app.get("/events", dependencies=[Depends(get_current_username)])
-def get_all_events(sort_by: Optional[str] = Query(None), db: Session = Depends(get_events_db)):
-    """Retrieves a list of all events, optionally sorted."""
-    return events_db_manager.get_all_events(sort_by, db)
+                 location: str = Body(...), participants: List[str] = Body(...),
+                 recurrence: Annotated[Optional[str], Body(description="RRULE of a recurring event")] = None,
+                 end: Annotated[Optional[datetime], Body(description="default: date + 1 hour")] = None,
+                 conflicts: Annotated[Optional[Literal["reject", "flag"]],
+                                      Query(description="reject or flag overlapping events")] = None,
+                 db: Session = Depends(get_events_db)):
+    return events_db_manager.create_event(title, description, date, location, participants, db, recurrence, end,
+                                          conflicts)
+
+
+# Endpoint to create many events in one transaction
+@app.post("/events/bulk", dependencies=[Depends(rate_limited_user)],
+          response_model=BulkCreateOut, response_model_exclude_none=True)
+def create_events(events: List[dict] = Body(..., description="events with the fields of POST /events"),
+                  db: Session = Depends(get_events_db)):
+    """Creates many events at once and returns a per-row result."""
+    return events_db_manager.create_events(events, db)
+
+
+# Endpoint to retrieve events, one page at a time
+@app.get("/events", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[EventsPageOut, EventsProjectionOut])
+def get_all_events(sort_by: Optional[str] = Query(None),
+                   limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1, le=events_db_manager.MAX_PAGE_SIZE),
+                   after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                   fields: Optional[str] = Query(None, description="comma-separated fields to return"),
+                   if_none_match: Optional[str] = Header(None),
+                   db: Session = Depends(get_events_read_db)):
+    """Retrieves a page of events, optionally sorted, with the cursor of the next page."""
+    fields_list = fields.split(",") if fields else None
+    # Served from the response cache until the next write, the generation is read before querying
+    # Writes of every worker go to the change log, cached responses older than its last entry are dropped
+    response_cache.validate(events_db_manager.latest_change(db))
+    generation = response_cache.generation
+    key = events_page_key(generation, sort_by, limit, after, fields)
+    cached = response_cache.get(key)
+    if cached is None:
+        page = events_db_manager.get_events_page(sort_by, limit, after, fields_list, db)
+        # A projection is rendered as plain dicts, an EventOut would fill in the fields that were not requested
+        page_model = EventsProjectionOut if fields_list else EventsPageOut
+        cached = response_cache.set(key, render(page_model, page), generation)
+    return to_response(cached, if_none_match)
+
+
+# Endpoint to retrieve the events between two dates, one page at a time
+@app.get("/events/range", dependencies=[Depends(rate_limited_user)], response_model=EventsPageOut)
+def get_events_in_range(start: datetime = Query(..., description="earliest event date, inclusive"),
+                        end: datetime = Query(..., description="latest event date, exclusive"),
+                        limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                           le=events_db_manager.MAX_PAGE_SIZE),
+                        after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                        db: Session = Depends(get_events_read_db)):
+    """Retrieves a page of the events between start and end, sorted by date."""
+    return events_db_manager.get_events_in_range(start, end, limit, after, db)
+
+
+# Endpoint to find the overlapping events between two dates
+@app.get("/events/conflicts", dependencies=[Depends(rate_limited_user)], response_model=ConflictsOut)
+def get_conflicts(start: datetime = Query(..., description="start of the range, inclusive"),
+                  end: datetime = Query(..., description="end of the range, exclusive, at most 31 days after start"),
+                  location: Optional[str] = Query(None, description="only the events at this location"),
+                  participant: Optional[str] = Query(None, description="only the events of this email"),
+                  limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1, le=events_db_manager.MAX_PAGE_SIZE),
+                  db: Session = Depends(get_events_read_db)):
+    """Retrieves the pairs of overlapping events at the same location or with a participant in common."""
+    return events_db_manager.get_conflicts(start, end, location, participant, limit, db)
+
+
+# Endpoint to retrieve the next events
+@app.get("/events/upcoming", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+def get_upcoming_events(limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                           le=events_db_manager.MAX_PAGE_SIZE),
+                        participant: Optional[str] = Query(None, description="only the events of this email"),
+                        db: Session = Depends(get_events_read_db)):
+    """Retrieves the next events from now on, sorted by date."""
+    return events_db_manager.get_upcoming_events(limit, participant, db)
+
+
+def read_changes(since, limit):
+    # A session per read, so a waiting long poll does not hold a pooled connection
+    with EventReadSessionLocal() as db:
+        changes = events_db_manager.get_changes(since, limit, db)
+        return render(ChangesOut, changes), not changes["changes"]
+
+
+async def read_change_messages(since):
+    def read():
+        with EventReadSessionLocal() as db:
+            changes = events_db_manager.get_changes(since, STREAM_BATCH_SIZE, db)["changes"]
+            return [(change["seq"], sse_message(change["seq"], render(ChangeOut, change))) for change in changes]
+    return await run_in_threadpool(read)
+
+
+# Endpoint to retrieve the changes made after a sequence number, optionally waiting for the next one
+@app.get("/events/changes", dependencies=[Depends(rate_limited_user)], response_model=ChangesOut)
+async def get_event_changes(since: int = Query(0, ge=0, description="last_seq of the previous response"),
+                            limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                               le=events_db_manager.MAX_PAGE_SIZE),
+                            wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS,
+                                                description="seconds to wait for a change if there is none yet")):
+    """Retrieves the changes after `since`. With `wait`, an up-to-date client gets the next change as a long poll."""
+    # Subscribed before reading, so a change committed in between still ends the wait
+    subscription = change_feed.subscribe() if wait else None
+    try:
+        body, empty = await run_in_threadpool(read_changes, since, limit)
+        if empty and subscription is not None and await subscription.wait(wait):
+            body, empty = await run_in_threadpool(read_changes, since, limit)
+    finally:
+        if subscription is not None:
+            change_feed.unsubscribe(subscription)
+    return Response(body, media_type="application/json")
+
+
+# Endpoint to stream the changes as Server-Sent Events
+@app.get("/events/changes/stream", dependencies=[Depends(rate_limited_user)], response_class=StreamingResponse)
+async def stream_event_changes(since: int = Query(0, ge=0, description="last_seq already received"),
+                               timeout: Optional[float] = Query(None, ge=0,
+                                                                description="seconds after which the stream ends"),
+                               last_event_id: Optional[int] = Header(None)):
+    """Streams the changes after `since`, the backlog first and then each change as it is made."""
+    # Reconnecting EventSource clients send the ID of the last event they received
+    if last_event_id is not None:
+        since = max(since, last_event_id)
+    return StreamingResponse(stream_changes(read_change_messages, since, timeout), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+# Endpoint to stream events as NDJSON or CSV
+@app.get("/events/export", dependencies=[Depends(rate_limited_user)], response_class=StreamingResponse)
+def export_events(export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                  start: Optional[datetime] = Query(None, description="earliest event date, inclusive"),
+                  end: Optional[datetime] = Query(None, description="latest event date, exclusive")):
+    """Streams events in date order, with constant memory whatever the number of events."""
+    def rows():
+        # The session lives as long as the stream, dependencies with yield are closed before streaming starts
+        with EventReadSessionLocal() as db:
+            yield from events_db_manager.export_events(start, end, export_format, db)
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type)
+
+
+# Endpoint to retrieve events matching several filters
+@app.get("/events/search", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+def search_events(title: Optional[str] = Query(None, description="title prefix"),
+                  description: Optional[str] = Query(None, description="description prefix"),
+                  location: Optional[str] = Query(None, description="location prefix"),
+                  participant: Optional[str] = Query(None, description="participant email"),
+                  date_from: Optional[datetime] = Query(None, description="earliest event date, inclusive"),
+                  date_to: Optional[datetime] = Query(None, description="latest event date, exclusive"),
+                  limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                     le=events_db_manager.MAX_PAGE_SIZE),
+                  db: Session = Depends(get_events_read_db)):
+    """Retrieves events matching all the given filters, sorted by date."""
+    return events_db_manager.search_events(title, description, location, participant, date_from, date_to, limit, db)
 
 
 # Endpoint to retrieve a specific event by ID
-@app.get("/events/{event_id}", dependencies=[Depends(get_current_username)])
+@app.get("/events/{event_id}", dependencies=[Depends(rate_limited_user)], response_model=Union[EventOut, MessageOut])
 def get_event(event_id: int = Path(..., description="ID of the event to retrieve"),
-              db: Session = Depends(get_events_db)):
+              if_none_match: Optional[str] = Header(None),
+              db: Session = Depends(get_events_read_db)):
     """Retrieves details of a specific event by its ID."""
-    return events_db_manager.get_event(event_id, db)
+    # Writes of every worker go to the change log, cached responses older than its last entry are dropped
+    response_cache.validate(events_db_manager.latest_change(db))
+    generation = response_cache.generation
+    cached = response_cache.get(event_key(event_id))
+    if cached is None:
+        event = events_db_manager.get_event(event_id, db)
+        cached = response_cache.set(event_key(event_id), render(Union[EventOut, MessageOut], event), generation)
+    return to_response(cached, if_none_match)
 
 
 # Endpoint to retrieve events by filtering
-@app.get("/events/{filter_by}/{filter_value}", dependencies=[Depends(get_current_username)])
+@app.get("/events/{filter_by}/{filter_value}", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[List[EventOut], MessageOut])
 def get_event_by_filter(filter_by: str = Path(..., description="key to filter by"),
                         filter_value: str = Path(..., description="value of key"),
-                        db: Session = Depends(get_events_db)):
+                        limit: int = Query(events_db_manager.DEFAULT_PAGE_SIZE, ge=1,
+                                           le=events_db_manager.MAX_PAGE_SIZE),
+                        db: Session = Depends(get_events_read_db)):
     """Retrieves details of events based on a specific filter."""
-    return events_db_manager.get_event_by(filter_by, filter_value, db)
+    return events_db_manager.get_event_by(filter_by, filter_value, db, limit)
 
 
 # Endpoint to update a specific event by ID
-@app.put("/events/{event_id}", dependencies=[Depends(get_current_username)])
+@app.put("/events/{event_id}", dependencies=[Depends(rate_limited_user)],
+         response_model=Union[EventMessageOut, MessageOut])
 def update_event(event_id: int = Path(..., description="ID of the event to update"),
                  title: Optional[str] = Body(None),
                  description: Optional[str] = Body(None),
                  date: Optional[datetime] = Body(None),
                  location: Optional[str] = Body(None),
                  participants: List[str] = Body(None),
+                 recurrence: Annotated[Optional[str], Body(description="RRULE, empty for a single event")] = None,
+                 end: Annotated[Optional[datetime], Body(description="new end of the event")] = None,
+                 conflicts: Annotated[Optional[Literal["reject", "flag"]],
+                                      Query(description="reject or flag overlapping events")] = None,
                  db: Session = Depends(get_events_db)):
-    return events_db_manager.update_event(event_id, title, description, date, location, participants, db)
+    return events_db_manager.update_event(event_id, title, description, date, location, participants, db,
+                                          recurrence, end, conflicts)
 
 
 # Endpoint to delete a specific event by ID
-@app.delete("/events/{event_id}", dependencies=[Depends(get_current_username)])
+@app.delete("/events/{event_id}", dependencies=[Depends(rate_limited_user)], response_model=MessageOut)
 def delete_event(event_id: int = Path(..., description="ID of the event to delete"),
                  db: Session = Depends(get_events_db)):
     """Deletes an event by its ID."""
     return events_db_manager.delete_event(event_id, db)
 
 
+# Endpoint to cancel one occurrence of a recurring event
+@app.delete("/events/{event_id}/occurrences/{occurrence}", dependencies=[Depends(rate_limited_user)],
+            response_model=MessageOut)
+def cancel_occurrence(event_id: int = Path(..., description="ID of the recurring event"),
+                      occurrence: datetime = Path(..., description="date of the occurrence to cancel"),
+                      db: Session = Depends(get_events_db)):
+    """Cancels one occurrence of a recurring event, the other occurrences are kept."""
+    return events_db_manager.cancel_occurrence(event_id, occurrence, db)
+
+
+# Endpoint to retrieve the events a participant is invited to
+@app.get("/participants/{email}/events", dependencies=[Depends(rate_limited_user)], response_model=List[EventOut])
+def get_participant_events(email: str = Path(..., description="email of the participant"),
+                           db: Session = Depends(get_events_read_db)):
+    """Retrieves the events a participant is invited to, sorted by date."""
+    return events_db_manager.get_participant_events(email, db)
+
+
+# Endpoint to retrieve the counters of the in-process caches and limiters
+@app.get("/metrics/cache", dependencies=[Depends(rate_limited_user)],
+         response_model=Dict[str, Dict[str, Union[int, float]]])
+def get_cache_metrics():
+    """Retrieves the hit and miss counters of the response and credential caches, and of the rate limiters."""
+    return {"responses": response_cache.stats(), "credentials": credential_cache.stats(),
+            "rate_limit": rate_limiter.stats(), "admission": concurrency_limiter.stats()}
+
+
+# Endpoint to expose the metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Retrieves the request, database, SMTP and scheduler latency histograms."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # Running the FastAPI server
 if __name__ == "__main__":
     import uvicorn
 
-    # Creating an instance of EventScheduler
-    scheduler = EventScheduler()
-    # Creating a scheduler for periodic tasks
-    scheduler.create_scheduler()
+    # Creating and migrating the tables before the workers start, so they do not all migrate at once. The spawned
+    # workers inherit the environment, not the module state, so they are told through it to skip the migration.
+    prepare_databases()
+    os.environ[DATABASES_PREPARED_ENV] = "1"
 
-    # Running the FastAPI server
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
+    # Running the FastAPI server. Each worker starts its scheduler in worker_lifespan, and the one holding the
+    # scheduler lease sends the reminders.
+    uvicorn.run("async_main:app" if DB_MODE == "async" else "main:app", host="0.0.0.0", port=8000, workers=WORKERS)
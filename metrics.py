@@ -0,0 +1,282 @@
+import cProfile
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+# Latency buckets in seconds, the Prometheus client default
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Requests with this header are profiled with cProfile when EVENT_MANAGER_PROFILE_DIR is set
+PROFILE_HEADER = "x-profile"
+PROFILE_DIR = os.environ.get("EVENT_MANAGER_PROFILE_DIR")
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels, rendered in the text exposition format.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): Metric name.
+            documentation (str): HELP text.
+            label_names (tuple): Names of the labels, their values are passed to observe in the same order.
+            buckets (tuple): Upper bounds of the buckets, +Inf is added.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One counter per bucket, then the sum and the count
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def series(self, label_values):
+        """
+        Returns:
+            tuple: Count and sum of the observations of these label values.
+        """
+        with self._lock:
+            series = self._series.get(label_values)
+            return (series[-1], series[-2]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+                separator = "," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="+Inf"}} {series[-1]}')
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("eventmanager_request_duration_seconds", "HTTP request latency by route.",
+                            ("method", "route", "status"))
+REQUEST_OPERATION_SECONDS = Histogram(
+    "eventmanager_request_operation_seconds",
+    "Time spent per operation (auth, db, scheduler, reminder enqueue) within a request, by route.",
+    ("method", "route", "operation"))
+REQUEST_DB_QUERIES = Histogram("eventmanager_request_db_queries", "Number of database queries per request, by route.",
+                               ("method", "route"), QUERY_COUNT_BUCKETS)
+DB_QUERY_SECONDS = Histogram("eventmanager_db_query_duration_seconds", "Database query latency by database.",
+                             ("database",))
+OPERATION_SECONDS = Histogram("eventmanager_operation_duration_seconds",
+                              "Latency of instrumented operations, in and out of requests (SMTP, scheduler, auth).",
+                              ("operation",))
+REGISTRY = (REQUEST_SECONDS, REQUEST_OPERATION_SECONDS, REQUEST_DB_QUERIES, DB_QUERY_SECONDS, OPERATION_SECONDS)
+# Functions called when the metrics are rendered, for the gauges and counters a subsystem keeps itself, e.g. the
+# SMTP delivery queue. Each returns (name, type, documentation, value) samples.
+_collectors = []
+
+
+def register_collector(collector):
+    """
+    Adds the samples returned by `collector` to every rendering of the metrics.
+    """
+    _collectors.append(collector)
+
+
+def _render_samples(samples):
+    lines = []
+    for name, kind, documentation, value in samples:
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines)
+
+
+class RequestStats:
+    """
+    Time per operation and number of database queries of the current request.
+    """
+
+    def __init__(self, profile=False):
+        self.operations = {}
+        self.db_queries = 0
+        self.profile = profile
+        self.profile_file = None
+
+    def add(self, operation, seconds):
+        self.operations[operation] = self.operations.get(operation, 0.0) + seconds
+
+
+# Stats of the request being handled. The object is shared with the threadpool and run_sync calls of the request.
+_request_stats = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def timed(operation):
+    """
+    Times a block, recorded in OPERATION_SECONDS and in the operations of the current request if there is one.
+
+    Args:
+        operation (str): Operation name, e.g. "auth" or "smtp_send".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        OPERATION_SECONDS.observe((operation,), elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add(operation, elapsed)
+
+
+def instrument_engine(engine, database):
+    """
+    Records the count and time of every query run on an engine.
+
+    Args:
+        engine (Engine): Sync engine, the sync_engine of an AsyncEngine.
+        database (str): Label of the database in DB_QUERY_SECONDS, e.g. "events".
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append((context, time.perf_counter()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info["query_start"].pop()[1]
+        DB_QUERY_SECONDS.observe((database,), elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.add("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute, its start time would be taken for the next query's.
+        # Errors raised outside of the execution, e.g. while fetching, have nothing left on the stack.
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts and starts[-1][0] is context.execution_context:
+            starts.pop()
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    APIRoute that runs its endpoint under cProfile when the request asked for a profile.
+
+    The profiler has to run in the thread of the endpoint, which for sync endpoints is a threadpool thread
+    that the middleware cannot reach.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _profiled(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def profiled_endpoint(*args, **kwargs):
+            stats = _request_stats.get()
+            if stats is None or not stats.profile:
+                return await endpoint(*args, **kwargs)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profiler.disable()
+                stats.profile_file = _dump_profile(profiler, endpoint.__name__)
+    else:
+        @functools.wraps(endpoint)
+        def profiled_endpoint(*args, **kwargs):
+            stats = _request_stats.get()
+            if stats is None or not stats.profile:
+                return endpoint(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(endpoint, *args, **kwargs)
+            finally:
+                stats.profile_file = _dump_profile(profiler, endpoint.__name__)
+    return profiled_endpoint
+
+
+def _dump_profile(profiler, name):
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}-{name}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every request by route template, with the time spent per
+    operation and the number of database queries. Unknown paths are recorded as route "unmatched", so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = PROFILE_DIR is not None and any(name == PROFILE_HEADER.encode() for name, _ in scope["headers"])
+        stats = RequestStats(profile)
+        token = _request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if stats.profile_file:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-file", stats.profile_file.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            REQUEST_SECONDS.observe(labels + (str(status),), elapsed)
+            REQUEST_DB_QUERIES.observe(labels, stats.db_queries)
+            for operation, seconds in stats.operations.items():
+                REQUEST_OPERATION_SECONDS.observe(labels + (operation,), seconds)
+
+
+def render():
+    """
+    Returns:
+        str: All metrics in the Prometheus text exposition format.
+    """
+    parts = [histogram.render() for histogram in REGISTRY]
+    parts += [_render_samples(collector()) for collector in _collectors]
+    return "\n".join(parts) + "\n"
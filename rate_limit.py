@@ -0,0 +1,188 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+# Tokens charged per request by (method, route), the other authenticated routes cost DEFAULT_COST. Lists, filters
+# and scans read many rows of the events database, a get by ID reads one.
+DEFAULT_COST = 1
+ROUTE_COSTS = {
+    ("GET", "/events"): 5,
+    ("GET", "/events/range"): 5,
+    ("GET", "/events/conflicts"): 5,
+    ("GET", "/events/search"): 5,
+    ("GET", "/events/{filter_by}/{filter_value}"): 5,
+    ("GET", "/participants/{email}/events"): 5,
+    ("GET", "/events/upcoming"): 2,
+    ("GET", "/events/export"): 20,
+    ("POST", "/events/bulk"): 20,
+}
+# Paths never shed by the admission middleware: the change feed waits on an asyncio event, not on a thread or the
+# database, and the metrics must stay readable under load
+ADMISSION_EXEMPT_PATHS = frozenset({"/events/changes", "/events/changes/stream", "/metrics", "/metrics/cache"})
+
+
+def route_cost(request):
+    """
+    Returns:
+        int: Tokens charged for a request, from ROUTE_COSTS by the route it matched.
+    """
+    return ROUTE_COSTS.get((request.method, request.scope["route"].path), DEFAULT_COST)
+
+
+def retry_after(seconds):
+    # Retry-After takes whole seconds
+    return str(max(1, math.ceil(seconds)))
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter keyed on username. Each user's bucket holds up to `burst` tokens and refills at
+    `rate` tokens per second, and a request is let through if its bucket has the tokens it costs.
+
+    A bucket is updated in O(1) when charged. Buckets are kept in least recently charged order, and the ones idle
+    long enough to be full again are evicted from the front as other users are charged, since a missing bucket
+    means a full one.
+    """
+
+    def __init__(self, rate=20.0, burst=100.0):
+        """
+        Args:
+            rate (float): Tokens added to a bucket per second, 0 disables the limiter.
+            burst (float): Capacity of a bucket, the largest burst a user can send at once.
+        """
+        self.rate = rate
+        self.burst = burst
+        # username -> [tokens, monotonic time of the last charge]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key, cost=DEFAULT_COST, now=None):
+        """
+        Charges a request to a bucket.
+
+        Args:
+            key (str): Username.
+            cost (float): Tokens the request costs, capped at the burst so any request can eventually go through.
+            now (float): Current time.monotonic(), for tests.
+
+        Returns:
+            float: 0 if the request is let through, otherwise the seconds until the bucket has enough tokens.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        cost = min(cost, self.burst)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict_idle(now)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0.0
+            self.limited += 1
+            return (cost - bucket[0]) / self.rate
+
+    def _evict_idle(self, now):
+        refill_seconds = self.burst / self.rate
+        while self._buckets:
+            key, (tokens, charged_at) = next(iter(self._buckets.items()))
+            if charged_at + refill_seconds > now:
+                break
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Allowed and limited counters and number of tracked users.
+        """
+        with self._lock:
+            return {"allowed": self.allowed, "limited": self.limited, "size": len(self._buckets)}
+
+
+class ConcurrencyLimiter:
+    """
+    Cap on the number of requests in flight. Past the cap, requests are answered at once with 429 and Retry-After
+    instead of queueing for the threadpool and the database, so latency stays bounded for the admitted ones.
+    Only used from the event loop thread, so the counters need no lock.
+    """
+
+    def __init__(self, max_concurrent=64):
+        """
+        Args:
+            max_concurrent (int): Maximum number of requests in flight, 0 disables the cap.
+        """
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        """
+        Returns:
+            bool: True if the request is admitted, it must then call release when done.
+        """
+        if 0 < self.max_concurrent <= self.in_flight:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {"admitted": self.admitted, "rejected": self.rejected, "in_flight": self.in_flight}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware shedding the requests the ConcurrencyLimiter does not admit.
+    """
+
+    def __init__(self, app, limiter, exempt_paths=ADMISSION_EXEMPT_PATHS):
+        """
+        Args:
+            app: The ASGI app.
+            limiter (ConcurrencyLimiter): Limiter shared by the app's requests.
+            exempt_paths (frozenset): Paths that are neither counted nor shed.
+        """
+        self.app = app
+        self.limiter = limiter
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if not self.limiter.try_acquire():
+            await send({"type": "http.response.start", "status": 429,
+                        "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")]})
+            await send({"type": "http.response.body", "body": orjson.dumps({"detail": "Server busy, retry later"})})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+# Limiters shared by the sync and async apps
+rate_limiter = RateLimiter(rate=float(os.environ.get("RATE_LIMIT_RATE", "20")),
+                           burst=float(os.environ.get("RATE_LIMIT_BURST", "100")))
+concurrency_limiter = ConcurrencyLimiter(int(os.environ.get("MAX_CONCURRENT_REQUESTS", "64")))
@@ -0,0 +1,138 @@
+from datetime import timedelta
+from functools import lru_cache
+from itertools import islice, takewhile
+
+from dateutil.rrule import rrulestr
+
+# Frequencies finer than this expand to too many occurrences per query, they are rejected
+UNSUPPORTED_FREQUENCIES = ("SECONDLY", "MINUTELY")
+# A bounded series is walked to its last occurrence when written, up to this many occurrences. Longer ones are
+# stored as unbounded, they are then filtered by their rule instead of by their end date.
+MAX_WALKED_OCCURRENCES = 100000
+# Frequencies whose periods have a fixed length, so a series can be started again whole periods later
+FIXED_PERIODS = {"WEEKLY": timedelta(weeks=1), "DAILY": timedelta(days=1), "HOURLY": timedelta(hours=1)}
+
+
+@lru_cache(maxsize=1024)
+def _rule(rule, dtstart):
+    # Parsed rules are immutable and can be iterated many times, so each series is parsed once
+    return rrulestr(rule, dtstart=dtstart)
+
+
+def _parts(rule):
+    return dict(part.partition("=")[::2] for part in rule.split(";"))
+
+
+@lru_cache(maxsize=1024)
+def _period(rule):
+    # Length of INTERVAL periods of the rule, None if it varies or the rule counts its occurrences from the start
+    parts = _parts(rule)
+    if "COUNT" in parts or parts.get("FREQ") not in FIXED_PERIODS:
+        return None
+    return FIXED_PERIODS[parts["FREQ"]] * int(parts.get("INTERVAL", "1"))
+
+
+@lru_cache(maxsize=1024)
+def _step(rule):
+    # Period between consecutive occurrences of a rule that is only a fixed FREQ and INTERVAL, None otherwise
+    return _period(rule) if _parts(rule).keys() <= {"FREQ", "INTERVAL"} else None
+
+
+def _stepped(dtstart, step, start):
+    # Occurrences every `step` from dtstart, from the first one at or after `start`, without going through dateutil
+    date = dtstart if start <= dtstart else dtstart - (dtstart - start) // step * step
+    while True:
+        yield date
+        date += step
+
+
+def _rule_from(rule, dtstart, start):
+    """
+    Returns the parsed rule, restarted whole periods later if possible so that iterating from `start` does not
+    walk every past occurrence: dateutil always iterates from the start of the series. Moving the start by whole
+    INTERVAL periods keeps the same occurrences for weekly, daily and hourly rules without COUNT.
+    """
+    parsed = _rule(rule, dtstart)
+    period = _period(rule)
+    if period is None or start < dtstart + period:
+        return parsed
+    return parsed.replace(dtstart=dtstart + (start - dtstart) // period * period)
+
+
+def normalize_rule(rule, dtstart):
+    """
+    Validates the RRULE of a series and returns it as stored.
+
+    Args:
+        rule (str): RFC 5545 recurrence rule, with or without the "RRULE:" prefix, e.g. "FREQ=WEEKLY;BYDAY=MO".
+        dtstart (datetime): Date of the first occurrence, the event's date.
+
+    Returns:
+        tuple: The rule without prefix and in upper case, and the date of the last occurrence, None if the series
+            has no COUNT or UNTIL or is longer than MAX_WALKED_OCCURRENCES.
+
+    Raises:
+        ValueError: If the rule is not a single valid RRULE, repeats more often than hourly, or has an INTERVAL or
+            COUNT that is not a positive integer.
+    """
+    rule = rule.strip().upper()
+    if rule.startswith("RRULE:"):
+        rule = rule[len("RRULE:"):]
+    if not rule or ":" in rule or "\n" in rule:
+        raise ValueError("recurrence must be a single RRULE, e.g. FREQ=WEEKLY;BYDAY=MO")
+    parts = _parts(rule)
+    if "FREQ" not in parts:
+        raise ValueError("recurrence must have a FREQ, e.g. FREQ=WEEKLY;BYDAY=MO")
+    if parts["FREQ"] in UNSUPPORTED_FREQUENCIES:
+        raise ValueError("recurrence must not repeat more often than hourly")
+    for part in ("INTERVAL", "COUNT"):
+        # Checked before parsing, dateutil accepts 0 and negative values that expand to nothing or backwards
+        if part in parts and not (parts[part].isdigit() and int(parts[part]) >= 1):
+            raise ValueError(f"recurrence {part} must be a positive integer")
+    parsed = _rule(rule, dtstart)
+    if "COUNT" not in parts and "UNTIL" not in parts:
+        return rule, None
+    walked, last = 0, None
+    for walked, last in enumerate(islice(parsed, MAX_WALKED_OCCURRENCES + 1), 1):
+        pass
+    return rule, last if walked <= MAX_WALKED_OCCURRENCES else None
+
+
+def occurrences(rule, dtstart, start, end=None, exceptions=()):
+    """
+    Lazily yields the occurrences of a series from `start`, inclusive, to `end`, exclusive, skipping the cancelled
+    ones. Without `end` an unbounded series never ends, so callers take only what they need.
+
+    Args:
+        rule (str): Normalized RRULE, see normalize_rule.
+        dtstart (datetime): Date of the first occurrence.
+        start (datetime): Earliest occurrence.
+        end (datetime): Occurrences at or after it are not yielded, None for no limit.
+        exceptions: Dates of the cancelled occurrences.
+
+    Yields:
+        datetime: Occurrence dates, in order.
+    """
+    step = _step(rule)
+    dates = _stepped(dtstart, step, start) if step else _rule_from(rule, dtstart, start).xafter(start, inc=True)
+    if end is not None:
+        dates = takewhile(lambda date: date < end, dates)
+    cancelled = set(exceptions)
+    return (date for date in dates if date not in cancelled)
+
+
+def next_occurrence(rule, dtstart, after, exceptions=()):
+    """
+    Returns:
+        datetime: The first occurrence strictly after `after` that is not cancelled, None if the series is over.
+    """
+    cancelled = set(exceptions)
+    return next((date for date in _rule_from(rule, dtstart, after).xafter(after) if date not in cancelled), None)
+
+
+def is_occurrence(rule, dtstart, date):
+    """
+    Returns:
+        bool: True if the series has an occurrence at `date`.
+    """
+    return next(_rule_from(rule, dtstart, date).xafter(date, inc=True), None) == date
@@ -0,0 +1,144 @@
+import json
+import time
+from datetime import datetime, timedelta
+from string import Template
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import events_db_manager
+
+# Message templates, compiled once at import
+INVITATION_TEMPLATE = Template("You are invited to the event $title"
+                               "\n Description: $description"
+                               "\n Location $location"
+                               "\n Invited: $invited"
+                               "\n On the date $date")
+DIGEST_TEMPLATE = Template("You have $count upcoming events:\n\n$events")
+DIGEST_EVENT_TEMPLATE = Template("$title"
+                                 "\n Description: $description"
+                                 "\n Location $location"
+                                 "\n On the date $date")
+# Ledger rows of events older than this are deleted, their reminders can no longer be due
+LEDGER_RETENTION = timedelta(days=1)
+# A claimed reminder is claimed again after this long if its dispatcher did not finish it, e.g. because it died
+CLAIM_SECONDS = 60
+
+
+def event_fields(event, occurrence=None):
+    """
+    Copies the fields used by the templates out of an event, so the event's session can be closed before the
+    reminder is sent.
+
+    Args:
+        event: Event object with its participants loaded.
+        occurrence (datetime): Date of one occurrence of a recurring event, instead of the event's date.
+
+    Returns:
+        dict: Template fields, plus the event's id and raw date for the ledger, so each occurrence of a
+            series is recorded on its own.
+    """
+    participants = [participant.email for participant in event.participants]
+    date = occurrence or event.date
+    return {"id": event.id, "event_date": date, "title": event.title, "description": event.description,
+            "location": event.location, "date": date, "invited": ", ".join(participants)}
+
+
+def render_invitation(fields):
+    return INVITATION_TEMPLATE.substitute(fields)
+
+
+def render_reminder(events):
+    """
+    Renders the message of one recipient: the single event's invitation, or a digest of all its events.
+
+    Args:
+        events (list): Fields of the events, see event_fields.
+
+    Returns:
+        str: The message.
+    """
+    if len(events) == 1:
+        return render_invitation(events[0])
+    ordered = sorted(events, key=lambda fields: fields["event_date"])
+    body = "\n\n".join(DIGEST_EVENT_TEMPLATE.substitute(fields) for fields in ordered)
+    return DIGEST_TEMPLATE.substitute(count=len(events), events=body)
+
+
+def record_reminders(engine, fields, recipients, now=None):
+    """
+    Records a due reminder in the sent_reminders ledger for each recipient, to be sent by claim_reminders.
+    A reminder already recorded, e.g. fired twice by two leaders while the lease changes hands, is not recorded
+    again, so it is sent once.
+
+    Args:
+        engine (Engine): Engine of the events database.
+        fields (dict): Fields of the event, see event_fields.
+        recipients (list): Participant emails.
+        now (float): Current Unix time, defaults to time.time().
+
+    Returns:
+        int: Number of recorded reminders.
+    """
+    if not recipients:
+        return 0
+    ledger = events_db_manager.SentReminder
+    now = time.time() if now is None else now
+    stored = json.dumps(fields, default=str)
+    rows = [{"event_id": fields["id"], "email": email, "event_date": fields["event_date"], "fields": stored,
+             "available_at": now, "attempts": 0} for email in recipients]
+    with engine.begin() as connection:
+        return connection.execute(sqlite_insert(ledger).values(rows).on_conflict_do_nothing()).rowcount
+
+
+def claim_reminders(engine, window, now=None):
+    """
+    Claims the reminders of the ledger that are due, once the digest window is over: the earliest reminder not
+    sent yet opens it. The window is kept in the ledger, so it survives a change of leader.
+
+    Claiming pushes the reminders' available_at CLAIM_SECONDS ahead, so a reminder whose dispatcher died before
+    finishing it is claimed again.
+
+    Args:
+        engine (Engine): Engine of the events database.
+        window (float): Seconds the digest window stays open, 0 claims due reminders immediately.
+        now (float): Current Unix time, defaults to time.time().
+
+    Returns:
+        dict: Fields of the claimed events (list) by recipient email, each with the number of attempts so far.
+    """
+    ledger = events_db_manager.SentReminder
+    now = time.time() if now is None else now
+    with engine.begin() as connection:
+        opened_at = connection.scalar(select(func.min(ledger.available_at)))
+        if opened_at is None or opened_at + window > now:
+            return {}
+        rows = connection.execute(
+            update(ledger).where(ledger.available_at <= now)
+            .values(available_at=now + CLAIM_SECONDS, attempts=ledger.attempts + 1)
+            .returning(ledger.event_id, ledger.email, ledger.event_date, ledger.fields, ledger.attempts)).all()
+        connection.execute(delete(ledger).where(
+            ledger.event_date < datetime.fromtimestamp(now) - LEDGER_RETENTION))
+    result = {}
+    for row in rows:
+        fields = json.loads(row.fields)
+        fields.update(event_date=row.event_date, attempts=row.attempts)
+        result.setdefault(row.email, []).append(fields)
+    return result
+
+
+def finish_reminders(engine, email, events, retry_at=None):
+    """
+    Marks claimed reminders of a recipient as sent, or makes them claimable again if their email failed.
+
+    Args:
+        engine (Engine): Engine of the events database.
+        email (str): Recipient email.
+        events (list): Fields of the claimed events, see claim_reminders.
+        retry_at (float): Unix time from which to retry, None if the email was sent.
+    """
+    ledger = events_db_manager.SentReminder
+    keys = [(fields["id"], email, fields["event_date"]) for fields in events]
+    with engine.begin() as connection:
+        connection.execute(update(ledger).where(tuple_(ledger.event_id, ledger.email, ledger.event_date).in_(keys))
+                           .values(available_at=retry_at))
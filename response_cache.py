@@ -0,0 +1,183 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+# A rendered JSON body and its ETag
+CachedResponse = namedtuple("CachedResponse", ["body", "etag"])
+
+
+class ResponseCache:
+    """
+    TTL/LRU read-through cache of rendered GET responses, keyed on endpoint plus query parameters.
+
+    Single-event entries are dropped by key when the event changes. Every write also bumps a generation counter
+    that is part of the list keys, so all cached pages go stale at once without having to find them. The cache is
+    per process, so with several workers the routes also validate it against the last change log entry, which
+    every worker writes: see validate.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        """
+        Args:
+            maxsize (int): Maximum number of cached responses, the least recently used one is evicted first.
+            ttl (float): Seconds a response stays in the cache.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        # Version of the data the entries were cached from, see validate
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Args:
+            key (tuple): Cache key, see event_key and events_page_key.
+
+        Returns:
+            CachedResponse: The cached response, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def set(self, key, body, generation):
+        """
+        Caches a rendered response.
+
+        Args:
+            key (tuple): Cache key.
+            body (bytes): JSON body, see render.
+            generation (int): Value of `generation` read before the database was queried. If a write happened since,
+                the body may already be stale and is returned without being cached.
+
+        Returns:
+            CachedResponse: The response with its ETag.
+        """
+        cached = CachedResponse(body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"')
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = (cached, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def validate(self, version):
+        """
+        Drops every entry and bumps the generation if the data changed since the entries were cached, possibly in
+        another worker. Call it before `generation` is read.
+
+        Args:
+            version (int): Current version of the data, the sequence number of the last change log entry.
+        """
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self.generation += 1
+                self._entries.clear()
+
+    def invalidate(self, *keys):
+        """
+        Drops the given entries and bumps the generation, which invalidates every cached list page.
+
+        Args:
+            *keys (tuple): Keys of the single-event entries affected by the write.
+        """
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters, hit ratio, number of cached responses and current generation.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "generation": self.generation,
+            }
+
+
+def event_key(event_id):
+    """
+    Returns the cache key of GET /events/{event_id}.
+    """
+    return ("event", event_id)
+
+
+def events_page_key(generation, sort_by, limit, after, fields):
+    """
+    Returns the cache key of a GET /events page, it changes with every write.
+    """
+    return ("events", generation, sort_by, limit, after, fields)
+
+
+@lru_cache(maxsize=None)
+def _type_adapter(response_model):
+    return TypeAdapter(response_model)
+
+
+def render(response_model, content):
+    """
+    Renders a manager function result to JSON bytes through its response model, like FastAPI does for the
+    response_model of a route, so cached and uncached responses are identical.
+
+    Args:
+        response_model: Pydantic model or type of the response, e.g. schemas.EventsPageOut.
+        content: Value returned by the manager function, ORM objects are read from their attributes.
+
+    Returns:
+        bytes: The JSON body.
+    """
+    adapter = _type_adapter(response_model)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+def etag_matches(cached, if_none_match):
+    """
+    Checks an If-None-Match request header against the ETag of a cached response.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or cached.etag in tags
+
+
+def to_response(cached, if_none_match=None):
+    """
+    Returns a 304 Not Modified if the client already has this response, the cached body otherwise.
+    """
+    if etag_matches(cached, if_none_match):
+        return Response(status_code=304, headers={"ETag": cached.etag})
+    return Response(cached.body, media_type="application/json", headers={"ETag": cached.etag})
+
+
+# Cache shared by the sync and async apps
+response_cache = ResponseCache(maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "1024")),
+                               ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "30")))
@@ -0,0 +1,162 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+class EventCreate(BaseModel):
+    """
+    Pydantic model of one event in the body of POST /events/bulk.
+    """
+    title: str
+    description: Optional[str] = None
+    date: datetime
+    location: str
+    participants: List[str]
+    # RRULE of a recurring event, e.g. "FREQ=WEEKLY;BYDAY=MO"
+    recurrence: Optional[str] = None
+    # End of the event, defaults to an hour after its date
+    end: Optional[datetime] = None
+
+
+class MessageOut(BaseModel):
+    """
+    Response of the endpoints that only return a message, e.g. "Event not found".
+    """
+    message: str
+
+
+class EventOut(BaseModel):
+    """
+    Pydantic model of an event in responses, read from the attributes of an events_db_manager.Event.
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    description: Optional[str] = None
+    date: datetime
+    location: str
+    participants: List[str] = []
+    # RRULE of a recurring event. Range queries return each occurrence with its own date.
+    recurrence: Optional[str] = None
+    end: Optional[datetime] = None
+
+    @field_validator("participants", mode="before")
+    @classmethod
+    def participant_emails(cls, participants):
+        # EventParticipant rows are returned as their email, like the fields projection and the export do
+        return [getattr(participant, "email", participant) for participant in participants]
+
+
+class EventSlotOut(BaseModel):
+    """
+    An event, or one occurrence of a recurring event, in a conflict.
+    """
+    id: Optional[int] = None
+    title: str
+    date: datetime
+    end: datetime
+    location: str
+
+
+class ConflictOut(BaseModel):
+    """
+    Two overlapping events at the same location or with participants in common. For an event checked when it is
+    written, `first` is that event, with the ID it was written with even if "reject" then rolled it back, and
+    `second` the existing one.
+    """
+    first: EventSlotOut
+    second: EventSlotOut
+    same_location: bool
+    participants: List[str]
+
+
+class ConflictsOut(BaseModel):
+    """
+    Response of GET /events/conflicts.
+    """
+    conflicts: List[ConflictOut]
+
+
+class EventMessageOut(BaseModel):
+    """
+    Response of POST /events and PUT /events/{event_id}. With conflicts=flag, the conflicts found.
+    """
+    message: str
+    event: EventOut
+    conflicts: Optional[List[ConflictOut]] = None
+
+
+class EventsPageOut(BaseModel):
+    """
+    Response of GET /events and GET /events/range.
+    """
+    events: List[EventOut]
+    next_cursor: Optional[str] = None
+
+
+class EventsProjectionOut(BaseModel):
+    """
+    Response of GET /events with `fields`, events only have the requested fields.
+    """
+    events: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+
+class ChangeOut(BaseModel):
+    """
+    One entry of the change log, with the current state of its event, None once the event is deleted.
+    """
+    seq: int
+    event_id: int
+    action: str
+    changed_at: datetime
+    event: Optional[EventOut] = None
+
+
+class ChangesOut(BaseModel):
+    """
+    Response of GET /events/changes. Pass last_seq as `since` to get the next changes.
+    """
+    changes: List[ChangeOut]
+    last_seq: int
+
+
+class BulkResultOut(BaseModel):
+    """
+    Result of one row of POST /events/bulk, with the new event ID or the validation errors.
+    """
+    index: int
+    status: str
+    id: Optional[int] = None
+    errors: Optional[List[str]] = None
+
+
+class BulkCreateOut(BaseModel):
+    """
+    Response of POST /events/bulk.
+    """
+    message: str
+    created: int
+    failed: int
+    results: List[BulkResultOut]
+
+
+class UserOut(BaseModel):
+    """
+    Pydantic model of a user in responses. The password hash is never part of it.
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    username: str
+    email: str
+
+
+class UserMessageOut(BaseModel):
+    """
+    Response of POST /users.
+    """
+    message: str
+    user: UserOut
@@ -1,9 +1,23 @@
-from fastapi import Body, Path
-from sqlalchemy import Column, Integer, String
+import hashlib
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Body, Path, HTTPException
+from sqlalchemy import Column, Integer, String, event, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, declarative_base
 
+from auth_cache import credential_cache
+
 Base = declarative_base()
 
+DATABASE_URL = "sqlite:///users.db"
+
+# PBKDF2 work factor for new password hashes, stored hashes keep the count they were created with
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", "600000"))
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256"
+
 
 class User(Base):
     """
@@ -11,30 +25,83 @@ class User(Base):
     """
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
-    username = Column(String, nullable=False)
+    username = Column(String, nullable=False, unique=True, index=True)
     password = Column(String)
     email = Column(String)
 
 
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_credentials(mapper, connection, target):
+    """
+    Drops cached credentials whenever a user row is created, changed or deleted.
+    """
+    credential_cache.invalidate(target.username)
+
+
+def hash_password(password):
+    """
+    Hashes a password with PBKDF2-SHA256 and a random salt.
+
+    Args:
+        password (str): Plain text password.
+
+    Returns:
+        str: Hash in the format "pbkdf2_sha256$<iterations>$<salt>$<hash>".
+    """
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_PREFIX}${PASSWORD_HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, password_hash):
+    """
+    Checks a password against a hash created by hash_password.
+
+    Args:
+        password (str): Plain text password.
+        password_hash (str): Stored hash.
+
+    Returns:
+        bool: True if the password matches, False otherwise.
+    """
+    try:
+        prefix, iterations, salt, digest = password_hash.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if prefix != PASSWORD_HASH_PREFIX:
+        return False
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
 def create_user(username: str = Body(...),
                 password: str = Body(...),
                 email: str = Body(...),
-                db: Session = None):
+                db: Session = None,
+                password_hash: Optional[str] = None):
     """
-    Creates a new user and saves it to the database.
+    Creates a new user and saves it to the database. The password is stored hashed.
 
     Args:
         username (str): Username of the user.
         password (str): Password of the user.
         email (str): Email of the user.
         db (Session): Database session.
+        password_hash (Optional[str]): Hash of the password from hash_password, computed by the caller, e.g. off
+            the event loop. The password is hashed here if None.
 
     Returns:
         dict: Message indicating success or failure of user creation along with user details.
     """
-    new_user = User(username=username, password=password, email=email)
+    new_user = User(username=username, password=password_hash or hash_password(password), email=email)
     db.add(new_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Username {username} already exists")
     db.refresh(new_user)
     return {"message": "Username created successfully!", "user": new_user}
 
@@ -70,3 +137,31 @@ def get_user_by_username(username: str = Path(..., description="username"),
     if user is None:
         return {"message": "Event not found"}
     return user
+
+
+def migrate_users(bind):
+    """
+    Adds the unique index on users.username and hashes passwords still stored in plain text.
+    Safe to run repeatedly.
+
+    Args:
+        bind: Engine of the users database.
+
+    Returns:
+        int: Number of passwords that were hashed.
+    """
+    Base.metadata.create_all(bind)
+    with Session(bind) as db:
+        duplicates = [username for (username,) in db.query(User.username)
+                      .group_by(User.username).having(func.count(User.id) > 1)]
+        if duplicates:
+            raise RuntimeError(f"Cannot add unique index on users.username, duplicated usernames: {duplicates}")
+
+        plain_text_users = db.query(User).filter(User.password.notlike(f"{PASSWORD_HASH_PREFIX}$%")).all()
+        for user in plain_text_users:
+            user.password = hash_password(user.password)
+        db.commit()
+
+    for index in User.__table__.indexes:
+        index.create(bind, checkfirst=True)
+    return len(plain_text_users)